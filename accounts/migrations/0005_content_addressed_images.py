@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:58
+
+import products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_model_restructure'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='vendor',
+            name='logo',
+            field=models.ImageField(blank=True, null=True, storage=products.storage.get_content_storage, upload_to=''),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
 
+from products.storage import get_content_storage
+
 class Customer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='customer')
     phone = models.CharField(max_length=20, blank=True, null=True)
@@ -13,7 +15,7 @@ class Vendor(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='vendor')
     shop_name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
-    logo = models.ImageField(upload_to='vendor/logos/', blank=True, null=True)
+    logo = models.ImageField(storage=get_content_storage, blank=True, null=True)
     
     phone = models.CharField(max_length=20, blank=True, null=True)
     address = models.CharField(max_length=255, blank=True, null=True)
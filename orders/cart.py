@@ -0,0 +1,160 @@
+"""
+Session-backed shopping cart.
+
+The cart lives in the session as ``{product_id: {'quantity': n, 'price': '9.99'}}``
+so reading it never touches the orders tables and anonymous visitors can shop.
+The stored price only feeds the navbar badge (``summary``); it is the price
+when the product was added, refreshed whenever the cart's lines are loaded
+(cart page, checkout). A price change therefore shows on the badge after
+the customer's next cart or checkout page; orders are always priced from
+the products.
+It only becomes an Order at checkout. When a customer logs out their cart is
+parked in a SavedCart row, and it is merged back into the session cart the
+next time they log in.
+"""
+from decimal import Decimal
+
+from django.utils.crypto import salted_hmac
+
+from products.inventory import with_available_stock
+from products.models import Product
+
+CART_SESSION_KEY = 'cart'
+
+
+class CartLine:
+    """A cart entry joined with its current Product row."""
+
+    def __init__(self, product, quantity, price):
+        self.product = product
+        self.quantity = quantity
+        self.price = price
+
+    @property
+    def total_price(self):
+        return self.price * self.quantity
+
+
+class Cart:
+    def __init__(self, request):
+        self.session = request.session
+        self.data = self.session.get(CART_SESSION_KEY, {})
+
+    def __len__(self):
+        """Number of distinct products in the cart."""
+        return len(self.data)
+
+    @property
+    def holder(self):
+        """
+        Key under which this cart's stock holds are recorded: a keyed hash
+        of the session key, so the holds table never stores a live session
+        key. None until the session has been saved.
+        """
+        session_key = self.session.session_key
+        if not session_key:
+            return None
+        return salted_hmac('orders.cart.holder', session_key, algorithm='sha256').hexdigest()
+
+    def __contains__(self, product_id):
+        return str(product_id) in self.data
+
+    def quantity(self, product_id):
+        return self.data.get(str(product_id), {}).get('quantity', 0)
+
+    def quantities(self):
+        """Return {product_id: quantity} for every line."""
+        return {int(pk): line['quantity'] for pk, line in self.data.items()}
+
+    def add(self, product, quantity=1, limit=None):
+        """Add ``quantity`` of ``product``, capping the line at ``limit`` if given."""
+        quantity = self.quantity(product.pk) + quantity
+        if limit is not None:
+            quantity = min(quantity, limit)
+        self.data[str(product.pk)] = {'quantity': quantity, 'price': str(product.price)}
+        self.save()
+
+    def set_quantity(self, product_id, quantity):
+        if str(product_id) not in self.data:
+            return
+        if quantity <= 0:
+            self.remove(product_id)
+            return
+        self.data[str(product_id)]['quantity'] = quantity
+        self.save()
+
+    def remove(self, product_id):
+        if self.data.pop(str(product_id), None) is not None:
+            self.save()
+
+    def merge(self, items):
+        """
+        Merge another cart's ``{product_id: {'quantity', 'price'}}`` into
+        this one, capping each merged line at the stock available to this
+        cart. A line with nothing available keeps its quantity, so cart
+        validation can tell the customer it is out of stock.
+        """
+        available = dict(with_available_stock(
+            Product.objects.filter(pk__in=[int(pk) for pk in items]),
+            exclude_holder=self.holder
+        ).values_list('pk', 'available'))
+        for pk, line in items.items():
+            current = self.data.get(str(pk))
+            if current:
+                current['quantity'] += line['quantity']
+            else:
+                current = self.data[str(pk)] = dict(line)
+            if available.get(int(pk), 0) > 0:
+                current['quantity'] = min(current['quantity'], available[int(pk)])
+        self.save()
+
+    def clear(self):
+        self.data = {}
+        self.session.pop(CART_SESSION_KEY, None)
+
+    def save(self):
+        self.session[CART_SESSION_KEY] = self.data
+        self.session.modified = True
+
+    def summary(self):
+        """
+        Line count and total from the session alone (no database access),
+        at the prices stored when the lines were last loaded.
+        """
+        total = sum(
+            (Decimal(line['price']) * line['quantity'] for line in self.data.values()),
+            Decimal('0')
+        )
+        return {'count': len(self.data), 'total': f'{total:.2f}'}
+
+    def lines(self):
+        """
+        Return CartLine objects priced from the current products, loaded in
+        one query. Each product is annotated with the stock ``available`` to
+        this cart, i.e. not held by other checkouts. Products that no longer
+        exist are dropped from the cart, and the stored prices the summary
+        reads are brought up to date.
+        """
+        products = with_available_stock(
+            Product.objects.filter(pk__in=self.quantities()),
+            exclude_holder=self.holder
+        ).select_related('vendor', 'category').in_bulk()
+        lines = []
+        changed = False
+        for pk, quantity in self.quantities().items():
+            product = products.get(pk)
+            if product is None:
+                self.remove(pk)
+                continue
+            line = self.data[str(pk)]
+            if line.get('price') != str(product.price):
+                line['price'] = str(product.price)
+                changed = True
+            lines.append(CartLine(product, quantity, product.price))
+        if changed:
+            self.save()
+        return lines
+
+    @staticmethod
+    def total(lines):
+        return sum((line.total_price for line in lines), Decimal('0'))
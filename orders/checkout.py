@@ -0,0 +1,189 @@
+"""
+Two-phase checkout.
+
+1. ``begin_payment`` turns the session cart into an order awaiting
+   payment and reserves its stock in one short transaction.
+2. The view charges the payment provider with no transaction open, so a
+   slow provider never holds row locks or a database connection hostage.
+3. ``confirm_payment`` or ``release_payment`` settles the order in a
+   second short transaction, either straight from the view or from the
+   provider's webhook. Both are idempotent.
+
+A charge can still succeed after its order was released (the provider
+answered after release_stale_payments gave up on it). The stock is gone
+by then, so ``confirm_payment`` records the charge on the cancelled order
+and flags it as a late charge, then refunds it. If the refund fails, the
+order stays cancelled and flagged; ``refund_late_charges`` retries those.
+Orders cancelled for any other reason are never refunded from here.
+
+The order is split into one VendorOrder per vendor when it is created (see
+orders.fulfillment); settling the payment moves every part with it.
+"""
+import logging
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+
+from products.inventory import reserve_stock, release_stock
+from .fulfillment import split_order
+from .models import Order, OrderItem, VendorOrder
+from .payments import get_gateway
+from .signals import order_status_changed
+
+logger = logging.getLogger(__name__)
+
+
+class CheckoutInProgress(Exception):
+    """The customer already has an order awaiting payment."""
+
+
+def order_quantities(order):
+    """Return {product_id: quantity} for every line of an order."""
+    return dict(order.items.values_list('product_id', 'quantity'))
+
+
+def begin_payment(customer, lines, delivery_address, phone, holder=None):
+    """
+    Phase 1: create an AWAITING_PAYMENT order from cart ``lines`` (see
+    orders.cart.CartLine) and reserve their stock, converting the stock
+    holds placed for ``holder`` at checkout into the reservation. Raises
+    CheckoutInProgress if another payment of this customer is still open
+    and InsufficientStock if any line is short.
+    """
+    with transaction.atomic():
+        # Serialise a customer's checkouts so a double submit makes one order
+        get_user_model().objects.select_for_update().values_list('pk').get(pk=customer.pk)
+        if Order.objects.filter(customer=customer, status=Order.Status.AWAITING_PAYMENT).exists():
+            raise CheckoutInProgress()
+        reserve_stock({line.product.pk: line.quantity for line in lines}, holder=holder)
+        order = Order.objects.create(
+            customer=customer,
+            total=sum(line.total_price for line in lines),
+            status=Order.Status.AWAITING_PAYMENT,
+            delivery_address=delivery_address,
+            phone=phone
+        )
+        # The total is set above, so the per-item delta updates are not needed
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=line.product,
+                vendor_id=line.product.vendor_id,
+                quantity=line.quantity,
+                price=line.price
+            )
+            for line in lines
+        ])
+        split_order(order, lines)
+    return order
+
+
+def confirm_payment(order_id, transaction_id):
+    """
+    Phase 3 (success): mark an awaiting order as paid. Returns True if it
+    changed. A charge for an order that was already released is refunded.
+    """
+    late = False
+    with transaction.atomic():
+        updated = Order.objects.filter(
+            pk=order_id,
+            status=Order.Status.AWAITING_PAYMENT
+        ).update(
+            status=Order.Status.PROCESSING,
+            transaction_id=transaction_id,
+            updated_at=timezone.now()
+        )
+        if updated:
+            VendorOrder.objects.filter(
+                order_id=order_id,
+                status=Order.Status.AWAITING_PAYMENT
+            ).update(status=Order.Status.PROCESSING, updated_at=timezone.now())
+            order_status_changed.send(sender=Order, order_ids=[order_id])
+        else:
+            # Only the first report of a late charge is recorded, so a
+            # repeated webhook cannot start a second refund
+            late = Order.objects.filter(
+                pk=order_id,
+                status=Order.Status.CANCELLED,
+                transaction_id=''
+            ).update(
+                transaction_id=transaction_id,
+                late_charge=True,
+                updated_at=timezone.now()
+            )
+    if late:
+        logger.warning('Charge %s arrived after order %s was released', transaction_id, order_id)
+        refund_late_charge(order_id, transaction_id)
+    return bool(updated)
+
+
+def refund_late_charge(order_id, transaction_id):
+    """
+    Refund the charge of a released order, outside any transaction, and
+    mark the order refunded. Returns True if the refund went through;
+    otherwise the order is left for ``refund_late_charges``.
+    """
+    try:
+        get_gateway().refund(transaction_id, idempotency_key=f'refund-order-{order_id}')
+    except Exception:
+        logger.exception('Refund of late charge %s for order %s failed', transaction_id, order_id)
+        return False
+    with transaction.atomic():
+        refunded = Order.objects.filter(
+            pk=order_id,
+            status=Order.Status.CANCELLED,
+            late_charge=True
+        ).update(
+            status=Order.Status.REFUNDED,
+            updated_at=timezone.now()
+        )
+        if refunded:
+            VendorOrder.objects.filter(order_id=order_id).update(
+                status=Order.Status.REFUNDED,
+                updated_at=timezone.now()
+            )
+    return True
+
+
+def refund_late_charges():
+    """Retry the refunds of late charges that are still owed. Returns the number refunded."""
+    charged = Order.objects.filter(
+        status=Order.Status.CANCELLED,
+        late_charge=True
+    ).values_list('pk', 'transaction_id')
+    return sum(refund_late_charge(pk, transaction_id) for pk, transaction_id in list(charged))
+
+
+def release_payment(order_id):
+    """
+    Phase 3 (failure): return the reserved stock and cancel the order.
+    The customer's cart is still in their session. Returns True if the
+    order was released.
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(
+            pk=order_id,
+            status=Order.Status.AWAITING_PAYMENT
+        ).first()
+        if order is None:
+            return False
+        release_stock(order_quantities(order))
+        order.status = Order.Status.CANCELLED
+        order.save(update_fields=['status', 'updated_at'])
+        VendorOrder.objects.filter(order_id=order_id).update(
+            status=Order.Status.CANCELLED,
+            updated_at=timezone.now()
+        )
+    return True
+
+
+def release_stale_payments(older_than=timedelta(minutes=30)):
+    """Release orders whose payment outcome never arrived. Returns the count."""
+    cutoff = timezone.now() - older_than
+    stale = Order.objects.filter(
+        status=Order.Status.AWAITING_PAYMENT,
+        updated_at__lt=cutoff
+    ).values_list('pk', flat=True)
+    return sum(release_payment(pk) for pk in list(stale))
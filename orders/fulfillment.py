@@ -0,0 +1,182 @@
+"""
+Per-vendor fulfillment.
+
+Checkout splits an order into one VendorOrder per vendor in the cart, each
+with its own subtotal and status. A vendor reads and moves only its own
+record, so vendor pages never filter the customer's whole order, and a
+vendor's revenue is its subtotal rather than the order total.
+
+The customer-facing Order.status is derived from its parts (see
+``combined_status``): the order is as far along as its slowest vendor.
+``set_status`` updates one part and the order's status together, holding
+the order's row lock only for that short transaction.
+
+Vendors go through ``vendor_set_status``. Payment states belong to
+checkout, so a vendor can only move a paid part between the
+VENDOR_STATUSES, or cancel it before it ships. A cancel returns the
+part's stock and refunds its subtotal (see ``cancel_part``).
+"""
+import logging
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from products.inventory import release_stock
+from .models import Order, OrderItem, VendorOrder
+from .payments import get_gateway
+from .signals import order_status_changed
+
+logger = logging.getLogger(__name__)
+
+# Open statuses from the earliest to the last
+PROGRESS = [
+    Order.Status.PENDING,
+    Order.Status.AWAITING_PAYMENT,
+    Order.Status.PROCESSING,
+    Order.Status.SHIPPED,
+    Order.Status.DELIVERED,
+]
+
+# What a vendor may set on a paid part, in either direction
+VENDOR_STATUSES = [
+    Order.Status.PROCESSING,
+    Order.Status.SHIPPED,
+    Order.Status.DELIVERED,
+]
+
+
+class InvalidTransition(ValueError):
+    """A vendor asked for a status change that is not allowed."""
+
+
+def split_order(order, lines):
+    """
+    Create ``order``'s VendorOrders from cart ``lines`` (see
+    orders.cart.CartLine) with one bulk insert. Returns them.
+    """
+    subtotals = defaultdict(int)
+    for line in lines:
+        subtotals[line.product.vendor_id] += line.total_price
+    return VendorOrder.objects.bulk_create([
+        VendorOrder(
+            order=order,
+            vendor_id=vendor_id,
+            subtotal=subtotal,
+            status=order.status,
+            created_at=order.created_at
+        )
+        for vendor_id, subtotal in subtotals.items()
+    ])
+
+
+def combined_status(statuses):
+    """
+    The order status for its parts' ``statuses``: the earliest open
+    status, or, when every part is closed, cancelled if all are cancelled
+    and refunded otherwise. None for an order without parts.
+    """
+    statuses = set(statuses)
+    if len(statuses) <= 1:
+        return next(iter(statuses), None)
+    for status in PROGRESS:
+        if status in statuses:
+            return status
+    return Order.Status.REFUNDED
+
+
+def set_status(vendor_order, status, allowed_from=None):
+    """
+    Move a vendor's part of an order to ``status`` and bring the order's
+    status in line. Returns True if the order's status changed. With
+    ``allowed_from``, raises InvalidTransition unless the part is in one
+    of those statuses, checked under the order's lock.
+    """
+    with transaction.atomic():
+        # Serialise the parts of one order, so two vendors updating at
+        # once both see each other's status
+        order = Order.objects.select_for_update().only('status').get(pk=vendor_order.order_id)
+        if allowed_from is not None:
+            current = VendorOrder.objects.values_list('status', flat=True).get(pk=vendor_order.pk)
+            if current not in allowed_from:
+                raise InvalidTransition(current)
+        vendor_order.status = status
+        vendor_order.save(update_fields=['status', 'updated_at'])
+        order_status = combined_status(
+            VendorOrder.objects.filter(order_id=order.pk).values_list('status', flat=True)
+        )
+        if order_status is None or order_status == order.status:
+            return False
+        Order.objects.filter(pk=order.pk).update(status=order_status, updated_at=timezone.now())
+        order_status_changed.send(sender=Order, order_ids=[order.pk])
+    return True
+
+
+def vendor_set_status(vendor_order, status):
+    """
+    Apply a status change asked for by the part's vendor. Raises
+    InvalidTransition for anything but a move between VENDOR_STATUSES or
+    a cancel (see ``cancel_part``).
+    """
+    if status == Order.Status.CANCELLED:
+        return cancel_part(vendor_order)
+    if status not in VENDOR_STATUSES:
+        raise InvalidTransition(status)
+    return set_status(vendor_order, status, allowed_from=VENDOR_STATUSES)
+
+
+def cancel_part(vendor_order):
+    """
+    Cancel a paid part that has not shipped: return its stock and mark it
+    cancelled in one transaction, then refund its subtotal. The part
+    becomes refunded once the refund goes through; until then it stays
+    cancelled and ``refund_cancelled_parts`` retries it. Calling this again
+    on such a part retries the refund. Returns True if it was refunded.
+    """
+    if vendor_order.status != Order.Status.CANCELLED:
+        with transaction.atomic():
+            set_status(vendor_order, Order.Status.CANCELLED, allowed_from=[Order.Status.PROCESSING])
+            release_stock(dict(OrderItem.objects.filter(
+                order_id=vendor_order.order_id,
+                vendor_id=vendor_order.vendor_id
+            ).values_list('product_id', 'quantity')))
+    elif not _refund_due().filter(pk=vendor_order.pk).exists():
+        raise InvalidTransition(vendor_order.status)
+    return refund_part(vendor_order)
+
+
+def _refund_due():
+    # Cancelled parts of paid orders; a late charge is refunded whole by
+    # orders.checkout instead
+    return VendorOrder.objects.filter(
+        status=Order.Status.CANCELLED,
+        order__late_charge=False
+    ).exclude(order__transaction_id='')
+
+
+def refund_part(vendor_order):
+    """
+    Refund a cancelled part's subtotal, outside any transaction, and mark
+    it refunded. Returns True if the refund went through.
+    """
+    charge_id = Order.objects.values_list('transaction_id', flat=True).get(pk=vendor_order.order_id)
+    try:
+        get_gateway().refund(
+            charge_id,
+            amount=int(vendor_order.subtotal * 100),
+            idempotency_key=f'refund-vendor-order-{vendor_order.pk}'
+        )
+    except Exception:
+        logger.exception('Refund of vendor order %s failed', vendor_order.pk)
+        return False
+    try:
+        set_status(vendor_order, Order.Status.REFUNDED, allowed_from=[Order.Status.CANCELLED])
+    except InvalidTransition:
+        # Refunded meanwhile by a concurrent retry under the same key
+        pass
+    return True
+
+
+def refund_cancelled_parts():
+    """Retry the refunds of cancelled parts of paid orders. Returns the number refunded."""
+    return sum(refund_part(vendor_order) for vendor_order in list(_refund_due()))
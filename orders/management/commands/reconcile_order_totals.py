@@ -0,0 +1,61 @@
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import F, Sum, Value, DecimalField
+from django.db.models.functions import Coalesce
+
+from orders.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Check stored order totals against the sum of their items and '
+        'optionally repair any that have drifted.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Rewrite mismatched totals from the item sums.'
+        )
+        parser.add_argument(
+            '--status',
+            choices=[value for value, _ in Order.Status.choices],
+            help='Only check orders with this status.'
+        )
+
+    def handle(self, *args, **options):
+        orders = Order.objects.all()
+        if options['status']:
+            orders = orders.filter(status=options['status'])
+
+        # One grouped query computes every order's item sum in the database
+        orders = orders.annotate(
+            items_sum=Coalesce(
+                Sum(F('items__price') * F('items__quantity')),
+                Value(0),
+                output_field=DecimalField(max_digits=10, decimal_places=2)
+            )
+        ).values_list('pk', 'total', 'items_sum').order_by('pk')
+
+        cent = Decimal('0.01')
+        checked = mismatched = 0
+        for pk, total, items_sum in orders.iterator(chunk_size=2000):
+            checked += 1
+            stored = Decimal(total).quantize(cent)
+            expected = Decimal(items_sum).quantize(cent)
+            if stored == expected:
+                continue
+            mismatched += 1
+            self.stdout.write(self.style.WARNING(
+                f'Order #{pk}: stored {stored}, items sum to {expected}'
+            ))
+            if options['fix']:
+                Order.objects.filter(pk=pk).update(total=expected)
+
+        style = self.style.SUCCESS if not mismatched else self.style.ERROR
+        action = 'fixed' if options['fix'] else 'found'
+        self.stdout.write(style(
+            f'Checked {checked} orders, {action} {mismatched} mismatched totals.'
+        ))
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from orders.checkout import refund_late_charges, release_stale_payments
+from orders.fulfillment import refund_cancelled_parts
+
+
+class Command(BaseCommand):
+    help = (
+        'Release stock held by orders that have been awaiting payment for too '
+        'long without a confirmation from the payment provider, and retry '
+        'refunds of charges that arrived after their order was released and '
+        'of paid parts that vendors cancelled.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--minutes',
+            type=int,
+            default=30,
+            help='Release orders awaiting payment for longer than this (default: 30).'
+        )
+
+    def handle(self, *args, **options):
+        released = release_stale_payments(timedelta(minutes=options['minutes']))
+        refunded = refund_late_charges()
+        parts = refund_cancelled_parts()
+        self.stdout.write(self.style.SUCCESS(
+            f'Released {released} stale orders, refunded {refunded} late charges '
+            f'and {parts} cancelled vendor orders.'
+        ))
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_order_customer_status_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='transaction_id',
+            field=models.CharField(blank=True, help_text='Payment provider reference for the charge', max_length=255, verbose_name='transaction id'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('awaiting', 'Awaiting payment'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled'), ('refunded', 'Refunded')], default='pending', max_length=10, verbose_name='status'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_awaiting_payment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SavedCart',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('items', models.JSONField(default=dict, help_text='{product_id: {"quantity": n, "price": "9.99"}}', verbose_name='items')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='saved_cart', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'saved cart',
+                'verbose_name_plural': 'saved carts',
+            },
+        ),
+    ]
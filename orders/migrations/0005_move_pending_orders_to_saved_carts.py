@@ -0,0 +1,34 @@
+from django.db import migrations
+
+
+def pending_orders_to_saved_carts(apps, schema_editor):
+    """Carts used to be PENDING orders; park them as saved carts instead."""
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    SavedCart = apps.get_model('orders', 'SavedCart')
+
+    pending = Order.objects.filter(status='pending')
+    carts = {}
+    for customer_id, product_id, quantity, price in OrderItem.objects.filter(
+        order__in=pending
+    ).values_list('order__customer_id', 'product_id', 'quantity', 'price').iterator():
+        items = carts.setdefault(customer_id, {})
+        line = items.setdefault(str(product_id), {'quantity': 0, 'price': str(price)})
+        line['quantity'] += quantity
+
+    SavedCart.objects.bulk_create([
+        SavedCart(user_id=customer_id, items=items)
+        for customer_id, items in carts.items()
+    ])
+    pending.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0004_savedcart'),
+    ]
+
+    operations = [
+        migrations.RunPython(pending_orders_to_saved_carts, migrations.RunPython.noop),
+    ]
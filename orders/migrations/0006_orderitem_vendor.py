@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:23
+
+import django.db.models.deletion
+from django.db import migrations, models, transaction
+from django.db.models import OuterRef, Subquery
+
+BATCH_SIZE = 5000
+
+
+def copy_vendor_from_product(apps, schema_editor):
+    # Walk the primary key range in batches, each in its own short
+    # transaction, so a large table is never locked as a whole
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    Product = apps.get_model('products', 'Product')
+    vendor = Subquery(Product.objects.filter(pk=OuterRef('product_id')).values('vendor_id')[:1])
+    db = schema_editor.connection.alias
+    last = OrderItem.objects.using(db).order_by('-pk').values_list('pk', flat=True).first() or 0
+    for start in range(0, last + 1, BATCH_SIZE):
+        with transaction.atomic(using=db):
+            OrderItem.objects.using(db).filter(
+                pk__gte=start,
+                pk__lt=start + BATCH_SIZE,
+                vendor__isnull=True
+            ).update(vendor_id=vendor)
+
+
+class Migration(migrations.Migration):
+
+    # The backfill commits batch by batch
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0005_content_addressed_images'),
+        ('orders', '0005_move_pending_orders_to_saved_carts'),
+        ('products', '0012_category_tree'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='vendor',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='order_items', to='accounts.vendor', verbose_name='vendor'),
+        ),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['vendor', 'order'], name='orderitem_vendor_order_idx'),
+        ),
+        migrations.RunPython(copy_vendor_from_product, migrations.RunPython.noop),
+    ]
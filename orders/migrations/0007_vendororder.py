@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:29
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F, Sum
+
+BATCH_SIZE = 2000
+
+
+def split_existing_orders(apps, schema_editor):
+    # One part per (order, vendor) of the existing lines, with the
+    # order's status and creation time
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    VendorOrder = apps.get_model('orders', 'VendorOrder')
+    db = schema_editor.connection.alias
+    parts = OrderItem.objects.using(db).filter(vendor__isnull=False).values(
+        'order_id', 'vendor_id', 'order__status', 'order__created_at'
+    ).annotate(
+        subtotal=Sum(F('price') * F('quantity'), output_field=models.DecimalField(max_digits=10, decimal_places=2))
+    ).order_by('order_id', 'vendor_id')
+    batch = []
+    for part in parts.iterator(chunk_size=BATCH_SIZE):
+        batch.append(VendorOrder(
+            order_id=part['order_id'],
+            vendor_id=part['vendor_id'],
+            subtotal=part['subtotal'] or 0,
+            status=part['order__status'],
+            created_at=part['order__created_at']
+        ))
+        if len(batch) == BATCH_SIZE:
+            VendorOrder.objects.using(db).bulk_create(batch)
+            batch = []
+    VendorOrder.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0005_content_addressed_images'),
+        ('orders', '0006_orderitem_vendor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VendorOrder',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subtotal', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='subtotal')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('awaiting', 'Awaiting payment'), ('processing', 'Processing'), ('shipped', 'Shipped'), ('delivered', 'Delivered'), ('cancelled', 'Cancelled'), ('refunded', 'Refunded')], default='pending', max_length=10, verbose_name='status')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='vendor_orders', to='orders.order', verbose_name='order')),
+                ('vendor', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='vendor_orders', to='accounts.vendor', verbose_name='vendor')),
+            ],
+            options={
+                'verbose_name': 'vendor order',
+                'verbose_name_plural': 'vendor orders',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['vendor', 'created_at'], name='vendororder_vendor_created_idx'), models.Index(fields=['vendor', 'status'], name='vendororder_vendor_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('order', 'vendor'), name='unique_order_vendor')],
+            },
+        ),
+        migrations.RunPython(split_existing_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:22
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_vendororder'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='late_charge',
+            field=models.BooleanField(default=False, help_text='Charged after the order was released; the charge is refunded', verbose_name='late charge'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(condition=models.Q(('late_charge', True)), fields=['status'], name='order_late_charge_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_late_charge'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='order',
+            name='order_customer_status_idx',
+        ),
+    ]
@@ -1,15 +1,27 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import F
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from products.models import Product
 
+# price * quantity for an OrderItem row
+LINE_TOTAL = models.ExpressionWrapper(
+    F('price') * F('quantity'),
+    output_field=models.DecimalField(max_digits=10, decimal_places=2)
+)
+
+
 class Order(models.Model):
     """
     Order model representing a customer's order.
     """
     class Status(models.TextChoices):
         PENDING = 'pending', _('Pending')
+        AWAITING_PAYMENT = 'awaiting', _('Awaiting payment')
         PROCESSING = 'processing', _('Processing')
         SHIPPED = 'shipped', _('Shipped')
         DELIVERED = 'delivered', _('Delivered')
@@ -43,6 +55,17 @@ class Order(models.Model):
         max_length=20,
         help_text=_('Contact phone number for delivery updates')
     )
+    transaction_id = models.CharField(
+        _('transaction id'),
+        max_length=255,
+        blank=True,
+        help_text=_('Payment provider reference for the charge')
+    )
+    late_charge = models.BooleanField(
+        _('late charge'),
+        default=False,
+        help_text=_('Charged after the order was released; the charge is refunded')
+    )
     created_at = models.DateTimeField(
         _('created at'),
         auto_now_add=True
@@ -59,6 +82,12 @@ class Order(models.Model):
         indexes = [
             models.Index(fields=['status'], name='order_status_idx'),
             models.Index(fields=['created_at'], name='order_created_at_idx'),
+            # The few late charges still to refund (see orders.checkout)
+            models.Index(
+                fields=['status'],
+                condition=models.Q(late_charge=True),
+                name='order_late_charge_idx'
+            ),
         ]
 
     def __str__(self):
@@ -69,14 +98,28 @@ class Order(models.Model):
         """Return total number of items in the order."""
         return self.items.aggregate(total=models.Sum('quantity'))['total'] or 0
 
+    def items_total(self):
+        """Sum the order items in the database."""
+        return self.items.aggregate(total=models.Sum(LINE_TOTAL))['total'] or 0
+
     def update_total(self):
-        """Update the order total based on order items."""
-        self.total = sum(
-            item.price * item.quantity
-            for item in self.items.all()
-        )
+        """
+        Reset the stored total from the order items.
+        Day-to-day changes are applied incrementally by OrderItem; this is
+        only needed to repair drift (see the reconcile_order_totals command).
+        """
+        self.total = self.items_total()
         self.save(update_fields=['total', 'updated_at'])
 
+    @classmethod
+    def adjust_total(cls, order_id, delta):
+        """Atomically add ``delta`` to an order's stored total in the database."""
+        if delta:
+            cls.objects.filter(pk=order_id).update(
+                total=F('total') + delta,
+                updated_at=timezone.now()
+            )
+
 
 class OrderItem(models.Model):
     """
@@ -94,6 +137,16 @@ class OrderItem(models.Model):
         related_name='order_items',
         verbose_name=_('product')
     )
+    # Copied from the product at purchase time so vendor queries use the
+    # (vendor, order) index instead of joining through Product
+    vendor = models.ForeignKey(
+        'accounts.Vendor',
+        on_delete=models.PROTECT,
+        related_name='order_items',
+        null=True,
+        editable=False,
+        verbose_name=_('vendor')
+    )
     quantity = models.PositiveIntegerField(
         _('quantity'),
         validators=[MinValueValidator(1)]
@@ -114,6 +167,9 @@ class OrderItem(models.Model):
                 name='unique_order_product'
             )
         ]
+        indexes = [
+            models.Index(fields=['vendor', 'order'], name='orderitem_vendor_order_idx'),
+        ]
 
     def __str__(self):
         return f"{self.quantity}x {self.product.name} (${self.price} each)"
@@ -123,13 +179,162 @@ class OrderItem(models.Model):
         """Calculate total price for this order item."""
         return self.price * self.quantity
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the persisted line total so saves can apply a delta
+        if 'price' in field_names and 'quantity' in field_names:
+            instance._saved_total_price = instance._line_total()
+        return instance
+
+    def _line_total(self):
+        # price may still be a string or float before the first save
+        return Decimal(str(self.price)) * int(self.quantity)
+
+    def _persisted_line_total(self):
+        if self._state.adding:
+            return 0
+        previous = getattr(self, '_saved_total_price', None)
+        if previous is None:
+            # Loaded with deferred fields; read the stored line once
+            previous = OrderItem.objects.filter(pk=self.pk).aggregate(
+                total=models.Sum(LINE_TOTAL)
+            )['total'] or 0
+        return previous
+
     def save(self, *args, **kwargs):
-        """Override save to update order total when item is saved."""
-        super().save(*args, **kwargs)
-        self.order.update_total()
+        """Save the item and add the change in its line total to the order and its vendor's part."""
+        if self.vendor_id is None:
+            self.vendor_id = self.product.vendor_id
+        previous = self._persisted_line_total()
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+            line_total = self._line_total()
+            Order.adjust_total(self.order_id, line_total - previous)
+            VendorOrder.adjust_subtotal(self.order_id, self.vendor_id, line_total - previous)
+        self._saved_total_price = line_total
 
     def delete(self, *args, **kwargs):
-        """Override delete to update order total when item is deleted."""
-        order = self.order
-        super().delete(*args, **kwargs)
-        order.update_total()
\ No newline at end of file
+        """Delete the item and subtract its line total from the order and its vendor's part."""
+        previous = self._persisted_line_total()
+        with transaction.atomic(using=kwargs.get('using')):
+            result = super().delete(*args, **kwargs)
+            Order.adjust_total(self.order_id, -previous)
+            VendorOrder.adjust_subtotal(self.order_id, self.vendor_id, -previous)
+        return result
+
+
+class VendorOrder(models.Model):
+    """
+    One vendor's part of an order: its subtotal and fulfillment status.
+    Checkout creates one per vendor in the cart; the vendor moves only
+    its own record, and the order's status follows them (see
+    orders.fulfillment).
+    """
+    order = models.ForeignKey(
+        Order,
+        on_delete=models.CASCADE,
+        related_name='vendor_orders',
+        verbose_name=_('order')
+    )
+    vendor = models.ForeignKey(
+        'accounts.Vendor',
+        on_delete=models.PROTECT,
+        related_name='vendor_orders',
+        verbose_name=_('vendor')
+    )
+    subtotal = models.DecimalField(
+        _('subtotal'),
+        max_digits=10,
+        decimal_places=2,
+        default=0
+    )
+    status = models.CharField(
+        _('status'),
+        max_length=10,
+        choices=Order.Status.choices,
+        default=Order.Status.PENDING
+    )
+    # The order's creation time, so vendor lists sort and filter without a join
+    created_at = models.DateTimeField(
+        _('created at'),
+        default=timezone.now
+    )
+    updated_at = models.DateTimeField(
+        _('updated at'),
+        auto_now=True
+    )
+
+    class Meta:
+        verbose_name = _('vendor order')
+        verbose_name_plural = _('vendor orders')
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['order', 'vendor'],
+                name='unique_order_vendor'
+            )
+        ]
+        indexes = [
+            models.Index(fields=['vendor', 'created_at'], name='vendororder_vendor_created_idx'),
+            models.Index(fields=['vendor', 'status'], name='vendororder_vendor_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"Order #{self.order_id} - {self.vendor} - {self.get_status_display()} (${self.subtotal})"
+
+    @property
+    def items(self):
+        """The order lines of this vendor."""
+        return OrderItem.objects.filter(order_id=self.order_id, vendor_id=self.vendor_id)
+
+    @classmethod
+    def adjust_subtotal(cls, order_id, vendor_id, delta):
+        """
+        Atomically add ``delta`` to a vendor's part of an order, creating
+        the part when a line of a new vendor is added after checkout.
+        """
+        if not delta:
+            return
+        updated = cls.objects.filter(order_id=order_id, vendor_id=vendor_id).update(
+            subtotal=F('subtotal') + delta,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            order = Order.objects.only('status', 'created_at').get(pk=order_id)
+            cls.objects.create(
+                order_id=order_id,
+                vendor_id=vendor_id,
+                subtotal=delta,
+                status=order.status,
+                created_at=order.created_at
+            )
+
+
+class SavedCart(models.Model):
+    """
+    A customer's cart parked at logout. Carts normally live in the session
+    (see orders.cart); this row is merged back into it on the next login.
+    """
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='saved_cart',
+        verbose_name=_('user')
+    )
+    items = models.JSONField(
+        _('items'),
+        default=dict,
+        help_text=_('{product_id: {"quantity": n, "price": "9.99"}}')
+    )
+    updated_at = models.DateTimeField(
+        _('updated at'),
+        auto_now=True
+    )
+
+    class Meta:
+        verbose_name = _('saved cart')
+        verbose_name_plural = _('saved carts')
+
+    def __str__(self):
+        return f"Saved cart of {self.user} ({len(self.items)} items)"
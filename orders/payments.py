@@ -0,0 +1,395 @@
+"""
+Payment gateways used by checkout.
+
+Views talk to a gateway object instead of the Stripe SDK directly. The
+gateway is configured by two settings:
+
+    PAYMENT_GATEWAY = 'orders.payments.StripeGateway'   # dotted path
+    PAYMENT_GATEWAY_OPTIONS = {'read_timeout': 10, 'retries': 2}
+
+Every gateway shares the same resilience layer (BaseGateway): bounded
+retries of transient failures under one idempotency key, so a retried
+request can never charge twice, and a circuit breaker that fails fast
+while the provider is down instead of tying up a worker per request.
+FakeGateway runs in-process for tests and load tests.
+"""
+import itertools
+import json
+import logging
+import random
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class PaymentError(Exception):
+    """The provider refused or failed the charge; no money was taken."""
+
+    def __init__(self, message, user_message=None):
+        super().__init__(message)
+        self.user_message = user_message or message
+
+
+class PaymentDeclined(PaymentError):
+    """The card was declined."""
+
+
+class GatewayUnavailable(PaymentError):
+    """The circuit breaker is open; the provider was not contacted."""
+
+
+class PaymentOutcomeUnknown(PaymentError):
+    """
+    Every attempt failed in transit, so the charge may or may not have
+    gone through. The provider's webhook is the source of truth.
+    """
+
+
+class TransientGatewayError(Exception):
+    """A retryable failure: timeout, connection error, rate limit or 5xx."""
+
+
+class WebhookError(Exception):
+    """A webhook payload could not be verified or parsed."""
+
+
+# Normalised webhook outcomes
+CHARGE_SUCCEEDED = 'succeeded'
+CHARGE_FAILED = 'failed'
+
+
+class CircuitBreaker:
+    """
+    Per-process circuit breaker.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    calls are refused for ``reset_timeout`` seconds. Then a single trial
+    call is let through (half-open): success closes the circuit, failure
+    opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return self.CLOSED
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self):
+        """
+        Return the state a call may be made in now: CLOSED, or HALF_OPEN for
+        the single trial call. None (refused) while open or a trial is in
+        flight.
+        """
+        with self._lock:
+            state = self.state
+            if state == self.CLOSED:
+                return state
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return state
+            return None
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def end_trial(self):
+        """Let another half-open trial through; a no-op once the outcome was recorded."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning('Payment gateway circuit opened after %s failures', self.failures)
+                self.opened_at = self.clock()
+
+
+class BaseGateway:
+    """Retry, idempotency and circuit-breaker logic shared by all gateways."""
+
+    def __init__(self, retries=2, backoff=0.25, failure_threshold=5, reset_timeout=30.0):
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+    def charge(self, amount, currency, source, description='', metadata=None, idempotency_key=None):
+        """
+        Charge ``amount`` (in cents) and return the provider's charge id.
+        Retries reuse ``idempotency_key`` so at most one charge is made.
+        """
+        return self._call(
+            self._charge,
+            amount=amount,
+            currency=currency,
+            source=source,
+            description=description,
+            metadata=metadata or {},
+            idempotency_key=idempotency_key or uuid.uuid4().hex,
+        )
+
+    def refund(self, charge_id, amount=None, idempotency_key=None):
+        """
+        Refund ``amount`` (in cents) of a charge, or all of it if None, and
+        return the provider's refund id. Retried like charge(), so at most
+        one refund is made per key.
+        """
+        return self._call(
+            self._refund,
+            charge_id=charge_id,
+            amount=amount,
+            idempotency_key=idempotency_key or uuid.uuid4().hex,
+        )
+
+    def _call(self, request, **kwargs):
+        """Make ``request(**kwargs)`` through the circuit breaker, retrying transient failures."""
+        allowed = self.breaker.allow()
+        if allowed is None:
+            raise GatewayUnavailable(
+                'Payment gateway circuit is open',
+                'Payments are temporarily unavailable. Please try again in a few minutes.'
+            )
+
+        try:
+            for attempt in range(self.retries + 1):
+                try:
+                    result = request(**kwargs)
+                except TransientGatewayError as e:
+                    last_error = e
+                    logger.warning('Payment attempt %s failed: %s', attempt + 1, e)
+                    if attempt < self.retries:
+                        time.sleep(self.backoff * 2 ** attempt)
+                    continue
+                except PaymentError:
+                    # A decline or bad request means the provider itself is healthy
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_success()
+                return result
+
+            self.breaker.record_failure()
+            raise PaymentOutcomeUnknown(
+                str(last_error),
+                'We could not reach the payment provider. '
+                'If your payment went through, your order will be confirmed shortly.'
+            ) from last_error
+        finally:
+            # An unexpected exception records neither outcome; without this
+            # a half-open trial would stay in flight and the circuit open for
+            # good. Only the trial call itself may end the trial.
+            if allowed == CircuitBreaker.HALF_OPEN:
+                self.breaker.end_trial()
+
+    def _charge(self, amount, currency, source, description, metadata, idempotency_key):
+        """Make one charge attempt; raise TransientGatewayError to retry."""
+        raise NotImplementedError
+
+    def _refund(self, charge_id, amount, idempotency_key):
+        """Make one refund attempt; raise TransientGatewayError to retry."""
+        raise NotImplementedError
+
+    def parse_webhook(self, payload, signature):
+        """
+        Verify a webhook and return ``(outcome, order_id, charge_id)``;
+        outcome is None for events checkout does not care about.
+        """
+        raise NotImplementedError
+
+
+class StripeGateway(BaseGateway):
+    """
+    Charges cards through the Stripe API over one pooled HTTP session
+    with explicit connect/read timeouts. Retrying is left to BaseGateway
+    so it shares the circuit breaker.
+    """
+
+    def __init__(self, connect_timeout=3.05, read_timeout=15, **kwargs):
+        super().__init__(**kwargs)
+        import requests
+        import stripe
+        self.stripe = stripe
+        self.api_key = getattr(settings, 'STRIPE_SECRET_KEY', '')
+        self.session = requests.Session()
+        requests_client = getattr(stripe, 'RequestsClient', None) or stripe.http_client.RequestsClient
+        stripe.default_http_client = requests_client(
+            timeout=(connect_timeout, read_timeout),
+            session=self.session,
+        )
+        stripe.max_network_retries = 0
+
+    def _charge(self, amount, currency, source, description, metadata, idempotency_key):
+        error = self.stripe.error
+        try:
+            charge = self.stripe.Charge.create(
+                api_key=self.api_key,
+                idempotency_key=idempotency_key,
+                amount=amount,
+                currency=currency,
+                description=description,
+                source=source,
+                metadata=metadata,
+            )
+        except error.CardError as e:
+            raise PaymentDeclined(str(e), e.user_message) from e
+        except (error.APIConnectionError, error.RateLimitError) as e:
+            raise TransientGatewayError(str(e)) from e
+        except error.APIError as e:
+            if (e.http_status or 500) >= 500:
+                raise TransientGatewayError(str(e)) from e
+            raise PaymentError(str(e), 'Payment processing error. Please try again.') from e
+        except error.StripeError as e:
+            raise PaymentError(str(e), 'Payment processing error. Please try again.') from e
+        return charge.id
+
+    def _refund(self, charge_id, amount, idempotency_key):
+        error = self.stripe.error
+        # Stripe refunds the whole charge when no amount is given
+        options = {} if amount is None else {'amount': amount}
+        try:
+            refund = self.stripe.Refund.create(
+                api_key=self.api_key,
+                idempotency_key=idempotency_key,
+                charge=charge_id,
+                **options
+            )
+        except (error.APIConnectionError, error.RateLimitError) as e:
+            raise TransientGatewayError(str(e)) from e
+        except error.APIError as e:
+            if (e.http_status or 500) >= 500:
+                raise TransientGatewayError(str(e)) from e
+            raise PaymentError(str(e)) from e
+        except error.StripeError as e:
+            raise PaymentError(str(e)) from e
+        return refund.id
+
+    def parse_webhook(self, payload, signature):
+        secret = getattr(settings, 'STRIPE_WEBHOOK_SECRET', '')
+        try:
+            event = self.stripe.Webhook.construct_event(payload, signature, secret)
+        except (ValueError, self.stripe.error.SignatureVerificationError) as e:
+            raise WebhookError(str(e)) from e
+        outcome = {
+            'charge.succeeded': CHARGE_SUCCEEDED,
+            'charge.failed': CHARGE_FAILED,
+        }.get(event['type'])
+        charge = event['data']['object']
+        return outcome, charge.get('metadata', {}).get('order_id'), charge.get('id')
+
+
+class FakeGateway(BaseGateway):
+    """
+    In-process stand-in for a real provider, for tests and load tests.
+
+    Every charge succeeds except for the DECLINE_TOKENS. ``latency`` adds a
+    simulated round trip (timing out past ``read_timeout``) and
+    ``failure_rate`` makes that share of attempts fail transiently, which
+    exercises the retry and circuit-breaker paths.
+    Charges and refunds are recorded in ``charges`` and ``refunds`` and
+    are idempotent per key.
+    """
+
+    DECLINE_TOKENS = {'tok_chargeDeclined', 'tok_visa_chargeDeclined'}
+
+    def __init__(self, latency=0, failure_rate=0, connect_timeout=None, read_timeout=None, **kwargs):
+        kwargs.setdefault('backoff', 0)
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.read_timeout = read_timeout
+        self.charges = []
+        self.refunds = []
+        self._by_key = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _charge(self, amount, currency, source, description, metadata, idempotency_key):
+        if self.latency:
+            if self.read_timeout is not None and self.latency > self.read_timeout:
+                time.sleep(self.read_timeout)
+                raise TransientGatewayError('Simulated read timeout')
+            time.sleep(self.latency)
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise TransientGatewayError('Simulated provider failure')
+        if source in self.DECLINE_TOKENS:
+            raise PaymentDeclined('Card declined', 'Your card was declined.')
+        with self._lock:
+            if idempotency_key in self._by_key:
+                return self._by_key[idempotency_key]
+            charge_id = f'ch_fake_{next(self._ids)}'
+            self._by_key[idempotency_key] = charge_id
+            self.charges.append({
+                'id': charge_id,
+                'amount': amount,
+                'currency': currency,
+                'source': source,
+                'description': description,
+                'metadata': metadata,
+            })
+        return charge_id
+
+    def _refund(self, charge_id, amount, idempotency_key):
+        with self._lock:
+            if idempotency_key in self._by_key:
+                return self._by_key[idempotency_key]
+            refund_id = f're_fake_{next(self._ids)}'
+            self._by_key[idempotency_key] = refund_id
+            self.refunds.append({'id': refund_id, 'charge': charge_id, 'amount': amount})
+        return refund_id
+
+    def parse_webhook(self, payload, signature):
+        """Accept unsigned ``{"outcome", "order_id", "charge_id"}`` JSON payloads."""
+        try:
+            data = json.loads(payload)
+            return data.get('outcome'), data.get('order_id'), data.get('charge_id')
+        except (ValueError, AttributeError) as e:
+            raise WebhookError(str(e)) from e
+
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+def get_gateway():
+    """
+    Return the process-wide gateway. It is built once per worker so the
+    HTTP session and the circuit breaker state are shared by all requests.
+    """
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                path = getattr(settings, 'PAYMENT_GATEWAY', 'orders.payments.StripeGateway')
+                options = getattr(settings, 'PAYMENT_GATEWAY_OPTIONS', {})
+                _gateway = import_string(path)(**options)
+    return _gateway
+
+
+def reset_gateway():
+    """Forget the cached gateway (used when settings change, e.g. in tests)."""
+    global _gateway
+    _gateway = None
@@ -0,0 +1,30 @@
+from django.contrib.auth.signals import user_logged_in, user_logged_out
+from django.dispatch import Signal, receiver
+
+from .cart import Cart
+from .models import SavedCart
+
+# Sent as order_status_changed(sender=Order, order_ids=[...]) by status
+# changes made with queryset updates, which send no post_save
+order_status_changed = Signal()
+
+
+@receiver(user_logged_in)
+def restore_saved_cart(sender, request, user, **kwargs):
+    """Merge the cart parked at the last logout into the session cart."""
+    if request is None or not hasattr(request, 'session'):
+        return
+    saved = SavedCart.objects.filter(user=user).first()
+    if saved is not None:
+        Cart(request).merge(saved.items)
+        saved.delete()
+
+
+@receiver(user_logged_out)
+def park_cart(sender, request, user, **kwargs):
+    """Keep a customer's cart across logout, when the session is flushed."""
+    if user is None or request is None or not hasattr(request, 'session'):
+        return
+    cart = Cart(request)
+    if len(cart):
+        SavedCart.objects.update_or_create(user=user, defaults={'items': cart.data})
@@ -1,3 +1,664 @@
-from django.test import TestCase
+import json
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.management import call_command
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+
+from accounts.models import Vendor
+from products.models import Category, Product, StockHold
+from . import fulfillment
+from .cart import CART_SESSION_KEY, Cart, CartLine
+from .models import Order, OrderItem, SavedCart, VendorOrder
+from .validation import CartProblem, validate_cart
+from .checkout import begin_payment, confirm_payment, refund_late_charges, release_payment
+from .payments import (
+    get_gateway, reset_gateway, CircuitBreaker, FakeGateway,
+    GatewayUnavailable, PaymentError, PaymentOutcomeUnknown, TransientGatewayError,
+)
+
+
+@override_settings(PAYMENT_GATEWAY='orders.payments.FakeGateway')
+class TwoPhaseCheckoutTests(TestCase):
+    def setUp(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        vendor_user = User.objects.create_user(username='vendor', password='pass')
+        vendor = Vendor.objects.create(user=vendor_user, shop_name='Shop')
+        category = Category.objects.create(name='General', slug='general')
+        self.product = Product.objects.create(
+            vendor=vendor,
+            category=category,
+            name='Laptop',
+            price='100.00',
+            stock=5,
+            status=Product.Status.ACTIVE
+        )
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.client.force_login(self.customer)
+        session = self.client.session
+        session[CART_SESSION_KEY] = {str(self.product.pk): {'quantity': 2, 'price': '100.00'}}
+        session.save()
+
+    def pay(self, token):
+        return self.client.post(reverse('orders:process_payment'), {
+            'stripeToken': token,
+            'delivery_address': '1 Main Street',
+            'phone': '0700000000',
+        }).json()
+
+    def test_successful_payment_confirms_order_and_clears_cart(self):
+        response = self.pay('tok_visa')
+        self.assertTrue(response['success'])
+        order = Order.objects.get(pk=response['order_id'])
+        self.product.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.PROCESSING)
+        self.assertEqual(order.transaction_id, get_gateway().charges[0]['id'])
+        self.assertEqual(get_gateway().charges[0]['amount'], 20000)
+        self.assertEqual(self.product.stock, 3)
+        self.assertNotIn(CART_SESSION_KEY, self.client.session)
+
+    def test_checkout_holds_stock_until_payment(self):
+        response = self.client.get(reverse('orders:checkout'))
+        self.assertEqual(response.status_code, 200)
+        hold = StockHold.objects.get(product=self.product)
+        self.assertEqual(hold.quantity, 2)
+        self.assertNotEqual(hold.holder, self.client.session.session_key)
+        self.assertEqual(self.product.available_stock, 3)
+
+        self.assertTrue(self.pay('tok_visa')['success'])
+        self.assertFalse(StockHold.objects.exists())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.available_stock, 3)
+
+    def test_own_hold_stays_available_to_the_cart(self):
+        self.client.get(reverse('orders:checkout'))
+        response = self.client.post(
+            reverse('orders:add_to_cart', args=[self.product.pk]), {'quantity': 3}
+        ).json()
+        self.assertTrue(response['success'])
+        self.assertEqual(self.client.session[CART_SESSION_KEY][str(self.product.pk)]['quantity'], 5)
+
+        url = reverse('orders:update_cart_item', args=[self.product.pk])
+        self.client.post(url, {'quantity': 4})
+        self.assertEqual(self.client.session[CART_SESSION_KEY][str(self.product.pk)]['quantity'], 4)
+        self.client.post(url, {'quantity': 6})
+        self.assertEqual(self.client.session[CART_SESSION_KEY][str(self.product.pk)]['quantity'], 4)
+
+        # Another shopper still sees the held units as taken
+        self.client.get(reverse('orders:checkout'))
+        other = self.client_class()
+        response = other.post(reverse('orders:add_to_cart', args=[self.product.pk]), {'quantity': 2}).json()
+        self.assertFalse(response['success'])
+
+    def test_declined_payment_releases_stock_and_keeps_cart(self):
+        response = self.pay('tok_chargeDeclined')
+        self.assertFalse(response['success'])
+        order = Order.objects.get(customer=self.customer)
+        self.product.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.CANCELLED)
+        self.assertEqual(self.product.stock, 5)
+        self.assertIn(str(self.product.pk), self.client.session[CART_SESSION_KEY])
+
+    def test_webhook_settles_awaiting_order(self):
+        from .checkout import begin_payment
+        order = begin_payment(
+            self.customer,
+            [CartLine(self.product, 2, Decimal('100.00'))],
+            '1 Main Street',
+            '0700000000'
+        )
+        response = self.client.post(
+            reverse('orders:payment_webhook'),
+            data=json.dumps({'outcome': 'failed', 'order_id': order.pk}),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        order.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.CANCELLED)
+        self.assertEqual(self.product.stock, 5)
+
+    def test_unknown_outcome_asks_customer_to_wait_not_retry(self):
+        for error in (TransientGatewayError('timeout'), RuntimeError('boom')):
+            with self.subTest(error=error):
+                Order.objects.all().delete()
+                with mock.patch.object(FakeGateway, '_charge', side_effect=error):
+                    response = self.pay('tok_visa')
+                self.assertTrue(response['pending'])
+                self.assertNotIn('try again', response['message'].lower())
+                order = Order.objects.get(pk=response['order_id'])
+                self.assertEqual(order.status, Order.Status.AWAITING_PAYMENT)
+                self.assertIn(str(self.product.pk), self.client.session[CART_SESSION_KEY])
+
+    def webhook(self, order, charge_id):
+        return self.client.post(
+            reverse('orders:payment_webhook'),
+            data=json.dumps({'outcome': 'succeeded', 'order_id': order.pk, 'charge_id': charge_id}),
+            content_type='application/json'
+        )
+
+    def test_charge_after_release_is_refunded_once(self):
+        order = begin_payment(
+            self.customer, [CartLine(self.product, 2, Decimal('100.00'))], '1 Main Street', '0700000000'
+        )
+        release_payment(order.pk)
+        self.webhook(order, 'ch_late')
+        self.webhook(order, 'ch_late')
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.transaction_id), (Order.Status.REFUNDED, 'ch_late'))
+        self.assertEqual(get_gateway().refunds, [{'id': mock.ANY, 'charge': 'ch_late', 'amount': None}])
+        self.assertEqual(set(order.vendor_orders.values_list('status', flat=True)), {Order.Status.REFUNDED})
+
+    def test_failed_refund_is_flagged_and_retried(self):
+        order = begin_payment(
+            self.customer, [CartLine(self.product, 2, Decimal('100.00'))], '1 Main Street', '0700000000'
+        )
+        release_payment(order.pk)
+        with mock.patch.object(FakeGateway, '_refund', side_effect=PaymentError('refused')):
+            self.assertFalse(confirm_payment(order.pk, 'ch_late'))
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.transaction_id), (Order.Status.CANCELLED, 'ch_late'))
+        self.assertTrue(order.late_charge)
+
+        out = StringIO()
+        call_command('release_stale_payments', stdout=out)
+        self.assertIn('refunded 1 late charges', out.getvalue())
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.REFUNDED)
+
+    def test_paid_order_cancelled_later_is_not_swept(self):
+        order = begin_payment(
+            self.customer, [CartLine(self.product, 2, Decimal('100.00'))], '1 Main Street', '0700000000'
+        )
+        confirm_payment(order.pk, 'ch_paid')
+        fulfillment.set_status(order.vendor_orders.get(), Order.Status.CANCELLED)
+        order.refresh_from_db()
+        self.assertEqual((order.status, order.late_charge), (Order.Status.CANCELLED, False))
+        self.assertEqual(refund_late_charges(), 0)
+        self.assertEqual(get_gateway().refunds, [])
+        order.refresh_from_db()
+        self.assertEqual(order.status, Order.Status.CANCELLED)
+
+    def test_view_reports_a_charge_that_lands_after_release(self):
+        charge = FakeGateway._charge
+
+        def released_meanwhile(gateway, **kwargs):
+            release_payment(kwargs['metadata']['order_id'])
+            return charge(gateway, **kwargs)
+
+        with mock.patch.object(FakeGateway, '_charge', autospec=True, side_effect=released_meanwhile):
+            response = self.pay('tok_visa')
+        self.assertFalse(response['success'])
+        order = Order.objects.get(customer=self.customer)
+        self.assertEqual(order.status, Order.Status.REFUNDED)
+        self.assertEqual(get_gateway().refunds[0]['charge'], order.transaction_id)
+        self.assertIn(str(self.product.pk), self.client.session[CART_SESSION_KEY])
+
+
+class SessionCartTests(TestCase):
+    def setUp(self):
+        vendor_user = User.objects.create_user(username='vendor', password='pass')
+        vendor = Vendor.objects.create(user=vendor_user, shop_name='Shop')
+        category = Category.objects.create(name='General', slug='general')
+        self.product = Product.objects.create(
+            vendor=vendor,
+            category=category,
+            name='Laptop',
+            price='100.00',
+            stock=5,
+            status=Product.Status.ACTIVE
+        )
+        self.customer = User.objects.create_user(username='customer', password='pass')
+
+    def test_anonymous_visitor_can_add_to_cart(self):
+        response = self.client.post(
+            reverse('orders:add_to_cart', args=[self.product.pk]), {'quantity': 2}
+        ).json()
+        self.assertTrue(response['success'])
+        self.assertEqual(response['cart'], {'count': 1, 'total': '200.00'})
+        self.assertFalse(Order.objects.exists())
+
+    def test_cart_is_parked_on_logout_and_merged_on_login(self):
+        self.client.login(username='customer', password='pass')
+        self.client.post(reverse('orders:add_to_cart', args=[self.product.pk]), {'quantity': 1})
+        self.client.logout()
+        self.assertTrue(SavedCart.objects.filter(user=self.customer).exists())
+
+        # Shop anonymously, then log in again
+        self.client.post(reverse('orders:add_to_cart', args=[self.product.pk]), {'quantity': 2})
+        self.client.login(username='customer', password='pass')
+        cart = self.client.get(reverse('orders:cart_summary')).json()
+        self.assertEqual(cart, {'count': 1, 'total': '300.00'})
+        self.assertFalse(SavedCart.objects.filter(user=self.customer).exists())
+
+    def test_merge_on_login_is_capped_at_available_stock(self):
+        SavedCart.objects.create(
+            user=self.customer, items={str(self.product.pk): {'quantity': 4, 'price': '100.00'}}
+        )
+        self.add(self.product, 3)
+        self.client.login(username='customer', password='pass')
+        self.assertEqual(self.client.session[CART_SESSION_KEY][str(self.product.pk)]['quantity'], 5)
+
+    def test_summary_price_is_refreshed_when_lines_load(self):
+        self.add(self.product, 2)
+        Product.objects.filter(pk=self.product.pk).update(price='80.00')
+        self.assertEqual(self.client.get(reverse('orders:cart_summary')).json()['total'], '200.00')
+        self.client.get(reverse('orders:cart'))
+        self.assertEqual(self.client.get(reverse('orders:cart_summary')).json()['total'], '160.00')
+
+    def add(self, product, quantity):
+        self.client.post(reverse('orders:add_to_cart', args=[product.pk]), {'quantity': quantity})
+
+    def test_summary_reads_only_the_session(self):
+        other = Product.objects.create(
+            vendor=self.product.vendor, category=self.product.category,
+            name='Mouse', price='12.50', stock=5, status=Product.Status.ACTIVE
+        )
+        self.add(self.product, 1)
+        self.add(other, 2)
+        # The session row; no product, stock or order queries
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('orders:cart_summary'))
+        self.assertEqual(response.json(), {'count': 2, 'total': '125.00'})
+        self.assertIn('no-cache', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+    def test_summary_revalidates_with_etag(self):
+        self.add(self.product, 1)
+        self.client.get(reverse('orders:cart'))  # Shows the "added" message
+        response = self.client.get(reverse('orders:cart_summary'))
+        etag = response['ETag']
+        response = self.client.get(reverse('orders:cart_summary'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.add(self.product, 1)
+        response = self.client.get(reverse('orders:cart_summary'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'count': 1, 'total': '200.00'})
+
+    def test_empty_cart_summary(self):
+        response = self.client.get(reverse('orders:cart_summary'))
+        self.assertEqual(response.json(), {'count': 0, 'total': '0.00'})
+
+    def test_deleted_product_is_dropped_when_the_cart_is_viewed(self):
+        self.add(self.product, 1)
+        self.product.delete()
+        # The summary trusts the session until the cart is next validated
+        self.assertEqual(self.client.get(reverse('orders:cart_summary')).json()['count'], 1)
+        response = self.client.get(reverse('orders:cart'))
+        self.assertEqual(response.context['lines'], [])
+        self.assertEqual([p.code for p in response.context['problems']], [CartProblem.MISSING])
+        self.assertEqual(
+            self.client.get(reverse('orders:cart_summary')).json(), {'count': 0, 'total': '0.00'}
+        )
+
+    def test_deactivated_product_blocks_checkout(self):
+        self.add(self.product, 1)
+        Product.objects.filter(pk=self.product.pk).update(status=Product.Status.INACTIVE)
+        response = self.client.get(reverse('orders:cart'))
+        self.assertFalse(response.context['can_checkout'])
+        line, = response.context['lines']
+        self.assertEqual([p.code for p in line.problems], [CartProblem.UNAVAILABLE])
+        # Adding more of it is refused
+        self.assertFalse(
+            self.client.post(reverse('orders:add_to_cart', args=[self.product.pk]), {'quantity': 1}).json()['success']
+        )
+
+
+class CartValidationTests(TestCase):
+    def setUp(self):
+        vendor_user = User.objects.create_user(username='vendor', password='pass')
+        self.vendor = Vendor.objects.create(user=vendor_user, shop_name='Shop')
+        self.category = Category.objects.create(name='General', slug='general')
+
+    def make_product(self, name, stock=5, status=Product.Status.ACTIVE):
+        return Product.objects.create(
+            vendor=self.vendor,
+            category=self.category,
+            name=name,
+            price=Decimal('10.00'),
+            stock=stock,
+            status=status
+        )
+
+    def cart_of(self, items):
+        request = RequestFactory().get('/')
+        request.session = SessionStore()
+        request.session[CART_SESSION_KEY] = items
+        return Cart(request)
+
+    def test_validates_every_line_in_one_query(self):
+        products = [self.make_product(f'Product {i}') for i in range(30)]
+        cart = self.cart_of({
+            str(product.pk): {'quantity': 1, 'price': '10.00'} for product in products
+        })
+        with self.assertNumQueries(1):
+            validation = validate_cart(cart)
+            for line in validation.lines:
+                line.product.vendor.shop_name
+        self.assertEqual(len(validation.lines), 30)
+        self.assertTrue(validation.is_valid)
+
+    def test_reports_problems_per_line(self):
+        short = self.make_product('Short', stock=2)
+        empty = self.make_product('Empty', stock=0)
+        hidden = self.make_product('Hidden', status=Product.Status.INACTIVE)
+        repriced = self.make_product('Repriced')
+        cart = self.cart_of({
+            str(short.pk): {'quantity': 3, 'price': '10.00'},
+            str(empty.pk): {'quantity': 1, 'price': '10.00'},
+            str(hidden.pk): {'quantity': 1, 'price': '10.00'},
+            str(repriced.pk): {'quantity': 1, 'price': '8.00'},
+            '999999': {'quantity': 1, 'price': '10.00'},
+        })
+        validation = validate_cart(cart)
+        codes = {problem.product_id: problem.code for problem in validation.problems}
+        self.assertEqual(codes, {
+            short.pk: CartProblem.INSUFFICIENT_STOCK,
+            empty.pk: CartProblem.OUT_OF_STOCK,
+            hidden.pk: CartProblem.UNAVAILABLE,
+            repriced.pk: CartProblem.PRICE_CHANGED,
+            999999: CartProblem.MISSING,
+        })
+        self.assertFalse(validation.is_valid)
+        self.assertEqual(len(validation.errors), 4)
+        self.assertNotIn('999999', cart)
+        self.assertEqual(cart.data[str(repriced.pk)]['price'], '10.00')
+
+
+class OrderConditionalGetTests(TestCase):
+    def setUp(self):
+        vendor_user = User.objects.create_user(username='vendor', password='pass')
+        vendor = Vendor.objects.create(user=vendor_user, shop_name='Shop')
+        category = Category.objects.create(name='General', slug='general')
+        product = Product.objects.create(
+            vendor=vendor,
+            category=category,
+            name='Laptop',
+            price='100.00',
+            stock=5,
+            status=Product.Status.ACTIVE
+        )
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        self.client.force_login(self.customer)
+        self.order = begin_payment(
+            self.customer,
+            [CartLine(product, 1, Decimal('100.00'))],
+            '1 Main Street',
+            '0700000000'
+        )
+
+    def test_order_detail_is_not_modified_until_the_order_changes(self):
+        url = reverse('orders:order_detail', args=[self.order.pk])
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        confirm_payment(self.order.pk, 'ch_1')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_order_history_etag_is_per_customer(self):
+        url = reverse('orders:order_history')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        other = User.objects.create_user(username='other', password='pass')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_other_customers_order_is_still_404(self):
+        other = User.objects.create_user(username='other', password='pass')
+        self.client.force_login(other)
+        response = self.client.get(reverse('orders:order_detail', args=[self.order.pk]))
+        self.assertEqual(response.status_code, 404)
+
+
+class VendorOrderTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='General', slug='general')
+        self.products = []
+        for name, price in (('lamp', '10.00'), ('rug', '30.00')):
+            user = User.objects.create_user(username=name, password='pass')
+            vendor = Vendor.objects.create(user=user, shop_name=name.title())
+            self.products.append(Product.objects.create(
+                vendor=vendor, category=category, name=name.title(),
+                price=price, stock=10, status=Product.Status.ACTIVE
+            ))
+        self.customer = User.objects.create_user(username='customer', password='pass')
+        lamp, rug = self.products
+        self.order = begin_payment(
+            self.customer,
+            [CartLine(lamp, 2, Decimal('10.00')), CartLine(rug, 1, Decimal('30.00'))],
+            '1 Main Street',
+            '0700000000'
+        )
+
+    def parts(self):
+        return dict(self.order.vendor_orders.values_list('vendor__shop_name', 'status'))
+
+    def test_checkout_splits_the_order_per_vendor(self):
+        subtotals = dict(self.order.vendor_orders.values_list('vendor__shop_name', 'subtotal'))
+        self.assertEqual(subtotals, {'Lamp': Decimal('20.00'), 'Rug': Decimal('30.00')})
+        confirm_payment(self.order.pk, 'ch_1')
+        self.assertEqual(set(self.parts().values()), {Order.Status.PROCESSING})
+
+    def test_released_payment_cancels_every_part(self):
+        release_payment(self.order.pk)
+        self.assertEqual(set(self.parts().values()), {Order.Status.CANCELLED})
+
+    def test_order_status_follows_the_slowest_vendor(self):
+        confirm_payment(self.order.pk, 'ch_1')
+        lamp, rug = self.order.vendor_orders.order_by('vendor__shop_name')
+        self.assertFalse(fulfillment.set_status(lamp, Order.Status.SHIPPED))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.PROCESSING)
+        self.assertTrue(fulfillment.set_status(rug, Order.Status.CANCELLED))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.SHIPPED)
+        fulfillment.set_status(lamp, Order.Status.DELIVERED)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.DELIVERED)
+        self.assertEqual(self.parts(), {'Lamp': Order.Status.DELIVERED, 'Rug': Order.Status.CANCELLED})
+
+    def test_line_changes_adjust_the_vendor_subtotal(self):
+        line = OrderItem.objects.get(order=self.order, product=self.products[0])
+        line.quantity = 3
+        line.save()
+        part = VendorOrder.objects.get(order=self.order, vendor_id=line.vendor_id)
+        self.assertEqual(part.subtotal, Decimal('30.00'))
+        line.delete()
+        part.refresh_from_db()
+        self.assertEqual(part.subtotal, Decimal('0.00'))
+
+    def test_customer_sees_each_vendors_part(self):
+        self.client.force_login(self.customer)
+        response = self.client.get(reverse('orders:order_detail', args=[self.order.pk]))
+        parts = response.context['vendor_orders']
+        self.assertEqual([len(part.lines) for part in parts], [1, 1])
+        self.assertContains(response, 'Rug')
+
+    def test_vendors_cannot_set_payment_statuses(self):
+        lamp, rug = self.order.vendor_orders.order_by('vendor__shop_name')
+        # Not paid yet: nothing to ship or cancel
+        for status in (Order.Status.SHIPPED, Order.Status.CANCELLED):
+            with self.assertRaises(fulfillment.InvalidTransition):
+                fulfillment.vendor_set_status(lamp, status)
+        confirm_payment(self.order.pk, 'ch_1')
+        for status in (Order.Status.AWAITING_PAYMENT, Order.Status.REFUNDED, Order.Status.PENDING, 'bogus'):
+            with self.assertRaises(fulfillment.InvalidTransition):
+                fulfillment.vendor_set_status(lamp, status)
+        fulfillment.vendor_set_status(lamp, Order.Status.SHIPPED)
+        with self.assertRaises(fulfillment.InvalidTransition):
+            fulfillment.vendor_set_status(lamp, Order.Status.CANCELLED)
+        self.assertEqual(self.parts(), {'Lamp': Order.Status.SHIPPED, 'Rug': Order.Status.PROCESSING})
+
+    @override_settings(PAYMENT_GATEWAY='orders.payments.FakeGateway')
+    def test_vendor_cancel_refunds_its_part_and_returns_stock(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        confirm_payment(self.order.pk, 'ch_1')
+        rug = self.order.vendor_orders.get(vendor__shop_name='Rug')
+        self.assertTrue(fulfillment.vendor_set_status(rug, Order.Status.CANCELLED))
+        self.assertEqual(get_gateway().refunds, [{'id': mock.ANY, 'charge': 'ch_1', 'amount': 3000}])
+        self.assertEqual(self.parts(), {'Lamp': Order.Status.PROCESSING, 'Rug': Order.Status.REFUNDED})
+        self.products[1].refresh_from_db()
+        self.assertEqual(self.products[1].stock, 10)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.status, Order.Status.PROCESSING)
+        self.assertEqual((refund_late_charges(), fulfillment.refund_cancelled_parts()), (0, 0))
+
+    @override_settings(PAYMENT_GATEWAY='orders.payments.FakeGateway')
+    def test_failed_part_refund_is_retried(self):
+        reset_gateway()
+        self.addCleanup(reset_gateway)
+        confirm_payment(self.order.pk, 'ch_1')
+        rug = self.order.vendor_orders.get(vendor__shop_name='Rug')
+        with mock.patch.object(FakeGateway, '_refund', side_effect=PaymentError('refused')):
+            self.assertFalse(fulfillment.vendor_set_status(rug, Order.Status.CANCELLED))
+        self.assertEqual(self.parts()['Rug'], Order.Status.CANCELLED)
+        out = StringIO()
+        call_command('release_stale_payments', stdout=out)
+        self.assertIn('and 1 cancelled vendor orders', out.getvalue())
+        self.assertEqual(self.parts()['Rug'], Order.Status.REFUNDED)
+        self.assertEqual(len(get_gateway().refunds), 1)
+
+
+class GatewayResilienceTests(TestCase):
+    def test_retries_reuse_idempotency_key_and_charge_once(self):
+        gateway = FakeGateway(retries=2)
+        attempts = []
+        original = gateway._charge
+
+        def flaky(**kwargs):
+            attempts.append(kwargs['idempotency_key'])
+            if len(attempts) < 3:
+                raise TransientGatewayError('timeout')
+            return original(**kwargs)
+
+        gateway._charge = flaky
+        charge_id = gateway.charge(1000, 'usd', 'tok_visa', idempotency_key='order-1-tok')
+        self.assertEqual(attempts, ['order-1-tok'] * 3)
+        self.assertEqual([charge['id'] for charge in gateway.charges], [charge_id])
+        self.assertEqual(gateway.charge(1000, 'usd', 'tok_visa', idempotency_key='order-1-tok'), charge_id)
+        self.assertEqual(len(gateway.charges), 1)
+
+    def test_circuit_opens_and_fails_fast(self):
+        gateway = FakeGateway(failure_rate=1, retries=0, failure_threshold=2, reset_timeout=60)
+        for _ in range(2):
+            with self.assertRaises(PaymentOutcomeUnknown):
+                gateway.charge(1000, 'usd', 'tok_visa')
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(GatewayUnavailable):
+            gateway.charge(1000, 'usd', 'tok_visa')
+
+    def test_half_open_trial_closes_circuit(self):
+        now = [0.0]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10, clock=lambda: now[0])
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+        now[0] = 11
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_read_timeout_is_transient(self):
+        gateway = FakeGateway(latency=0.05, read_timeout=0.01, retries=0)
+        with self.assertRaises(PaymentOutcomeUnknown):
+            gateway.charge(1000, 'usd', 'tok_visa')
+
+    def test_unexpected_error_in_half_open_trial_does_not_wedge_the_circuit(self):
+        now = [0.0]
+        gateway = FakeGateway(retries=0, failure_threshold=1, reset_timeout=10)
+        gateway.breaker.clock = lambda: now[0]
+        gateway.breaker.record_failure()
+        now[0] = 11
+        with mock.patch.object(gateway, '_charge', side_effect=RuntimeError('bug')):
+            with self.assertRaises(RuntimeError):
+                gateway.charge(1000, 'usd', 'tok_visa')
+        # The next call is let through as a new trial and closes the circuit
+        self.assertTrue(gateway.charge(1000, 'usd', 'tok_visa'))
+        self.assertEqual(gateway.breaker.state, CircuitBreaker.CLOSED)
+
+
+    def test_call_started_before_the_trial_does_not_end_it(self):
+        now = [0.0]
+        gateway = FakeGateway(retries=0, failure_threshold=1, reset_timeout=10)
+        gateway.breaker.clock = lambda: now[0]
+
+        def slow_charge(**kwargs):
+            # The circuit opens and its trial starts while this call runs
+            gateway.breaker.record_failure()
+            now[0] = 11
+            self.assertEqual(gateway.breaker.allow(), CircuitBreaker.HALF_OPEN)
+            raise RuntimeError('bug')
+
+        with mock.patch.object(gateway, '_charge', side_effect=slow_charge):
+            with self.assertRaises(RuntimeError):
+                gateway.charge(1000, 'usd', 'tok_visa')
+        self.assertIsNone(gateway.breaker.allow())
+
+
+class OrderTotalTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='vendor', password='pass')
+        vendor = Vendor.objects.create(user=user, shop_name='Shop')
+        category = Category.objects.create(name='General', slug='general')
+        self.lamp, self.rug = (
+            Product.objects.create(
+                vendor=vendor, category=category, name=name,
+                price=price, stock=10, status=Product.Status.ACTIVE
+            )
+            for name, price in (('Lamp', '10.00'), ('Rug', '30.00'))
+        )
+        customer = User.objects.create_user(username='customer', password='pass')
+        self.order = Order.objects.create(
+            customer=customer, total=0, delivery_address='1 Main Street', phone='0700000000'
+        )
+        OrderItem.objects.create(order=self.order, product=self.lamp, quantity=2, price=Decimal('10.00'))
+
+    def total(self):
+        self.order.refresh_from_db(fields=['total'])
+        return self.order.total
+
+    def test_new_changed_and_deleted_lines_adjust_the_total(self):
+        self.assertEqual(self.total(), Decimal('20.00'))
+        rug = OrderItem.objects.create(order=self.order, product=self.rug, quantity=1, price=Decimal('30.00'))
+        self.assertEqual(self.total(), Decimal('50.00'))
+
+        rug.quantity = 2
+        rug.save()
+        self.assertEqual(self.total(), Decimal('80.00'))
+        rug.price = Decimal('25.00')
+        rug.save()
+        self.assertEqual(self.total(), Decimal('70.00'))
+
+        rug.delete()
+        self.assertEqual(self.total(), Decimal('20.00'))
+        self.assertEqual(self.total(), self.order.items_total())
+
+    def test_line_loaded_with_deferred_fields_uses_the_stored_total(self):
+        line = OrderItem.objects.only('id', 'order', 'quantity').get(order=self.order)
+        line.quantity = 3
+        line.save()
+        self.assertEqual(self.total(), Decimal('30.00'))
+
+    def test_reconcile_command_reports_and_fixes_drift(self):
+        Order.objects.filter(pk=self.order.pk).update(total=Decimal('99.00'))
+        out = StringIO()
+        call_command('reconcile_order_totals', stdout=out)
+        self.assertIn(f'Order #{self.order.pk}: stored 99.00, items sum to 20.00', out.getvalue())
+        self.assertIn('Checked 1 orders, found 1 mismatched totals.', out.getvalue())
+        self.assertEqual(self.total(), Decimal('99.00'))
+
+        out = StringIO()
+        call_command('reconcile_order_totals', '--fix', stdout=out)
+        self.assertIn('fixed 1 mismatched', out.getvalue())
+        self.assertEqual(self.total(), Decimal('20.00'))
+        out = StringIO()
+        call_command('reconcile_order_totals', stdout=out)
+        self.assertIn('found 0 mismatched', out.getvalue())
@@ -5,11 +5,13 @@ app_name = 'orders'
 
 urlpatterns = [
     path('cart/', views.cart, name='cart'),
+    path('cart/summary/', views.cart_summary, name='cart_summary'),
     path('cart/add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
-    path('cart/update/<int:item_id>/', views.update_cart_item, name='update_cart_item'),
-    path('cart/remove/<int:item_id>/', views.remove_from_cart, name='remove_from_cart'),
+    path('cart/update/<int:product_id>/', views.update_cart_item, name='update_cart_item'),
+    path('cart/remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
     path('checkout/', views.checkout, name='checkout'),
     path('checkout/process/', views.process_payment, name='process_payment'),
+    path('checkout/webhook/', views.payment_webhook, name='payment_webhook'),
     path('orders/', views.order_history, name='order_history'),
     path('orders/<int:order_id>/', views.order_detail, name='order_detail'),
 ]
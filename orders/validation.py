@@ -0,0 +1,123 @@
+"""
+Cart validation.
+
+``validate_cart`` checks every cart line against the current product rows
+and the stock other checkouts hold, loaded in a single joined query, and
+reports what is wrong with each line. The cart page shows the problems next
+to their lines, and checkout and payment refuse to continue while any of
+them is blocking.
+"""
+from decimal import Decimal
+
+from django.utils.translation import gettext_lazy as _
+
+
+class CartProblem:
+    """Something wrong with one cart line."""
+
+    MISSING = 'missing'
+    UNAVAILABLE = 'unavailable'
+    OUT_OF_STOCK = 'out_of_stock'
+    INSUFFICIENT_STOCK = 'insufficient_stock'
+    PRICE_CHANGED = 'price_changed'
+
+    # Problems that do not stop the customer from paying
+    WARNINGS = {PRICE_CHANGED}
+
+    def __init__(self, product_id, code, message, name='', available=None):
+        self.product_id = product_id
+        self.code = code
+        self.message = message
+        self.name = name
+        self.available = available
+
+    @property
+    def blocking(self):
+        return self.code not in self.WARNINGS
+
+    def as_dict(self):
+        return {
+            'product_id': self.product_id,
+            'code': self.code,
+            'message': str(self.message),
+            'available': self.available,
+        }
+
+    def __repr__(self):
+        return f'<CartProblem {self.product_id} {self.code}>'
+
+
+class CartValidation:
+    """The priced cart lines plus the problems found on them."""
+
+    def __init__(self, lines, problems):
+        self.lines = lines
+        self.problems = problems
+
+    @property
+    def errors(self):
+        return [problem for problem in self.problems if problem.blocking]
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+
+def validate_cart(cart):
+    """
+    Validate ``cart`` (an orders.cart.Cart) and return a CartValidation.
+
+    Every line gets a ``problems`` list. Lines whose product was deleted
+    are dropped from the cart and reported as MISSING, and price changes
+    are reported once before the cart takes the new price.
+    """
+    session_lines = {pk: dict(line) for pk, line in cart.data.items()}
+    lines = cart.lines()
+    problems = []
+
+    found = {str(line.product.pk) for line in lines}
+    for pk in session_lines.keys() - found:
+        problems.append(CartProblem(
+            int(pk), CartProblem.MISSING,
+            _('This product is no longer sold and was removed from your cart.')
+        ))
+
+    for line in lines:
+        product = line.product
+        line.problems = []
+        if product.status != product.Status.ACTIVE:
+            line.problems.append(CartProblem(
+                product.pk, CartProblem.UNAVAILABLE,
+                _('%(name)s is no longer available.') % {'name': product.name},
+                name=product.name, available=0
+            ))
+        elif product.available <= 0:
+            line.problems.append(CartProblem(
+                product.pk, CartProblem.OUT_OF_STOCK,
+                _('%(name)s is out of stock.') % {'name': product.name},
+                name=product.name, available=0
+            ))
+        elif line.quantity > product.available:
+            line.problems.append(CartProblem(
+                product.pk, CartProblem.INSUFFICIENT_STOCK,
+                _('Only %(stock)s of %(name)s left in stock.') % {
+                    'stock': product.available, 'name': product.name
+                },
+                name=product.name, available=product.available
+            ))
+
+        added_at = session_lines[str(product.pk)].get('price')
+        if added_at is not None and Decimal(added_at) != product.price:
+            line.problems.append(CartProblem(
+                product.pk, CartProblem.PRICE_CHANGED,
+                _('The price of %(name)s changed from $%(old)s to $%(new)s.') % {
+                    'name': product.name, 'old': added_at, 'new': product.price
+                },
+                name=product.name
+            ))
+            # Report a price change once; the cart now shows the new price
+            cart.data[str(product.pk)]['price'] = str(product.price)
+            cart.save()
+        problems.extend(line.problems)
+
+    return CartValidation(lines, problems)
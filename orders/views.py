@@ -1,202 +1,325 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.http import JsonResponse, HttpResponse, Http404
+from django.views.decorators.http import require_POST, require_GET, condition
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_cookie
+from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
-from django.db import transaction
-from .models import Order, OrderItem
+from django.db.models import Count, Max
+from .models import Order
+from .cart import Cart
+from .validation import validate_cart
+from . import checkout as checkout_service
+from .payments import (
+    get_gateway, PaymentError, PaymentDeclined, PaymentOutcomeUnknown, WebhookError,
+    CHARGE_SUCCEEDED, CHARGE_FAILED,
+)
 from products.models import Product
-import stripe
-import json
+from products.inventory import InsufficientStock, hold_stock, with_available_stock
+from products.conditional import make_etag
+import logging
 
-# Initialize Stripe
-stripe.api_key = getattr(settings, 'STRIPE_SECRET_KEY', '')
+logger = logging.getLogger(__name__)
 
-@login_required
 def cart(request):
     """Display shopping cart."""
-    # Get or create cart order for user
-    order, created = Order.objects.get_or_create(
-        customer=request.user,
-        status=Order.Status.PENDING,
-        defaults={
-            'total': 0,
-            'delivery_address': '',
-            'phone': ''
-        }
-    )
+    cart = Cart(request)
+    validation = validate_cart(cart)
     
     context = {
-        'order': order,
-        'items': order.items.all(),
+        'cart': cart,
+        'lines': validation.lines,
+        'problems': validation.problems,
+        'can_checkout': validation.is_valid,
+        'cart_total': Cart.total(validation.lines),
     }
     return render(request, 'orders/cart.html', context)
 
-@login_required
+def cart_summary_etag(request):
+    """Validator for the cart badge: the badge data itself, from the session."""
+    return make_etag(request, *Cart(request).summary().values())
+
+@require_GET
+@vary_on_cookie
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=cart_summary_etag)
+def cart_summary(request):
+    """Lightweight JSON cart badge data (item count and total)."""
+    return JsonResponse(Cart(request).summary())
+
 @require_POST
 def add_to_cart(request, product_id):
     """Add product to cart."""
-    product = get_object_or_404(Product, id=product_id)
+    cart = Cart(request)
+    # Stock this cart's own checkout holds is still available to it
+    product = get_object_or_404(
+        with_available_stock(Product.objects.all(), exclude_holder=cart.holder),
+        id=product_id
+    )
     quantity = int(request.POST.get('quantity', 1))
     
     if not product.is_available:
         messages.error(request, 'Product is not available.')
         return JsonResponse({'success': False, 'message': 'Product not available'})
     
-    if quantity > product.stock:
-        messages.error(request, f'Only {product.stock} items available in stock.')
+    available = product.available_stock
+    if quantity > available:
+        messages.error(request, f'Only {available} items available in stock.')
         return JsonResponse({'success': False, 'message': 'Insufficient stock'})
     
-    # Get or create pending order
-    order, created = Order.objects.get_or_create(
-        customer=request.user,
-        status=Order.Status.PENDING,
-        defaults={'total': 0, 'delivery_address': '', 'phone': ''}
-    )
-    
-    # Add or update order item
-    order_item, created = OrderItem.objects.get_or_create(
-        order=order,
-        product=product,
-        defaults={'quantity': quantity, 'price': product.price}
-    )
-    
-    if not created:
-        order_item.quantity += quantity
-        if order_item.quantity > product.stock:
-            order_item.quantity = product.stock
-        order_item.save()
+    # Add or update the line, never beyond what is in stock
+    cart.add(product, quantity, limit=available)
     
-    order.update_total()
     messages.success(request, f'{product.name} added to cart!')
     
+    summary = cart.summary()
     return JsonResponse({
         'success': True,
         'message': 'Product added to cart',
-        'cart_count': order.items.count()
+        'cart_count': summary['count'],
+        'cart': summary,
     })
 
-@login_required
 @require_POST
-def update_cart_item(request, item_id):
+def update_cart_item(request, product_id):
     """Update cart item quantity."""
-    item = get_object_or_404(OrderItem, id=item_id, order__customer=request.user)
+    cart = Cart(request)
+    if product_id not in cart:
+        raise Http404('Product is not in the cart.')
+    product = get_object_or_404(
+        with_available_stock(Product.objects.all(), exclude_holder=cart.holder),
+        id=product_id
+    )
     quantity = int(request.POST.get('quantity', 1))
     
     if quantity <= 0:
-        item.delete()
+        cart.remove(product_id)
         messages.success(request, 'Item removed from cart.')
-    elif quantity > item.product.stock:
-        messages.error(request, f'Only {item.product.stock} items available.')
+    elif quantity > product.available_stock:
+        messages.error(request, f'Only {product.available_stock} items available.')
     else:
-        item.quantity = quantity
-        item.save()
+        cart.set_quantity(product_id, quantity)
         messages.success(request, 'Cart updated.')
     
     return redirect('orders:cart')
 
-@login_required
 @require_POST
-def remove_from_cart(request, item_id):
+def remove_from_cart(request, product_id):
     """Remove item from cart."""
-    item = get_object_or_404(OrderItem, id=item_id, order__customer=request.user)
-    item.delete()
+    Cart(request).remove(product_id)
     messages.success(request, 'Item removed from cart.')
     return redirect('orders:cart')
 
 @login_required
 def checkout(request):
     """Checkout page with Stripe payment."""
-    order = get_object_or_404(
-        Order,
-        customer=request.user,
-        status=Order.Status.PENDING
-    )
+    cart = Cart(request)
+    validation = validate_cart(cart)
+    lines = validation.lines
     
-    if order.items.count() == 0:
+    if not lines:
         messages.warning(request, 'Your cart is empty.')
         return redirect('orders:cart')
     
-    # Check stock availability
-    for item in order.items.all():
-        if item.quantity > item.product.stock:
-            messages.error(request, f'{item.product.name} is out of stock.')
-            return redirect('orders:cart')
+    # Stock, status and price checks for every line, in one query
+    if not validation.is_valid:
+        messages.error(request, 'Please review the problems in your cart before checking out.')
+        return redirect('orders:cart')
+    for problem in validation.problems:
+        messages.warning(request, problem.message)
+    
+    # Set the stock aside while the customer enters their payment details
+    try:
+        hold_expires_at = hold_stock(cart.holder, cart.quantities())
+    except InsufficientStock:
+        messages.error(request, 'Some items were just taken by other shoppers. Please review your cart.')
+        return redirect('orders:cart')
     
     # Get Stripe publishable key
     stripe_publishable_key = getattr(settings, 'STRIPE_PUBLISHABLE_KEY', '')
     
     context = {
-        'order': order,
+        'lines': lines,
+        'cart_total': Cart.total(lines),
         'stripe_publishable_key': stripe_publishable_key,
+        'hold_expires_at': hold_expires_at,
     }
     return render(request, 'orders/checkout.html', context)
 
 @login_required
 @require_POST
-@transaction.atomic
 def process_payment(request):
-    """Process Stripe payment."""
-    order = get_object_or_404(
-        Order,
-        customer=request.user,
-        status=Order.Status.PENDING
-    )
+    """
+    Process the payment in three short steps (see orders.checkout):
+    reserve stock, charge with no transaction open, then confirm or release.
+    """
+    cart = Cart(request)
+    validation = validate_cart(cart)
+    lines = validation.lines
     
-    if order.items.count() == 0:
+    if not lines:
         return JsonResponse({'success': False, 'message': 'Cart is empty'})
     
+    if validation.problems:
+        # Blocking problems, or a price change the customer has not seen yet
+        return JsonResponse({
+            'success': False,
+            'message': 'Your cart has changed. Please review it before paying.',
+            'problems': [problem.as_dict() for problem in validation.problems],
+        })
+    
+    # Get payment details from request
+    token = request.POST.get('stripeToken')
+    delivery_address = request.POST.get('delivery_address', '')
+    phone = request.POST.get('phone', '')
+    
+    if not delivery_address or not phone:
+        return JsonResponse({
+            'success': False,
+            'message': 'Please provide delivery address and phone number'
+        })
+    
+    # Phase 1: turn the cart into an order awaiting payment and reserve stock
     try:
-        # Get payment details from request
-        token = request.POST.get('stripeToken')
-        delivery_address = request.POST.get('delivery_address', '')
-        phone = request.POST.get('phone', '')
-        
-        if not delivery_address or not phone:
-            return JsonResponse({
-                'success': False,
-                'message': 'Please provide delivery address and phone number'
-            })
-        
-        # Update order with delivery info
-        order.delivery_address = delivery_address
-        order.phone = phone
-        
-        # Create Stripe charge
-        charge = stripe.Charge.create(
+        order = checkout_service.begin_payment(
+            request.user, lines, delivery_address, phone, holder=cart.holder
+        )
+    except checkout_service.CheckoutInProgress:
+        return JsonResponse({
+            'success': False,
+            'message': 'A previous payment is still being processed. Please wait a moment.'
+        })
+    except InsufficientStock as e:
+        names = ', '.join(
+            Product.objects.filter(pk__in=e.product_ids).values_list('name', flat=True)
+        )
+        messages.error(request, f'Not enough stock left for: {names}.')
+        return JsonResponse({'success': False, 'message': 'Insufficient stock'})
+    
+    # Phase 2: charge the provider outside any database transaction.
+    # The idempotency key is stable for this card submission, so gateway
+    # retries can never charge the customer twice.
+    try:
+        transaction_id = get_gateway().charge(
             amount=int(order.total * 100),  # Convert to cents
             currency='usd',
-            description=f'Order #{order.id}',
             source=token,
+            description=f'Order #{order.id}',
+            metadata={'order_id': order.id},
+            idempotency_key=f'order-{order.id}-{token}',
         )
-        
-        # Update order status and reduce stock
-        order.status = Order.Status.PROCESSING
-        order.save()
-        
-        # Reduce product stock
-        for item in order.items.all():
-            item.product.reduce_stock(item.quantity)
-        
-        messages.success(request, f'Payment successful! Order #{order.id} has been placed.')
-        return JsonResponse({
-            'success': True,
-            'message': 'Payment processed successfully',
-            'order_id': order.id
-        })
-        
-    except stripe.error.CardError as e:
+    except PaymentDeclined as e:
+        checkout_service.release_payment(order.id)
         messages.error(request, f'Card error: {e.user_message}')
         return JsonResponse({'success': False, 'message': str(e)})
-    except stripe.error.StripeError as e:
-        messages.error(request, 'Payment processing error. Please try again.')
-        return JsonResponse({'success': False, 'message': str(e)})
-    except Exception as e:
-        messages.error(request, 'An error occurred. Please try again.')
+    except PaymentOutcomeUnknown as e:
+        # Keep the reservation until the webhook settles it
+        # or release_stale_payments gives up on it. Paying again would
+        # only hit CheckoutInProgress, so don't ask for it.
+        messages.info(request, e.user_message)
+        return JsonResponse({
+            'success': False,
+            'pending': True,
+            'order_id': order.id,
+            'message': e.user_message
+        })
+    except PaymentError as e:
+        checkout_service.release_payment(order.id)
+        messages.error(request, e.user_message)
         return JsonResponse({'success': False, 'message': str(e)})
+    except Exception:
+        # Outcome unknown, as above
+        logger.exception('Payment for order %s failed unexpectedly', order.id)
+        message = (
+            'We are confirming your payment with the provider. '
+            'Your order will be updated shortly; there is no need to pay again.'
+        )
+        messages.info(request, message)
+        return JsonResponse({
+            'success': False,
+            'pending': True,
+            'order_id': order.id,
+            'message': message
+        })
+    
+    # Phase 3: confirm (the webhook may already have done it)
+    if not checkout_service.confirm_payment(order.id, transaction_id):
+        order.refresh_from_db(fields=['status'])
+        if order.status in (Order.Status.CANCELLED, Order.Status.REFUNDED):
+            # The charge came back after the order was released; it is refunded
+            messages.error(
+                request,
+                'Your payment was confirmed too late to keep the order and has been refunded. '
+                'Please review your cart and try again.'
+            )
+            return JsonResponse({'success': False, 'message': 'Payment arrived after the order was released'})
+    cart.clear()
+    
+    messages.success(request, f'Payment successful! Order #{order.id} has been placed.')
+    return JsonResponse({
+        'success': True,
+        'message': 'Payment processed successfully',
+        'order_id': order.id
+    })
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """Settle awaiting orders from the payment provider's charge events."""
+    try:
+        outcome, order_id, transaction_id = get_gateway().parse_webhook(
+            request.body,
+            request.headers.get('Stripe-Signature', '')
+        )
+    except WebhookError:
+        return HttpResponse(status=400)
+    
+    if order_id:
+        if outcome == CHARGE_SUCCEEDED:
+            checkout_service.confirm_payment(order_id, transaction_id)
+        elif outcome == CHARGE_FAILED:
+            checkout_service.release_payment(order_id)
+    return HttpResponse(status=200)
+
+def _order_history_etag(request):
+    state = Order.objects.filter(
+        customer=request.user
+    ).exclude(status=Order.Status.PENDING).aggregate(
+        last_modified=Max('updated_at'),
+        count=Count('pk')
+    )
+    return make_etag(request, *state.values())
+
+def _order_detail_state(request, order_id):
+    """
+    (updated_at, status, latest product change, latest vendor order change)
+    of the customer's order, or None.
+    """
+    return Order.objects.filter(
+        id=order_id,
+        customer=request.user
+    ).annotate(
+        products_changed=Max('items__product__updated_at'),
+        parts_changed=Max('vendor_orders__updated_at')
+    ).values_list('updated_at', 'status', 'products_changed', 'parts_changed').first()
+
+def _order_detail_etag(request, order_id):
+    state = _order_detail_state(request, order_id)
+    # No ETag for a missing order; the view then answers 404
+    return make_etag(request, *state) if state else None
+
+def _order_detail_last_modified(request, order_id):
+    state = _order_detail_state(request, order_id)
+    if state is None:
+        return None
+    updated_at, _, products_changed, parts_changed = state
+    return max(updated_at, products_changed or updated_at, parts_changed or updated_at)
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_order_history_etag)
 def order_history(request):
     """Display user's order history."""
     orders = Order.objects.filter(
@@ -209,12 +332,21 @@ def order_history(request):
     return render(request, 'orders/order_history.html', context)
 
 @login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=_order_detail_etag, last_modified_func=_order_detail_last_modified)
 def order_detail(request, order_id):
     """Display order details."""
     order = get_object_or_404(Order, id=order_id, customer=request.user)
+    items = list(order.items.select_related('product'))
+    
+    # The order is shown as its vendors' parts, each with its own status
+    vendor_orders = list(order.vendor_orders.select_related('vendor').order_by('pk'))
+    for vendor_order in vendor_orders:
+        vendor_order.lines = [item for item in items if item.vendor_id == vendor_order.vendor_id]
     
     context = {
         'order': order,
-        'items': order.items.all(),
+        'items': items,
+        'vendor_orders': vendor_orders,
     }
     return render(request, 'orders/order_detail.html', context)
@@ -1,9 +1,13 @@
 from django.contrib import admin
-from .models import Category, Product
+from .models import Category, Product, StockHold
+from .inventory import with_available_stock
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'is_active']
+    list_display = ['name', 'parent', 'slug', 'is_active', 'active_product_count']
+    list_filter = ['is_active', 'parent']
+    ordering = ['path']
+    autocomplete_fields = ['parent']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name', 'slug']
 
@@ -29,7 +33,18 @@ class ProductAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Annotate available stock so the list does not query holds per row
+        return with_available_stock(super().get_queryset(request))
+    
     def is_available_display(self, obj):
         return obj.is_available
     is_available_display.boolean = True
     is_available_display.short_description = 'Available'
+
+
+@admin.register(StockHold)
+class StockHoldAdmin(admin.ModelAdmin):
+    list_display = ['product', 'quantity', 'expires_at', 'created_at']
+    list_select_related = ['product']
+    search_fields = ['product__name']
@@ -0,0 +1,125 @@
+"""
+Fragment cache for catalog product cards and product detail pages.
+
+The shared part of a card (image, category, vendor, price, stock badge) is
+rendered once and stored under ``product-card:<id>`` together with the
+product's ``updated_at`` and availability. A cached card is only served
+while both still match the product being listed, so stock changes made
+with queryset updates (which bump ``updated_at`` but send no signals) and
+stock holds never show a stale badge. Saving or deleting a product, or
+its category or vendor, deletes the entry outright (see products.signals).
+
+The body of the product detail page is cached the same way, under
+``product-card:detail:<id>``.
+
+Per-user markup such as the add-to-cart form and its CSRF token is
+rendered by the page templates outside the fragments. A catalog page
+fetches all of its cards with one get_many and stores the ones it had to
+render with one set_many (``render_cards``).
+
+Hits and misses are counted in the same cache, once per page, so every
+worker reports into one total; see the ``product_card_stats`` command.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import render_to_string
+
+CARD_TEMPLATE = 'products/includes/product_card.html'
+DETAIL_TEMPLATE = 'products/includes/product_detail.html'
+KEY_PREFIX = 'product-card'
+HITS_KEY = f'{KEY_PREFIX}:hits'
+MISSES_KEY = f'{KEY_PREFIX}:misses'
+
+
+def get_cache():
+    return caches[getattr(settings, 'PRODUCT_CARD_CACHE', 'default')]
+
+
+def card_key(product_id):
+    return f'{KEY_PREFIX}:{product_id}'
+
+
+def detail_key(product_id):
+    return f'{KEY_PREFIX}:detail:{product_id}'
+
+
+def _version(product):
+    return (product.updated_at.isoformat(), product.is_available)
+
+
+def render_card(product):
+    """Return the card markup for ``product``, from the cache when still current."""
+    return render_cards([product])[0]
+
+
+def render_cards(products):
+    """
+    Return the card markup of each of ``products``, in order, with one
+    cache read and at most one cache write for the whole page.
+    """
+    return _render(products, card_key, CARD_TEMPLATE)
+
+
+def render_detail(product):
+    """Return the detail page body for ``product``, from the cache when still current."""
+    return _render([product], detail_key, DETAIL_TEMPLATE)[0]
+
+
+def _render(products, key_func, template_name):
+    cache = get_cache()
+    products = list(products)
+    keys = [key_func(product.pk) for product in products]
+    cached = cache.get_many(keys)
+    html = []
+    rendered = {}
+    for product, key in zip(products, keys):
+        version = _version(product)
+        entry = cached.get(key)
+        if entry is not None and entry[0] == version:
+            html.append(entry[1])
+            continue
+        fragment = render_to_string(template_name, {'product': product})
+        rendered[key] = (version, fragment)
+        html.append(fragment)
+
+    if rendered:
+        cache.set_many(rendered, getattr(settings, 'PRODUCT_CARD_CACHE_TIMEOUT', 24 * 60 * 60))
+    _count(cache, HITS_KEY, len(products) - len(rendered))
+    _count(cache, MISSES_KEY, len(rendered))
+    return html
+
+
+def invalidate_cards(product_ids):
+    """Drop the cached cards and detail fragments of ``product_ids``."""
+    keys = []
+    for pk in product_ids:
+        keys += [card_key(pk), detail_key(pk)]
+    get_cache().delete_many(keys)
+
+
+def _count(cache, key, delta):
+    if not delta:
+        return
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        # First hit or miss since the counter was reset or evicted
+        if not cache.add(key, delta, timeout=None):
+            cache.incr(key, delta)
+
+
+def get_stats():
+    """Return hits, misses and the hit rate (0-1) since the last reset."""
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits = counts.get(HITS_KEY, 0)
+    misses = counts.get(MISSES_KEY, 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': hits / total if total else 0.0,
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
@@ -0,0 +1,143 @@
+"""
+The category tree.
+
+Category.path holds the ids from the root down ('3/12/40/'), so "this
+category and all of its subcategories" is a single indexed prefix match
+on the category table.
+
+The tree of active categories is built with one query and cached, since
+every page's navigation menu and the catalog filter read it. Each node
+carries the ids of its whole subtree (inactive subcategories included),
+so the catalog filters products with ``category_id IN (...)`` and keeps
+using the (status, category, ...) product indexes; a join on the path
+could not. A subcategory of an inactive category is shown as a top-level
+category. products.signals drops the cached tree whenever a category is
+saved or deleted.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+TREE_CACHE_KEY = 'catalog:category-tree'
+
+
+class CategoryNode:
+    """An active category in the cached tree."""
+
+    def __init__(self, pk, name, slug, path, parent_id):
+        self.pk = self.id = pk
+        self.name = name
+        self.slug = slug
+        self.path = path
+        self.parent_id = parent_id
+        self.depth = 0
+        self.children = []
+        # This category and every category below it, active or not
+        self.subtree_ids = [pk]
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def indented_name(self):
+        return '— ' * self.depth + self.name
+
+
+class CategoryTree:
+    """Active categories by id and in depth-first, by-name order."""
+
+    def __init__(self, nodes):
+        self.nodes = {node.pk: node for node in nodes}
+        self.roots = []
+        for node in nodes:
+            parent = self.nodes.get(node.parent_id)
+            (parent.children if parent else self.roots).append(node)
+        self.ordered = []
+        self._walk(self.roots, 0)
+
+    def _walk(self, nodes, depth):
+        for node in nodes:
+            node.depth = depth
+            self.ordered.append(node)
+            self._walk(node.children, depth + 1)
+
+    def __iter__(self):
+        return iter(self.ordered)
+
+    def __len__(self):
+        return len(self.ordered)
+
+    def get(self, category_id):
+        """The node for ``category_id`` (an int or a query string value), or None."""
+        try:
+            return self.nodes.get(int(category_id))
+        except (TypeError, ValueError):
+            return None
+
+    def lineage(self, category_id):
+        """The active categories from the root down to ``category_id``, for breadcrumbs."""
+        node = self.get(category_id)
+        if node is None:
+            return []
+        ids = [int(pk) for pk in node.path.strip('/').split('/')]
+        return [self.nodes[pk] for pk in ids if pk in self.nodes]
+
+    def facets(self, counts):
+        """
+        Nodes whose subtree has products, each with a ``facet_count`` that
+        includes its subcategories. ``counts`` is {category id: own count}.
+        """
+        totals = {}
+        for node in reversed(self.ordered):
+            totals[node.pk] = counts.get(node.pk, 0) + sum(totals[child.pk] for child in node.children)
+        facets = []
+        for node in self.ordered:
+            if totals[node.pk]:
+                node.facet_count = totals[node.pk]
+                facets.append(node)
+        return facets
+
+
+def build_tree():
+    from .models import Category
+
+    rows = Category.objects.order_by('name', 'pk').values_list(
+        'pk', 'name', 'slug', 'path', 'parent_id', 'is_active'
+    )
+    nodes = {}
+    paths = []
+    for pk, name, slug, path, parent_id, is_active in rows:
+        paths.append((pk, path))
+        if is_active:
+            nodes[pk] = CategoryNode(pk, name, slug, path, parent_id)
+    # Add every category to the subtrees of its active ancestors
+    for pk, path in paths:
+        for ancestor in path.strip('/').split('/')[:-1]:
+            node = nodes.get(int(ancestor))
+            if node is not None:
+                node.subtree_ids.append(pk)
+    return CategoryTree(list(nodes.values()))
+
+
+def get_category_tree():
+    tree = cache.get(TREE_CACHE_KEY)
+    if tree is None:
+        tree = build_tree()
+        cache.set(TREE_CACHE_KEY, tree, getattr(settings, 'CATEGORY_TREE_CACHE_TIMEOUT', 60 * 60))
+    return tree
+
+
+def invalidate_category_tree():
+    cache.delete(TREE_CACHE_KEY)
+
+
+def filter_by_category(products, category_id):
+    """Products in the category ``category_id`` or any of its subcategories."""
+    node = get_category_tree().get(category_id)
+    if node is not None:
+        # Literal ids, so a leaf category is an equality on the index prefix
+        return products.filter(category_id__in=node.subtree_ids)
+    # An inactive category has no node; match its own products only
+    try:
+        return products.filter(category_id=int(category_id))
+    except (TypeError, ValueError):
+        return products.none()
@@ -0,0 +1,28 @@
+"""
+Helpers for conditional GET (ETag / 304 Not Modified).
+
+Views wrap themselves in django.views.decorators.http.condition() with an
+ETag function that runs one cheap aggregate query instead of the full
+queryset and template. The ETag always includes who is asking, since the
+pages carry the visitor's name and navigation.
+"""
+import hashlib
+
+from django.conf import settings
+
+
+def has_pending_messages(request):
+    """Flash messages are rendered into the page, so it must be sent in full."""
+    return bool(request.COOKIES.get(getattr(settings, 'MESSAGE_COOKIE_NAME', 'messages')))
+
+
+def make_etag(request, *parts):
+    """
+    Build an ETag from ``parts`` and the requesting user, or return None
+    (no conditional handling) while messages are pending.
+    """
+    if has_pending_messages(request):
+        return None
+    user = request.user.pk if request.user.is_authenticated else 'anonymous'
+    payload = '|'.join(str(part) for part in (request.path, user, *parts))
+    return hashlib.md5(payload.encode()).hexdigest()
@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .categories import get_category_tree
+
+
+def category_tree(request):
+    """The cached category tree for the navigation menu, read only if a template uses it."""
+    return {'category_tree': SimpleLazyObject(get_category_tree)}
@@ -0,0 +1,81 @@
+"""
+Category facet counts for the catalog filter.
+
+Category.active_product_count holds the number of active, in-stock
+products in each category. It is kept current incrementally:
+
+* Product.save() moves a product between counts when its status, stock
+  or category changes, and a post_delete signal drops deleted products;
+* the stock helpers in products.inventory, which update stock without
+  saving the model, report sell-outs and restocks through
+  ``record_stock_changes``.
+
+``refresh_category_counts`` recomputes every count in one UPDATE. Run it
+from the ``refresh_category_counts`` command to repair any drift, for
+example after raw SQL or queryset updates elsewhere.
+
+With a search query the stored counts do not apply, so the facets are
+computed from the search results with a single GROUP BY instead. Either
+way each category's facet includes its subcategories, rolled up along the
+cached category tree (products.categories).
+"""
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .categories import get_category_tree
+from .models import Category, Product
+
+
+def counted_products(queryset=None):
+    """Products that count towards a facet: active and in stock."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.filter(status=Product.Status.ACTIVE, stock__gt=0)
+
+
+def category_facets(search_results=None):
+    """
+    Return the active categories that have products, in tree order, each
+    with a ``facet_count`` that includes its subcategories. Pass the
+    search-filtered product queryset to count within the search results
+    (one GROUP BY query) instead of reading the stored counts.
+    """
+    if search_results is None:
+        counts = Category.objects.filter(active_product_count__gt=0).values_list(
+            'pk', 'active_product_count'
+        )
+    else:
+        counts = counted_products(search_results).order_by().values('category').annotate(
+            count=Count('pk', distinct=True)
+        ).values_list('category', 'count')
+    return get_category_tree().facets(dict(counts))
+
+
+def record_stock_changes(changes, using=None):
+    """
+    Adjust category counts after stock was changed with queryset updates.
+    ``changes`` is {product_id: stock delta}; the current stock and
+    category are read back in one query.
+    """
+    if not changes:
+        return
+    products = Product.objects.using(using).filter(
+        pk__in=changes,
+        status=Product.Status.ACTIVE
+    ).values_list('pk', 'category_id', 'stock')
+    for pk, category_id, stock in products:
+        was_counted = stock - changes[pk] > 0
+        if was_counted and stock <= 0:
+            Category.adjust_product_count(category_id, -1, using)
+        elif stock > 0 and not was_counted:
+            Category.adjust_product_count(category_id, 1, using)
+
+
+def refresh_category_counts(using=None):
+    """Recompute every category's active product count. Returns the number of categories."""
+    counts = counted_products(Product.objects.using(using)).filter(
+        category=OuterRef('pk')
+    ).order_by().values('category').annotate(count=Count('pk')).values('count')
+    return Category.objects.using(using).update(
+        active_product_count=Coalesce(Subquery(counts, output_field=IntegerField()), Value(0))
+    )
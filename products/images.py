@@ -0,0 +1,226 @@
+"""
+Responsive image derivatives.
+
+Every uploaded Product.image and Vendor.logo gets resized copies at
+IMAGE_DERIVATIVE_WIDTHS, in WebP and in JPEG as a fallback, stored next to
+the other media under ``derivatives/``:
+
+    cas/3f/a1/3fa1...9c.png -> derivatives/cas/3f/a1/3fa1...9c-400w-q80.webp
+                               derivatives/cas/3f/a1/3fa1...9c-400w-q80.jpg
+
+Names are derived from the original's name, so templates can build a
+``srcset`` without a lookup table (see the ``responsive_image`` tag). They
+also carry the encoder quality: a name always stands for the same original,
+width, format and settings, so it is served immutable, and changing
+IMAGE_DERIVATIVE_QUALITY moves every image to new URLs instead of
+rewriting files browsers have cached.
+
+The Pillow work runs in a process pool after the saving transaction
+commits, so uploads never wait for it and the GIL is not held by image
+decoding. Set IMAGE_DERIVATIVES_ASYNC = False to generate them inline,
+e.g. in tests. The ``generate_image_derivatives`` command backfills
+existing media.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVES_DIR = 'derivatives'
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+READY_CACHE_PREFIX = 'img-derivatives'
+FAILED_CACHE_PREFIX = 'img-derivatives-failed'
+
+
+def get_widths():
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (200, 400, 800)))
+
+
+def get_quality():
+    return getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+
+
+def derivative_name(name, width, extension):
+    path = PurePosixPath(name)
+    return str(
+        PurePosixPath(DERIVATIVES_DIR) / path.parent
+        / f'{path.stem}-{width}w-q{get_quality()}.{extension}'
+    )
+
+
+def derivative_names(name):
+    """Every derivative name of ``name``."""
+    return [
+        derivative_name(name, width, extension)
+        for width in get_widths()
+        for extension in FORMATS
+    ]
+
+
+def has_derivatives(name):
+    """
+    True once the derivatives of ``name`` exist. Uploaded names are never
+    reused for other content, so a positive answer is cached for a day; a
+    negative one for IMAGE_DERIVATIVE_MISSING_CACHE_TIMEOUT seconds, so an
+    image whose derivatives are not ready does not cost a storage lookup
+    on every render. generate_derivatives marks the name ready when done.
+    """
+    if not name:
+        return False
+    key = _ready_key(name)
+    ready = cache.get(key)
+    if ready is not None:
+        return ready
+    ready = default_storage.exists(derivative_name(name, max(get_widths()), 'jpg'))
+    if ready:
+        _mark_ready(name)
+    else:
+        cache.set(key, False, getattr(settings, 'IMAGE_DERIVATIVE_MISSING_CACHE_TIMEOUT', 60))
+    return ready
+
+
+def _mark_ready(name):
+    cache.set(_ready_key(name), True, 24 * 60 * 60)
+    cache.delete(f'{FAILED_CACHE_PREFIX}:{name}')
+
+
+def has_failed(name):
+    """True if generating the derivatives of ``name`` failed recently."""
+    return bool(name) and cache.get(f'{FAILED_CACHE_PREFIX}:{name}', False)
+
+
+def mark_failed(name):
+    """
+    Remember that ``name`` could not be resized (e.g. a corrupt upload), so
+    saving its row again does not resubmit it. The backfill command still
+    retries it.
+    """
+    cache.set(
+        f'{FAILED_CACHE_PREFIX}:{name}',
+        True,
+        getattr(settings, 'IMAGE_DERIVATIVE_FAILED_CACHE_TIMEOUT', 24 * 60 * 60)
+    )
+
+
+def generate_derivatives(name, force=False):
+    """
+    Write every derivative of the stored image ``name`` and return their
+    names. Existing derivatives are kept unless ``force`` is set; since a
+    name fixes the encoder settings, forcing only repairs damaged files.
+    """
+    from PIL import Image, ImageOps
+
+    targets = derivative_names(name)
+    if not force and all(default_storage.exists(target) for target in targets):
+        return targets
+
+    with default_storage.open(name, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    quality = get_quality()
+
+    written = []
+    for width in get_widths():
+        resized = image.copy()
+        # Never upscale; a small original is re-encoded at its own size
+        resized.thumbnail((width, width * 10), Image.LANCZOS)
+        for extension, (pil_format, _) in FORMATS.items():
+            frame = resized
+            if pil_format == 'JPEG' and frame.mode != 'RGB':
+                background = Image.new('RGB', frame.size, 'white')
+                background.paste(frame, mask=frame.getchannel('A') if frame.mode == 'RGBA' else None)
+                frame = background
+            buffer = BytesIO()
+            frame.save(buffer, pil_format, quality=quality, optimize=True)
+            target = derivative_name(name, width, extension)
+            if default_storage.exists(target):
+                default_storage.delete(target)
+            written.append(default_storage.save(target, ContentFile(buffer.getvalue())))
+    _mark_ready(name)
+    return written
+
+
+def _ready_key(name):
+    return f'{READY_CACHE_PREFIX}:q{get_quality()}:{name}'
+
+
+def delete_derivatives(name):
+    """Delete the derivatives of ``name``, whatever settings wrote them."""
+    path = PurePosixPath(name)
+    directory = str(PurePosixPath(DERIVATIVES_DIR) / path.parent)
+    if default_storage.exists(directory):
+        for filename in default_storage.listdir(directory)[1]:
+            if filename.startswith(f'{path.stem}-'):
+                default_storage.delete(f'{directory}/{filename}')
+    cache.delete(_ready_key(name))
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    import django
+    django.setup()
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The per-process pool that runs the Pillow work."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ProcessPoolExecutor(
+                    max_workers=getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2),
+                    # Forking a threaded server process is unsafe; start clean workers
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', 'sokohub.settings'),),
+                )
+    return _executor
+
+
+def schedule_derivatives(name, on_done=None):
+    """
+    Generate the derivatives of ``name`` in the background, then call
+    ``on_done(names)`` in this process.
+    """
+    if not getattr(settings, 'IMAGE_DERIVATIVES_ASYNC', True):
+        try:
+            names = generate_derivatives(name)
+        except Exception:
+            mark_failed(name)
+            raise
+        if on_done:
+            on_done(names)
+        return
+
+    def finished(future):
+        try:
+            names = future.result()
+        except Exception:
+            logger.exception('Generating image derivatives for %s failed', name)
+            mark_failed(name)
+            return
+        # The pool process may not share this process's cache
+        _mark_ready(name)
+        if on_done:
+            on_done(names)
+
+    get_executor().submit(generate_derivatives, name).add_done_callback(finished)
@@ -0,0 +1,151 @@
+"""
+Stock reservation for checkout.
+
+Stock is decremented with conditional ``UPDATE ... SET stock = stock - n
+WHERE stock >= n`` statements, one per product, taken in primary-key order
+inside a single transaction. The database row lock taken by each UPDATE
+serialises concurrent checkouts of the same product, the WHERE clause makes
+overselling impossible, and ordering by id keeps two multi-line checkouts
+from deadlocking on each other.
+
+Between the checkout page and the payment, a StockHold sets the cart's
+quantities aside for STOCK_HOLD_TTL seconds. Held stock is not available
+to anyone else. It is computed as ``stock - SUM(unexpired holds)`` in the
+same query that loads the products.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .facets import record_stock_changes
+from .models import Product, StockHold
+
+
+class InsufficientStock(Exception):
+    """Raised when one or more lines cannot be reserved; nothing is changed."""
+
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        super().__init__(f'Insufficient stock for products {self.product_ids}')
+
+
+def held_quantity(product, exclude_holder=None, now=None):
+    """
+    Expression for the quantity of ``product`` (an id or an OuterRef) held
+    by unexpired holds, other than those of ``exclude_holder``.
+    """
+    holds = StockHold.objects.filter(
+        product=product,
+        expires_at__gt=now or timezone.now()
+    )
+    if exclude_holder:
+        holds = holds.exclude(holder=exclude_holder)
+    total = holds.values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def with_available_stock(queryset, exclude_holder=None):
+    """
+    Annotate products with ``held`` and ``available`` (stock minus active
+    holds). Pass the current checkout's holder to ignore its own holds.
+    """
+    return queryset.annotate(
+        held=held_quantity(OuterRef('pk'), exclude_holder)
+    ).annotate(
+        available=F('stock') - F('held')
+    )
+
+
+def hold_stock(holder, quantities, ttl=None, using=None):
+    """
+    Hold ``quantities`` ({product_id: quantity}) for ``holder`` for ``ttl``
+    seconds (default STOCK_HOLD_TTL), replacing the holder's previous holds.
+    All or nothing: raises InsufficientStock listing every short product.
+    Returns the expiry time.
+    """
+    if ttl is None:
+        ttl = getattr(settings, 'STOCK_HOLD_TTL', 600)
+    quantities = {pk: quantity for pk, quantity in quantities.items() if quantity > 0}
+    with transaction.atomic(using=using):
+        now = timezone.now()
+        # Lock the product rows so concurrent holds on them are serialised
+        products = with_available_stock(
+            Product.objects.using(using).select_for_update().filter(pk__in=quantities).order_by('pk'),
+            exclude_holder=holder
+        )
+        available = dict(products.values_list('pk', 'available'))
+        short = [
+            pk for pk in sorted(quantities)
+            if available.get(pk, 0) < quantities[pk]
+        ]
+        if short:
+            raise InsufficientStock(short)
+
+        expires_at = now + timedelta(seconds=ttl)
+        StockHold.objects.using(using).filter(holder=holder).delete()
+        StockHold.objects.using(using).bulk_create([
+            StockHold(product_id=pk, holder=holder, quantity=quantity, expires_at=expires_at)
+            for pk, quantity in quantities.items()
+        ])
+    return expires_at
+
+
+def release_holds(holder, using=None):
+    """Drop every hold of ``holder``. Returns the number of holds removed."""
+    deleted, _ = StockHold.objects.using(using).filter(holder=holder).delete()
+    return deleted
+
+
+def release_expired_holds(now=None, using=None):
+    """Delete expired holds in one statement. Returns the number removed."""
+    deleted, _ = StockHold.objects.using(using).filter(
+        expires_at__lte=now or timezone.now()
+    ).delete()
+    return deleted
+
+
+def reserve_stock(quantities, using=None, holder=None):
+    """
+    Take ``quantities`` ({product_id: quantity}) out of stock, all or nothing.
+    Stock held by other checkouts is not touched; the ``holder``'s own holds
+    are converted into the reservation and removed.
+    Raises InsufficientStock listing every short product and rolls back
+    the lines already reserved.
+    """
+    short = []
+    with transaction.atomic(using=using):
+        now = timezone.now()
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            if quantity <= 0:
+                continue
+            updated = Product.objects.using(using).filter(
+                pk=product_id,
+                stock__gte=Value(quantity) + held_quantity(product_id, holder, now)
+            ).update(stock=F('stock') - quantity, updated_at=now)
+            if not updated:
+                short.append(product_id)
+        if short:
+            raise InsufficientStock(short)
+        record_stock_changes({pk: -quantity for pk, quantity in quantities.items() if quantity > 0}, using)
+        if holder:
+            StockHold.objects.using(using).filter(holder=holder).delete()
+
+
+def release_stock(quantities, using=None):
+    """Put previously reserved ``quantities`` back into stock."""
+    with transaction.atomic(using=using):
+        now = timezone.now()
+        for product_id in sorted(quantities):
+            quantity = quantities[product_id]
+            if quantity <= 0:
+                continue
+            Product.objects.using(using).filter(pk=product_id).update(
+                stock=F('stock') + quantity,
+                updated_at=now
+            )
+        record_stock_changes({pk: quantity for pk, quantity in quantities.items() if quantity > 0}, using)
@@ -0,0 +1,71 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from products.suggest import PRODUCT, CATEGORY, PrefixIndex
+
+WORDS = (
+    'laptop phone charger cable wireless bluetooth speaker headphones leather '
+    'wallet bag backpack cotton shirt dress shoes sneakers running kitchen '
+    'blender kettle coffee maker steel bottle organic honey tea green black '
+    'red blue mini pro max ultra smart watch fitness tracker gaming mouse '
+    'keyboard monitor stand desk lamp solar power bank portable camera lens'
+).split()
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the typeahead prefix index on a synthetic catalog: build '
+        'time, estimated memory and per-lookup latency. Uses no database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=100_000)
+        parser.add_argument('--categories', type=int, default=200)
+        parser.add_argument('--queries', type=int, default=20_000)
+        parser.add_argument('--limit', type=int, default=8)
+        parser.add_argument(
+            '--max-bytes',
+            type=int,
+            default=None,
+            help='Memory budget for the index (default: unlimited).'
+        )
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        def name():
+            return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+
+        documents = [(CATEGORY, pk, name()) for pk in range(1, options['categories'] + 1)]
+        documents += [(PRODUCT, pk, f'{name()} {pk}') for pk in range(1, options['products'] + 1)]
+
+        started = time.perf_counter()
+        index = PrefixIndex.build(documents, max_bytes=options['max_bytes'])
+        build_time = time.perf_counter() - started
+        self.stdout.write(
+            f'Indexed {len(index)} documents ({len(index.entries)} entries) '
+            f'in {build_time:.2f}s, ~{index.size / 1024 / 1024:.1f} MiB'
+            f'{" (truncated by the memory budget)" if index.truncated else ""}'
+        )
+
+        queries = []
+        for _ in range(options['queries']):
+            words = rng.choice(documents)[2].lower().split()
+            word = rng.choice(words)
+            queries.append(word[:rng.randint(1, len(word))])
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.suggest(query, options['limit'])
+            timings.append((time.perf_counter() - started) * 1_000_000)
+        timings.sort()
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(timings)} lookups: mean {statistics.mean(timings):.1f}us, '
+            f'p50 {timings[len(timings) // 2]:.1f}us, '
+            f'p99 {timings[int(len(timings) * 0.99)]:.1f}us'
+        ))
@@ -0,0 +1,78 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.models import Vendor
+from products import images
+from products.models import Product
+from products.storage import CONTENT_DIR, content_storage
+
+
+def stored_names(storage, directory):
+    """Every file name below ``directory``, recursively."""
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield f'{directory}/{name}'
+    for name in directories:
+        yield from stored_names(storage, f'{directory}/{name}')
+
+
+def is_recent(name, cutoff):
+    try:
+        return content_storage.get_modified_time(name).timestamp() > cutoff
+    except FileNotFoundError:
+        # Already gone
+        return True
+
+
+def is_referenced(name):
+    return (
+        Product.objects.filter(image=name).exists()
+        or Vendor.objects.filter(logo=name).exists()
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete content-addressed media (and its resized derivatives) that '
+        'no product image or vendor logo references any more. Files younger '
+        'than MEDIA_GC_GRACE are kept, since their row may not be saved yet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='List what would be deleted without deleting it.',
+        )
+
+    def handle(self, *args, **options):
+        if not content_storage.exists(CONTENT_DIR):
+            self.stdout.write(self.style.SUCCESS('No content-addressed media stored.'))
+            return
+
+        referenced = set(Product.objects.exclude(image='').values_list('image', flat=True))
+        referenced.update(Vendor.objects.exclude(logo='').values_list('logo', flat=True))
+        cutoff = time.time() - getattr(settings, 'MEDIA_GC_GRACE', 24 * 60 * 60)
+
+        deleted = freed = 0
+        for name in stored_names(content_storage, CONTENT_DIR):
+            if name in referenced or is_recent(name, cutoff):
+                continue
+            if not options['dry_run'] and is_referenced(name):
+                # Saved by a row since the references were read
+                continue
+            size = content_storage.size(name)
+            if options['dry_run']:
+                self.stdout.write(name)
+            else:
+                content_storage.delete(name)
+                images.delete_derivatives(name)
+            deleted += 1
+            freed += size
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {deleted} unreferenced files ({freed // 1024} KiB).'
+        ))
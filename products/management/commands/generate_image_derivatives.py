@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Vendor
+from products import images
+from products.cards import invalidate_cards
+from products.models import Product
+from products.page_cache import bump_generation
+
+
+def _generate(name, force):
+    """Resize one image; returns the error message, if any (runs in the pool)."""
+    try:
+        images.generate_derivatives(name, force=force)
+    except Exception as exc:
+        return str(exc) or exc.__class__.__name__
+    return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate the resized WebP and JPEG copies of every product image '
+        'and vendor logo that does not have them yet. Uploads are handled '
+        'as they happen; run this after deploying or changing '
+        'IMAGE_DERIVATIVE_WIDTHS or IMAGE_DERIVATIVE_QUALITY.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Rewrite derivatives that already exist (e.g. damaged files).',
+        )
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Resize in this process instead of the worker pool.',
+        )
+
+    def handle(self, *args, **options):
+        force = options['force']
+        names = set(
+            Product.objects.exclude(image='').exclude(image__isnull=True)
+            .values_list('image', flat=True)
+        )
+        names.update(
+            Vendor.objects.exclude(logo='').exclude(logo__isnull=True)
+            .values_list('logo', flat=True)
+        )
+        if not force:
+            names = {name for name in names if not images.has_derivatives(name)}
+        names = sorted(names)
+
+        if options['sync']:
+            results = map(_generate, names, [force] * len(names))
+        else:
+            results = images.get_executor().map(_generate, names, [force] * len(names))
+
+        generated = failed = 0
+        for name, error in zip(names, results):
+            if error:
+                failed += 1
+                images.mark_failed(name)
+                self.stderr.write(f'{name}: {error}')
+            else:
+                generated += 1
+
+        if generated:
+            # Cards and cached pages rendered before now still point at the originals
+            invalidate_cards(Product.objects.values_list('pk', flat=True))
+            bump_generation()
+        self.stdout.write(self.style.SUCCESS(
+            f'Generated derivatives for {generated} images ({failed} failed).'
+        ))
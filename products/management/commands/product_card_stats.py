@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from products.cards import get_stats, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the hit rate of the catalog product-card fragment cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset',
+            action='store_true',
+            help='Reset the hit and miss counters after reporting them.'
+        )
+
+    def handle(self, *args, **options):
+        stats = get_stats()
+        self.stdout.write(
+            f"Hits: {stats['hits']}  Misses: {stats['misses']}  "
+            f"Hit rate: {stats['hit_rate']:.1%}"
+        )
+        if options['reset']:
+            reset_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
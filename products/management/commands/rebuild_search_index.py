@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from products.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product full-text search index from the products table.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            default=None,
+            help='Database alias to rebuild (defaults to the products database).'
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend(options['database'])
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {count} products with {backend.__class__.__name__}.'
+        ))
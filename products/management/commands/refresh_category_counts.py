@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from products.facets import refresh_category_counts
+
+
+class Command(BaseCommand):
+    help = (
+        'Recompute the active, in-stock product count of every category. '
+        'Counts are maintained incrementally; run this periodically to '
+        'repair drift from bulk updates made outside the model.'
+    )
+
+    def handle(self, *args, **options):
+        updated = refresh_category_counts()
+        self.stdout.write(self.style.SUCCESS(f'Refreshed product counts for {updated} categories.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from products.inventory import release_expired_holds
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired checkout stock holds. Expired holds already stop '
+        'counting against available stock; run this periodically (e.g. from '
+        'cron every few minutes) to keep the holds table small.'
+    )
+
+    def handle(self, *args, **options):
+        released = release_expired_holds()
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired stock holds.'))
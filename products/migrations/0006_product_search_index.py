@@ -0,0 +1,48 @@
+from django.db import migrations
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS products_product_fts "
+    "USING fts5(name, description, tokenize='unicode61 remove_diacritics 2')",
+    "INSERT INTO products_product_fts (rowid, name, description) "
+    "SELECT id, name, COALESCE(description, '') FROM products_product",
+]
+SQLITE_REVERSE = [
+    "DROP TABLE IF EXISTS products_product_fts",
+]
+
+POSTGRES_FORWARD = [
+    "CREATE TABLE IF NOT EXISTS products_product_search ("
+    "product_id bigint PRIMARY KEY REFERENCES products_product (id) "
+    "ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+    "document tsvector NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS products_product_search_document_gin "
+    "ON products_product_search USING gin (document)",
+    "INSERT INTO products_product_search (product_id, document) "
+    "SELECT id, setweight(to_tsvector('english', name), 'A') || "
+    "setweight(to_tsvector('english', COALESCE(description, '')), 'B') "
+    "FROM products_product",
+]
+POSTGRES_REVERSE = [
+    "DROP TABLE IF EXISTS products_product_search",
+]
+
+
+def run_for_vendor(statements):
+    def run(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_update_vendor_reference'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_for_vendor({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRES_FORWARD}),
+            run_for_vendor({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRES_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_model_restructure'),
+        ('products', '0006_product_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', '-created_at', 'id'], name='prod_status_created_idx'),
+        ),
+    ]
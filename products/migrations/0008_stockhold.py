@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_catalog_keyset_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('holder', models.CharField(help_text='Session key of the checkout holding the stock', max_length=64, verbose_name='holder')),
+                ('quantity', models.PositiveIntegerField(verbose_name='quantity')),
+                ('expires_at', models.DateTimeField(verbose_name='expires at')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='holds', to='products.product', verbose_name='product')),
+            ],
+            options={
+                'verbose_name': 'stock hold',
+                'verbose_name_plural': 'stock holds',
+                'indexes': [models.Index(fields=['product', 'expires_at'], name='hold_product_expires_idx'), models.Index(fields=['holder'], name='hold_holder_idx'), models.Index(fields=['expires_at'], name='hold_expires_idx')],
+                'constraints': [models.UniqueConstraint(fields=('product', 'holder'), name='hold_product_holder_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:46
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_active_products(apps, schema_editor):
+    Category = apps.get_model('products', 'Category')
+    Product = apps.get_model('products', 'Product')
+    counts = Product.objects.filter(status='active', stock__gt=0).order_by().values(
+        'category'
+    ).annotate(count=Count('pk')).values_list('category', 'count')
+    for category_id, count in counts:
+        Category.objects.filter(pk=category_id).update(active_product_count=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_stockhold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='active_product_count',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Active, in-stock products in this category (see products.facets).', verbose_name='active product count'),
+        ),
+        migrations.RunPython(count_active_products, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_model_restructure'),
+        ('products', '0009_category_active_product_count'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='prod_price_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='product',
+            name='prod_status_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'category', '-created_at', 'id'], name='prod_status_cat_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'price', 'id'], name='prod_status_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['status', 'category', 'price', 'id'], name='prod_status_cat_price_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active'), ('stock__gt', 0)), fields=['-created_at', 'id'], name='prod_in_stock_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('status', 'active'), ('stock__gt', 0)), fields=['price', 'id'], name='prod_in_stock_price_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:58
+
+import products.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0010_catalog_sort_filter_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=products.storage.get_content_storage, upload_to='', verbose_name='product image'),
+        ),
+    ]
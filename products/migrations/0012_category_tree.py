@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+
+
+def set_root_paths(apps, schema_editor):
+    # Every existing category is a root: its path is its own id
+    Category = apps.get_model('products', 'Category')
+    Category.objects.update(path=Concat(Cast('pk', CharField()), Value('/')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0011_content_addressed_images'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='children', to='products.category', verbose_name='parent category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='path'),
+        ),
+        migrations.RunPython(set_root_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 09:28
+
+from django.db import migrations, models
+
+
+def drop_raw_session_holds(apps, schema_editor):
+    # Holds keyed by a raw session key would no longer match their cart;
+    # they last minutes, so dropping them only frees their stock early
+    StockHold = apps.get_model('products', 'StockHold')
+    StockHold.objects.using(schema_editor.connection.alias).all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0012_category_tree'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stockhold',
+            name='holder',
+            field=models.CharField(help_text='Keyed hash of the session key of the checkout holding the stock', max_length=64, verbose_name='holder'),
+        ),
+        migrations.RunPython(drop_raw_session_holds, migrations.RunPython.noop),
+    ]
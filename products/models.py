@@ -1,12 +1,37 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator
+from django.db.models.functions import Concat, Substr
+
+from .storage import get_content_storage
 
 class Category(models.Model):
     """
     Category model for grouping products.
+    
+    Categories form a tree through ``parent``. ``path`` is the materialized
+    path of ids from the root down (e.g. '3/12/40/'), maintained by save(),
+    so a category and all of its descendants are one indexed prefix match
+    (see products.categories).
     """
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.PROTECT, # Move or delete the subcategories first
+        related_name='children',
+        blank=True,
+        null=True,
+        verbose_name=_('parent category')
+    )
+    path = models.CharField(
+        _('path'),
+        max_length=255,
+        db_index=True,
+        editable=False,
+        default=''
+    )
     name = models.CharField(
         _('name'),
         max_length=100
@@ -24,6 +49,12 @@ class Category(models.Model):
         _('is active'),
         default=True
     )
+    active_product_count = models.PositiveIntegerField(
+        _('active product count'),
+        default=0,
+        editable=False,
+        help_text=_('Active, in-stock products in this category (see products.facets).')
+    )
     created_at = models.DateTimeField(
         _('created at'),
         auto_now_add=True
@@ -44,6 +75,48 @@ class Category(models.Model):
     def __str__(self):
         return self.name
 
+    def clean(self):
+        super().clean()
+        if self.pk is not None and self.parent_id is not None and self._is_own_subtree(self.parent_id):
+            raise ValidationError({'parent': _('A category cannot be placed under itself or one of its subcategories.')})
+
+    def _is_own_subtree(self, category_id, using=None):
+        paths = type(self).objects.using(using).filter(pk__in=[self.pk, category_id])
+        paths = dict(paths.values_list('pk', 'path'))
+        return category_id == self.pk or paths.get(category_id, '').startswith(paths.get(self.pk) or '-')
+
+    def save(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db
+        with transaction.atomic(using=using):
+            super().save(*args, **kwargs)
+            self._update_path(using)
+
+    def _update_path(self, using=None):
+        """Recompute this category's path and move its subtree along with it."""
+        categories = type(self).objects.using(using)
+        paths = dict(categories.filter(pk__in=[self.pk, self.parent_id]).values_list('pk', 'path'))
+        old_path = paths[self.pk]
+        parent_path = paths[self.parent_id] if self.parent_id is not None else ''
+        if old_path and parent_path.startswith(old_path):
+            raise ValueError('A category cannot be placed under itself or one of its subcategories.')
+        new_path = f'{parent_path}{self.pk}/'
+        if old_path != new_path:
+            categories.filter(pk=self.pk).update(path=new_path)
+            if old_path:
+                categories.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(models.Value(new_path), Substr('path', len(old_path) + 1))
+                )
+        self.path = new_path
+
+    @classmethod
+    def adjust_product_count(cls, category_id, delta, using=None):
+        """Apply ``delta`` to a category's active product count in one UPDATE."""
+        if category_id is None or not delta:
+            return
+        cls.objects.using(using).filter(pk=category_id).update(
+            active_product_count=models.F('active_product_count') + delta
+        )
+
 
 class Product(models.Model):
     """
@@ -89,7 +162,7 @@ class Product(models.Model):
     )
     image = models.ImageField(
         _('product image'),
-        upload_to='products/%Y/%m/%d/',
+        storage=get_content_storage,
         blank=True,
         null=True
     )
@@ -114,29 +187,150 @@ class Product(models.Model):
         verbose_name = _('product')
         verbose_name_plural = _('products')
         ordering = ['-created_at']
+        # Catalog indexes follow the query shapes of product_list: equality
+        # on status (and category), then the sort key and the id tiebreak,
+        # so each page is an index range scan with no sort step.
         indexes = [
             models.Index(fields=['name'], name='prod_name_idx'),
-            models.Index(fields=['price'], name='prod_price_idx'),
-            models.Index(fields=['status'], name='prod_status_idx'),
+            # Keyset pagination of the public catalog, newest first
+            models.Index(fields=['status', '-created_at', 'id'], name='prod_status_created_idx'),
+            models.Index(fields=['status', 'category', '-created_at', 'id'], name='prod_status_cat_created_idx'),
+            # Price sorts and price-range filters
+            models.Index(fields=['status', 'price', 'id'], name='prod_status_price_idx'),
+            models.Index(fields=['status', 'category', 'price', 'id'], name='prod_status_cat_price_idx'),
+            # "In stock" listings: only sellable rows are indexed
+            models.Index(
+                fields=['-created_at', 'id'],
+                condition=models.Q(status='active', stock__gt=0),
+                name='prod_in_stock_created_idx'
+            ),
+            models.Index(
+                fields=['price', 'id'],
+                condition=models.Q(status='active', stock__gt=0),
+                name='prod_in_stock_price_idx'
+            ),
         ]
 
     def __str__(self):
         return f"{self.name} - {self.price}"
 
+    # Fields that decide whether a product counts towards its category's facet
+    FACET_FIELDS = ('status', 'stock', 'category_id')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if not instance.get_deferred_fields().intersection(cls.FACET_FIELDS):
+            instance._saved_facet_category = instance.facet_category_id()
+        return instance
+
+    def facet_category_id(self):
+        """The category this product is counted in, or None if it is not counted."""
+        if self.status == self.Status.ACTIVE and int(self.stock) > 0:
+            return self.category_id
+        return None
+
+    def _persisted_facet_category(self, using):
+        if hasattr(self, '_saved_facet_category'):
+            return self._saved_facet_category
+        saved = Product.objects.using(using).filter(pk=self.pk).values_list(*self.FACET_FIELDS).first()
+        if saved is None:
+            return None
+        status, stock, category_id = saved
+        return category_id if status == self.Status.ACTIVE and stock > 0 else None
+
+    def save(self, *args, **kwargs):
+        """Save, moving the product between category facet counts if needed."""
+        using = kwargs.get('using')
+        with transaction.atomic(using=using):
+            before = None if self._state.adding else self._persisted_facet_category(using)
+            super().save(*args, **kwargs)
+            after = self.facet_category_id()
+            if before != after:
+                Category.adjust_product_count(before, -1, using)
+                Category.adjust_product_count(after, 1, using)
+        self._saved_facet_category = after
+
+    @property
+    def available_stock(self):
+        """
+        Stock not held by a checkout in progress. Uses the ``available``
+        annotation added by products.inventory.with_available_stock when
+        present, so catalog pages do not run a query per product.
+        """
+        if hasattr(self, 'available'):
+            return self.available
+        held = self.holds.filter(expires_at__gt=timezone.now()).aggregate(
+            total=models.Sum('quantity')
+        )['total'] or 0
+        return self.stock - held
+
     @property
     def is_available(self):
         """Check if product is available for purchase."""
-        return self.status == self.Status.ACTIVE and self.stock > 0
+        return self.status == self.Status.ACTIVE and self.available_stock > 0
 
     def reduce_stock(self, quantity):
         """
         Reduce the product stock by the given quantity.
         Returns True if successful, False otherwise.
+        The check and the decrement are one conditional UPDATE, so
+        concurrent callers can never take the stock below zero.
         """
         if quantity <= 0:
             return False
-        if self.stock >= quantity:
-            self.stock -= quantity
-            self.save(update_fields=['stock', 'updated_at'])
-            return True
-        return False
\ No newline at end of file
+        updated = Product.objects.filter(
+            pk=self.pk,
+            stock__gte=quantity
+        ).update(stock=models.F('stock') - quantity, updated_at=timezone.now())
+        if updated:
+            self.refresh_from_db(fields=['stock', 'updated_at'])
+            if self.stock == 0 and self.status == self.Status.ACTIVE:
+                # Sold out: no longer counted in its category
+                Category.adjust_product_count(self.category_id, -1)
+            self._saved_facet_category = self.facet_category_id()
+        return bool(updated)
+
+
+class StockHold(models.Model):
+    """
+    Stock set aside for a checkout in progress until ``expires_at``.
+
+    Holds do not change Product.stock. Available stock is the stock minus
+    the unexpired holds, so an abandoned checkout frees its stock as soon
+    as its hold expires, even before the sweeper deletes the row.
+    """
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='holds',
+        verbose_name=_('product')
+    )
+    holder = models.CharField(
+        _('holder'),
+        max_length=64,
+        help_text=_('Keyed hash of the session key of the checkout holding the stock')
+    )
+    quantity = models.PositiveIntegerField(_('quantity'))
+    expires_at = models.DateTimeField(_('expires at'))
+    created_at = models.DateTimeField(
+        _('created at'),
+        auto_now_add=True
+    )
+
+    class Meta:
+        verbose_name = _('stock hold')
+        verbose_name_plural = _('stock holds')
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'holder'], name='hold_product_holder_uniq'),
+        ]
+        indexes = [
+            # Sum of active holds per product
+            models.Index(fields=['product', 'expires_at'], name='hold_product_expires_idx'),
+            models.Index(fields=['holder'], name='hold_holder_idx'),
+            # Sweeper
+            models.Index(fields=['expires_at'], name='hold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
@@ -0,0 +1,150 @@
+"""
+Full-page cache for anonymous catalog pages.
+
+Responses are stored under a key built from the catalog *generation* and
+the normalised query string (search, filters, sort and cursor), e.g.
+``catalog:page:7:<md5 of "category=3&q=red shoes">``. Any change to a
+product, category or vendor bumps the generation (see products.signals),
+so every cached page becomes unreachable at once without deleting keys,
+which works the same on every cache backend.
+
+Only one request renders a missing page. The others wait briefly for it
+instead of all rendering it at the same time (a cache stampede).
+
+Cached pages are shared between visitors, so the CSRF token embedded in
+their forms belongs to whoever rendered the page. Serving a cached page
+still makes sure the visitor gets a CSRF cookie, and static/js/main.js
+sends that cookie's value with its POSTs.
+"""
+import functools
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlencode
+
+from .conditional import has_pending_messages
+
+GENERATION_KEY = 'catalog:generation'
+PAGE_KEY_PREFIX = 'catalog:page'
+
+# Query parameters that change the page; anything else (utm_*, etc.) is ignored
+PAGE_PARAMS = ('q', 'category', 'sort', 'min_price', 'max_price', 'in_stock', 'cursor')
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_PAGE_CACHE', 'default')]
+
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def bump_generation():
+    """Invalidate every cached catalog page."""
+    cache = get_cache()
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, 2, timeout=None)
+
+
+def normalize_search(value):
+    """
+    A search query with its whitespace collapsed. Case is kept: the page
+    echoes the query back, so "iPhone" and "iphone" are different pages.
+    """
+    return ' '.join((value or '').split())
+
+
+def normalize_query(query_dict):
+    """Return the canonical query string for the parameters that matter."""
+    params = []
+    for name in PAGE_PARAMS:
+        value = query_dict.get(name, '')
+        if name == 'q':
+            value = normalize_search(value)
+        else:
+            value = value.strip()
+        if value:
+            params.append((name, value))
+    return urlencode(params)
+
+
+def page_cache_key(request, generation=None):
+    if generation is None:
+        generation = get_generation()
+    digest = hashlib.md5(
+        f'{request.path}?{normalize_query(request.GET)}'.encode()
+    ).hexdigest()
+    return f'{PAGE_KEY_PREFIX}:{generation}:{digest}'
+
+
+def is_cacheable(request):
+    """Only plain anonymous GETs with no pending flash messages are shared."""
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    if has_pending_messages(request):
+        return False
+    return not request.user.is_authenticated
+
+
+def cache_anonymous_page(view):
+    """Serve anonymous visitors from the catalog page cache."""
+
+    @functools.wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if not is_cacheable(request):
+            return view(request, *args, **kwargs)
+
+        cache = get_cache()
+        key = page_cache_key(request)
+        response = cache.get(key)
+        if response is None:
+            response = _render_once(cache, key, view, request, *args, **kwargs)
+            response['X-Cache'] = 'MISS'
+        else:
+            get_token(request)
+            response['X-Cache'] = 'HIT'
+            # Answer revalidations from the stored ETag without touching the database
+            not_modified = get_conditional_response(request, etag=response.get('ETag'), response=response)
+            if not_modified is not response:
+                return not_modified
+        return response
+
+    return wrapper
+
+
+def _render_once(cache, key, view, request, *args, **kwargs):
+    """Render and store the page, letting only one request render at a time."""
+    lock_key = f'{key}:lock'
+    lock_timeout = getattr(settings, 'CATALOG_PAGE_CACHE_LOCK_TIMEOUT', 10)
+    if not cache.add(lock_key, 1, lock_timeout):
+        # Someone else is rendering this page; wait for their copy
+        deadline = time.monotonic() + getattr(settings, 'CATALOG_PAGE_CACHE_WAIT', 2)
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            response = cache.get(key)
+            if response is not None:
+                get_token(request)
+                return response
+        # They are taking too long; render without caching
+        return view(request, *args, **kwargs)
+
+    try:
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        if response.status_code == 200 and not response.streaming and not response.cookies:
+            cache.set(key, response, getattr(settings, 'CATALOG_PAGE_CACHE_TIMEOUT', 60))
+        return response
+    finally:
+        cache.delete(lock_key)
@@ -0,0 +1,157 @@
+"""
+Keyset (cursor) pagination.
+
+Pages are fetched with a ``WHERE (ordering keys) past the last row`` filter
+instead of OFFSET, and no COUNT(*) is run, so page 500 costs the same as
+page 1. Cursors are opaque URL-safe tokens that encode the ordering values
+of the boundary row.
+"""
+import base64
+import datetime
+import json
+import math
+from decimal import Decimal
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import models
+from django.db.models import Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded."""
+
+
+class KeysetPage:
+    """A single page of results plus the cursors around it."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+class KeysetPaginator:
+    """
+    Paginate ``queryset`` over ``ordering``, a list of order_by() strings
+    such as ``['-created_at', 'id']``. The last key must be unique so every
+    row has a distinct position.
+    """
+
+    NEXT = 'n'
+    PREVIOUS = 'p'
+
+    def __init__(self, queryset, ordering, page_size):
+        self.queryset = queryset
+        self.ordering = list(ordering)
+        self.page_size = page_size
+        self.keys = [(key.lstrip('-'), key.startswith('-')) for key in self.ordering]
+
+    def page(self, cursor=None):
+        """Return the page after (or before) ``cursor``; the first page if None."""
+        direction, values = self.decode_cursor(cursor) if cursor else (self.NEXT, None)
+        backwards = direction == self.PREVIOUS
+
+        queryset = self.queryset.order_by(*self._ordering(backwards))
+        if values is not None:
+            queryset = queryset.filter(self._boundary(values, backwards))
+
+        # One extra row tells us whether there is another page, without a COUNT.
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if backwards:
+            rows.reverse()
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+
+        if not rows:
+            return KeysetPage([])
+        return KeysetPage(
+            rows,
+            next_cursor=self.encode_cursor(self.NEXT, rows[-1]) if has_next else None,
+            previous_cursor=self.encode_cursor(self.PREVIOUS, rows[0]) if has_previous else None,
+        )
+
+    def _ordering(self, backwards):
+        if not backwards:
+            return self.ordering
+        return [name if descending else '-' + name for name, descending in self.keys]
+
+    def _boundary(self, values, backwards):
+        """
+        Build ``(k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...`` with each
+        comparison flipped for descending keys.
+        """
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.keys, values):
+            lookup = 'lt' if descending != backwards else 'gt'
+            condition |= Q(**equal, **{f'{name}__{lookup}': value})
+            equal[name] = value
+        return condition
+
+    def encode_cursor(self, direction, row):
+        values = [self._dump_value(getattr(row, name)) for name, _ in self.keys]
+        payload = json.dumps([direction, values], separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            direction, values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            if direction not in (self.NEXT, self.PREVIOUS) or len(values) != len(self.keys):
+                raise InvalidCursor(cursor)
+            return direction, [
+                self._parse_value(name, value)
+                for (name, _), value in zip(self.keys, values)
+            ]
+        except (TypeError, ValueError, ArithmeticError, ValidationError) as exc:
+            raise InvalidCursor(cursor) from exc
+
+    def _dump_value(self, value):
+        # Full precision: a truncated timestamp would skip or repeat rows.
+        if isinstance(value, (datetime.date, datetime.time)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        return value
+
+    def _parse_value(self, name, value):
+        try:
+            field = self.queryset.model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Annotations such as a search rank are plain, finite numbers.
+            parsed = float(value)
+            if not math.isfinite(parsed):
+                raise InvalidCursor(value)
+            return parsed
+        if isinstance(field, models.DateTimeField):
+            parsed = parse_datetime(value)
+        elif isinstance(field, models.DateField):
+            parsed = parse_date(value)
+        else:
+            # DecimalField.to_python() also rejects NaN and infinities
+            parsed = field.to_python(value)
+        if parsed is None:
+            raise InvalidCursor(value)
+        return parsed
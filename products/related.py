@@ -0,0 +1,44 @@
+"""
+Precomputed "more from this vendor" lists.
+
+Each vendor's newest active products are stored in the cache as a short
+list of plain rows under ``vendor-products:<vendor id>``. The list is
+rebuilt when one of the vendor's products is saved or deleted, after the
+transaction commits (see products.signals), so product pages only read it.
+A missing list (evicted, or a cold cache) is rebuilt on first read.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+KEY_PREFIX = 'vendor-products'
+
+
+def vendor_products_key(vendor_id):
+    return f'{KEY_PREFIX}:{vendor_id}'
+
+
+def refresh_vendor_products(vendor_id):
+    """Rebuild and store the vendor's list with one query; returns it."""
+    from .models import Product
+
+    size = getattr(settings, 'VENDOR_PRODUCTS_LIST_SIZE', 12)
+    rows = list(
+        Product.objects.filter(vendor_id=vendor_id, status=Product.Status.ACTIVE)
+        .order_by('-created_at', '-id')
+        .values('id', 'name', 'price', 'image')[:size]
+    )
+    cache.set(vendor_products_key(vendor_id), rows, timeout=None)
+    return rows
+
+
+def vendor_products(vendor_id):
+    rows = cache.get(vendor_products_key(vendor_id))
+    if rows is None:
+        rows = refresh_vendor_products(vendor_id)
+    return rows
+
+
+def more_from_vendor(product, limit=4):
+    """Up to ``limit`` other products of ``product``'s vendor, as dicts."""
+    rows = [row for row in vendor_products(product.vendor_id) if row['id'] != product.pk]
+    return rows[:limit]
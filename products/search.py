@@ -0,0 +1,193 @@
+"""
+Full-text search for the product catalog.
+
+SQLite (development) keeps an FTS5 virtual table and PostgreSQL (production)
+keeps a ``tsvector`` table with a GIN index. Both are keyed by product id and
+are kept in sync from the Product post_save/post_delete signals, so a search
+is an index lookup instead of a ``LIKE '%...%'`` scan over every description.
+"""
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+SQLITE_TABLE = 'products_product_fts'
+POSTGRES_TABLE = 'products_product_search'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(query):
+    """Split a raw search query into plain word tokens."""
+    return TOKEN_RE.findall(query or '')
+
+
+def unranked(queryset):
+    """``queryset`` with the constant ``search_rank`` of results that are not ranked."""
+    return queryset.annotate(
+        search_rank=Value(0.0, output_field=FloatField())
+    ).order_by('-search_rank', '-created_at')
+
+
+class BaseSearchBackend:
+    """Interface shared by the per-database search backends."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def index_product(self, product):
+        raise NotImplementedError
+
+    def remove_product(self, product_id):
+        raise NotImplementedError
+
+    def rebuild(self):
+        """Re-index every product and return the number of indexed rows."""
+        raise NotImplementedError
+
+    def search(self, queryset, query):
+        """
+        Filter ``queryset`` down to products matching ``query``.
+        Results are annotated with ``search_rank`` (higher is better)
+        and ordered by it.
+        """
+        raise NotImplementedError
+
+
+class SQLiteSearchBackend(BaseSearchBackend):
+    """FTS5 backend, ranked with bm25 (name weighted above description)."""
+
+    def index_product(self, product):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [product.pk])
+            cursor.execute(
+                f'INSERT INTO {SQLITE_TABLE} (rowid, name, description) VALUES (%s, %s, %s)',
+                [product.pk, product.name, product.description or '']
+            )
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE} WHERE rowid = %s', [product_id])
+
+    def rebuild(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+            cursor.execute(
+                f"INSERT INTO {SQLITE_TABLE} (rowid, name, description) "
+                f"SELECT id, name, COALESCE(description, '') FROM products_product"
+            )
+            return cursor.rowcount
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return unranked(queryset.none())
+        # Every token must match, each as a prefix: "lap" finds "laptop".
+        match = ' '.join('"%s"*' % token for token in tokens)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {SQLITE_TABLE} WHERE {SQLITE_TABLE} MATCH %s', (match,))
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT -bm25({SQLITE_TABLE}, 10.0, 1.0) FROM {SQLITE_TABLE} '
+                f'WHERE {SQLITE_TABLE} MATCH %s AND rowid = "{table}"."id"',
+                (match,)
+            )
+        ).order_by('-search_rank', '-created_at')
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """tsvector/GIN backend, ranked with ts_rank (name weighted 'A')."""
+
+    DOCUMENT_SQL = (
+        "setweight(to_tsvector(%s::regconfig, %s), 'A') || "
+        "setweight(to_tsvector(%s::regconfig, %s), 'B')"
+    )
+
+    @property
+    def config(self):
+        return getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'english')
+
+    def index_product(self, product):
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {POSTGRES_TABLE} (product_id, document) '
+                f'VALUES (%s, {self.DOCUMENT_SQL}) '
+                f'ON CONFLICT (product_id) DO UPDATE SET document = EXCLUDED.document',
+                [product.pk, self.config, product.name, self.config, product.description or '']
+            )
+
+    def remove_product(self, product_id):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {POSTGRES_TABLE} WHERE product_id = %s', [product_id])
+
+    def rebuild(self):
+        document = self.DOCUMENT_SQL % ('%s', 'name', '%s', "COALESCE(description, '')")
+        with self.connection.cursor() as cursor:
+            cursor.execute(f'TRUNCATE {POSTGRES_TABLE}')
+            cursor.execute(
+                f'INSERT INTO {POSTGRES_TABLE} (product_id, document) '
+                f'SELECT id, {document} FROM products_product',
+                [self.config, self.config]
+            )
+            return cursor.rowcount
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return unranked(queryset.none())
+        # Tokens are \w+ only, so they are safe to feed to to_tsquery.
+        tsquery = ' & '.join('%s:*' % token for token in tokens)
+        table = queryset.model._meta.db_table
+        return queryset.filter(
+            id__in=RawSQL(
+                f'SELECT product_id FROM {POSTGRES_TABLE} '
+                f'WHERE document @@ to_tsquery(%s::regconfig, %s)',
+                (self.config, tsquery)
+            )
+        ).annotate(
+            search_rank=RawSQL(
+                f'SELECT ts_rank(document, to_tsquery(%s::regconfig, %s)) FROM {POSTGRES_TABLE} '
+                f'WHERE product_id = "{table}"."id"',
+                (self.config, tsquery)
+            )
+        ).order_by('-search_rank', '-created_at')
+
+
+class FallbackSearchBackend(BaseSearchBackend):
+    """Plain icontains search for databases without a full-text index."""
+
+    def index_product(self, product):
+        pass
+
+    def remove_product(self, product_id):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, queryset, query):
+        return unranked(queryset.filter(
+            Q(name__icontains=query) |
+            Q(description__icontains=query)
+        ))
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def get_backend(using=None):
+    """Return the search backend for the database products are stored in."""
+    from .models import Product
+    connection = connections[using or router.db_for_write(Product)]
+    return BACKENDS.get(connection.vendor, FallbackSearchBackend)(connection)
+
+
+def search_products(queryset, query):
+    """Filter a Product queryset by a full-text query, ranked by relevance."""
+    return get_backend(queryset.db).search(queryset, query)
@@ -0,0 +1,125 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from accounts.models import Vendor
+from .models import Category, Product
+from . import cards, categories, images, page_cache, related, search, suggest
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """Keep the full-text search index in sync with saved products."""
+    if raw:
+        return
+    search.get_backend().index_product(instance)
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """Drop deleted products from the full-text search index."""
+    search.get_backend().remove_product(instance.pk)
+
+
+@receiver(post_delete, sender=Product)
+def uncount_deleted_product(sender, instance, **kwargs):
+    """Drop a deleted product from its category's facet count."""
+    category_id = instance.facet_category_id()
+    if category_id is not None:
+        Category.adjust_product_count(category_id, -1)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_card(sender, instance, **kwargs):
+    """Drop the cached catalog card of a changed product."""
+    cards.invalidate_cards([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Vendor)
+def invalidate_related_cards(sender, instance, raw=False, **kwargs):
+    """Category and vendor names are shown on the cards of their products."""
+    if raw:
+        return
+    cards.invalidate_cards(instance.products.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=Vendor)
+def invalidate_catalog_pages(sender, **kwargs):
+    """Any catalog change retires every cached anonymous catalog page."""
+    page_cache.bump_generation()
+
+
+@receiver(post_save, sender=Product)
+def update_product_suggestions(sender, instance, raw=False, **kwargs):
+    """Keep this worker's typeahead index in step with saved products."""
+    if raw:
+        return
+    suggest.update_product(instance)
+
+
+@receiver(post_save, sender=Category)
+def update_category_suggestions(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    suggest.update_category(instance)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def remove_suggestions(sender, instance, **kwargs):
+    kind = suggest.PRODUCT if sender is Product else suggest.CATEGORY
+    suggest.remove(kind, instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def refresh_vendor_products(sender, instance, raw=False, **kwargs):
+    """Rebuild the vendor's "more from this vendor" list once the change is committed."""
+    if raw:
+        return
+    vendor_id = instance.vendor_id
+    transaction.on_commit(lambda: related.refresh_vendor_products(vendor_id))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    """The cached tree feeds the navigation menu and the catalog filter."""
+    categories.invalidate_category_tree()
+
+
+def _derivatives_ready(product_ids):
+    """Show the new srcset on cards and catalog pages rendered from now on."""
+    def on_done(names):
+        cards.invalidate_cards(product_ids)
+        page_cache.bump_generation()
+    return on_done
+
+
+@receiver(post_save, sender=Product)
+def schedule_product_image_derivatives(sender, instance, raw=False, **kwargs):
+    """Resize a newly uploaded product image once the save has committed."""
+    if raw or not instance.image:
+        return
+    name = instance.image.name
+    # Already resized, or failed before and left to the backfill command
+    if images.has_derivatives(name) or images.has_failed(name):
+        return
+    on_done = _derivatives_ready([instance.pk])
+    transaction.on_commit(lambda: images.schedule_derivatives(name, on_done))
+
+
+@receiver(post_save, sender=Vendor)
+def schedule_vendor_logo_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not instance.logo:
+        return
+    name = instance.logo.name
+    if images.has_derivatives(name) or images.has_failed(name):
+        return
+    transaction.on_commit(lambda: images.schedule_derivatives(name))
@@ -0,0 +1,83 @@
+"""
+Content-addressed media storage.
+
+Product images and vendor logos are stored under the SHA-256 of their
+bytes instead of their upload name:
+
+    shoe.JPG -> cas/3f/a1/3fa1...9c.jpg
+
+Uploading a photo that is already stored (for another product, or the same
+product edited again) reuses the existing file, and a file's URL never
+changes content, so browsers and CDNs may cache it forever (see
+IMMUTABLE_CACHE_CONTROL). The resized derivatives of these files
+(products.images) are named after them and are immutable too.
+
+Replacing or deleting an image leaves its file in place, since other rows
+may still point at it; the ``gc_media`` command removes files nothing
+references any more. Reusing a stored file touches its modification time,
+so the collector's grace period covers the new reference too.
+"""
+import hashlib
+import os
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from .images import DERIVATIVES_DIR
+
+CONTENT_DIR = 'cas'
+
+
+def immutable_cache_control():
+    max_age = getattr(settings, 'MEDIA_IMMUTABLE_MAX_AGE', 365 * 24 * 60 * 60)
+    return f'public, max-age={max_age}, immutable'
+
+
+def is_content_addressed(name):
+    """True for stored names (originals or their derivatives) that never change."""
+    parts = PurePosixPath(name).parts
+    if parts and parts[0] == DERIVATIVES_DIR:
+        parts = parts[1:]
+    return bool(parts) and parts[0] == CONTENT_DIR
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage that names files by the hash of their content."""
+
+    def content_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        extension = os.path.splitext(name)[1].lower()
+        return f'{CONTENT_DIR}/{digest[:2]}/{digest[2:4]}/{digest}{extension}'
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Same bytes are already stored; share them, and restart the
+            # file's gc_media grace period, since the row about to point
+            # at it may not be committed yet
+            try:
+                os.utime(self.path(name))
+            except FileNotFoundError:
+                # Collected in between; store it again
+                return super().save(name, content, max_length=max_length)
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+content_storage = ContentAddressedStorage()
+
+
+def get_content_storage():
+    """Storage of Product.image and Vendor.logo (a callable keeps it out of migrations)."""
+    return content_storage
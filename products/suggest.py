@@ -0,0 +1,282 @@
+"""
+In-process prefix index for typeahead suggestions.
+
+Every worker keeps a sorted list of ``(kind, token, id)`` entries, one per
+word of each active category name and active product name. A suggestion
+lookup is, per kind, a bisect to the first token starting with the typed
+prefix and a short forward scan, so it never touches the database.
+
+The index is built when the worker starts (see sokohub/wsgi.py) or on
+first use, and products.signals keeps it current for changes made in the
+same process. Changes made by other workers are picked up by a background
+rebuild once the index is older than SUGGEST_INDEX_REFRESH seconds; the
+changes this worker makes while it runs are replayed onto the new index
+before it replaces the old one.
+
+Lookups and updates of an index take its lock, so a lookup never scans
+the entry list while a save is shifting it.
+
+SUGGEST_INDEX_MAX_BYTES caps the estimated memory use. Once it is reached,
+older products are left out (newest products are indexed first) and a
+warning is logged.
+"""
+import logging
+import sys
+import threading
+import time
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.db import DatabaseError, connection
+
+from .search import tokenize
+
+logger = logging.getLogger(__name__)
+
+CATEGORY = 0
+PRODUCT = 1
+KIND_NAMES = {CATEGORY: 'category', PRODUCT: 'product'}
+
+# Rough per-entry cost beyond the tuple itself: the list slot, the label
+# map entry and the per-document token list.
+ENTRY_OVERHEAD = 64
+
+
+class PrefixIndex:
+    """Sorted-array prefix index over product and category names."""
+
+    def __init__(self, max_bytes=None, scan_limit=500):
+        self.max_bytes = max_bytes
+        self.scan_limit = scan_limit
+        self.entries = []
+        self.labels = {}
+        self.tokens = {}
+        self.size = 0
+        self.truncated = False
+        self.built_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _document(self, kind, pk, label):
+        tokens = sorted({sys.intern(token.lower()) for token in tokenize(label)})
+        entries = [(kind, token, pk) for token in tokens]
+        size = sum(sys.getsizeof(entry) + ENTRY_OVERHEAD for entry in entries)
+        size += sys.getsizeof(label)
+        return tokens, entries, size
+
+    def _fits(self, size):
+        if self.max_bytes is None or self.size + size <= self.max_bytes:
+            return True
+        if not self.truncated:
+            logger.warning(
+                'Suggestion index reached its memory budget of %s bytes; '
+                'older entries are left out', self.max_bytes
+            )
+            self.truncated = True
+        return False
+
+    @classmethod
+    def build(cls, documents, **kwargs):
+        """
+        Build an index from ``(kind, pk, label)`` documents in priority
+        order, sorting once at the end.
+        """
+        index = cls(**kwargs)
+        for kind, pk, label in documents:
+            tokens, entries, size = index._document(kind, pk, label)
+            if not entries or not index._fits(size):
+                continue
+            index.entries.extend(entries)
+            index.labels[kind, pk] = label
+            index.tokens[kind, pk] = (tokens, size)
+            index.size += size
+        index.entries.sort()
+        return index
+
+    def add(self, kind, pk, label):
+        """Index (or re-index) one document."""
+        with self._lock:
+            self._remove(kind, pk)
+            tokens, entries, size = self._document(kind, pk, label)
+            if not entries or not self._fits(size):
+                return
+            for entry in entries:
+                insort(self.entries, entry)
+            self.labels[kind, pk] = label
+            self.tokens[kind, pk] = (tokens, size)
+            self.size += size
+
+    def remove(self, kind, pk):
+        with self._lock:
+            self._remove(kind, pk)
+
+    def _remove(self, kind, pk):
+        tokens, size = self.tokens.pop((kind, pk), ((), 0))
+        for token in tokens:
+            position = bisect_left(self.entries, (kind, token, pk))
+            if position < len(self.entries) and self.entries[position] == (kind, token, pk):
+                del self.entries[position]
+        self.labels.pop((kind, pk), None)
+        self.size -= size
+
+    def suggest(self, query, limit=8):
+        """
+        Return up to ``limit`` ``(kind, pk, label)`` matches. The last word
+        of ``query`` is matched as a prefix; earlier words must prefix some
+        other word of the same name. Categories come before products.
+        """
+        words = [word.lower() for word in tokenize(query)]
+        if not words:
+            return []
+        prefix, others = words[-1], words[:-1]
+
+        results = []
+        with self._lock:
+            for kind in (CATEGORY, PRODUCT):
+                results += self._scan(kind, prefix, others, limit - len(results))
+        return results
+
+    def _scan(self, kind, prefix, others, limit):
+        results = []
+        seen = set()
+        entries = self.entries
+        position = bisect_left(entries, (kind, prefix))
+        end = min(len(entries), position + self.scan_limit)
+        while position < end and len(results) < limit:
+            entry_kind, token, pk = entries[position]
+            position += 1
+            if entry_kind != kind or not token.startswith(prefix):
+                break
+            if pk in seen:
+                continue
+            seen.add(pk)
+            label = self.labels.get((kind, pk))
+            if label is None:
+                continue
+            if others and not self._matches(label, others):
+                continue
+            results.append((kind, pk, label))
+        return results
+
+    @staticmethod
+    def _matches(label, words):
+        tokens = [token.lower() for token in tokenize(label)]
+        return all(any(token.startswith(word) for token in tokens) for word in words)
+
+
+def catalog_documents():
+    """Active categories, then active products newest first, as (kind, pk, label)."""
+    from .models import Category, Product
+
+    for pk, name in Category.objects.filter(is_active=True).values_list('pk', 'name').iterator():
+        yield CATEGORY, pk, name
+    products = Product.objects.filter(status=Product.Status.ACTIVE).order_by('-created_at', '-id')
+    for pk, name in products.values_list('pk', 'name').iterator(chunk_size=2000):
+        yield PRODUCT, pk, name
+
+
+def build_index():
+    started = time.perf_counter()
+    index = PrefixIndex.build(
+        catalog_documents(),
+        max_bytes=getattr(settings, 'SUGGEST_INDEX_MAX_BYTES', 96 * 1024 * 1024),
+    )
+    logger.info(
+        'Built suggestion index: %s documents, ~%s KiB in %.2fs',
+        len(index), index.size // 1024, time.perf_counter() - started
+    )
+    return index
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = threading.Event()
+# Updates made while a rebuild runs, as (method, args), to replay onto it
+_pending = None
+
+
+def get_index():
+    """Return this worker's index, building it on first use."""
+    global _index
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                _index = build_index()
+    elif time.monotonic() - _index.built_at > getattr(settings, 'SUGGEST_INDEX_REFRESH', 300):
+        _refresh_in_background()
+    return _index
+
+
+def _refresh_in_background():
+    global _pending
+    if _refreshing.is_set():
+        return
+    _refreshing.set()
+    with _index_lock:
+        _pending = []
+
+    def refresh():
+        global _index, _pending
+        try:
+            index = build_index()
+            with _index_lock:
+                for method, args in _pending:
+                    getattr(index, method)(*args)
+                _index = index
+        except Exception:
+            logger.exception('Rebuilding the suggestion index failed')
+        finally:
+            with _index_lock:
+                _pending = None
+            connection.close()
+            _refreshing.clear()
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def warm_index():
+    """Build the index now (called once per worker at startup)."""
+    if not getattr(settings, 'SUGGEST_INDEX_PRELOAD', True):
+        return
+    try:
+        get_index()
+    except DatabaseError:
+        # e.g. migrations not applied yet; the first suggestion builds it
+        logger.exception('Could not preload the suggestion index')
+
+
+def reset_index():
+    """Forget the index (used in tests)."""
+    global _index
+    _index = None
+
+
+def _update(method, *args):
+    """Apply an update to this worker's index, if it has been built."""
+    if _index is None:
+        return
+    with _index_lock:
+        if _pending is not None:
+            _pending.append((method, args))
+        getattr(_index, method)(*args)
+
+
+def update_product(product):
+    """Apply a saved product to this worker's index, if it has been built."""
+    if product.status == product.Status.ACTIVE:
+        _update('add', PRODUCT, product.pk, product.name)
+    else:
+        _update('remove', PRODUCT, product.pk)
+
+
+def update_category(category):
+    if category.is_active:
+        _update('add', CATEGORY, category.pk, category.name)
+    else:
+        _update('remove', CATEGORY, category.pk)
+
+
+def remove(kind, pk):
+    _update('remove', kind, pk)
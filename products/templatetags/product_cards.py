@@ -0,0 +1,18 @@
+from django import template
+from django.utils.safestring import mark_safe
+
+from products.cards import render_card, render_detail
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_card(product):
+    """Render the cached, user-independent part of a catalog product card."""
+    return mark_safe(render_card(product))
+
+
+@register.simple_tag
+def product_detail(product):
+    """Render the cached, user-independent body of a product detail page."""
+    return mark_safe(render_detail(product))
@@ -0,0 +1,44 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from products.images import FORMATS, derivative_name, get_widths, has_derivatives
+
+register = template.Library()
+
+
+@register.inclusion_tag('products/includes/responsive_image.html')
+def responsive_image(image, alt='', sizes='100vw', css_class='', style=''):
+    """
+    Render ``image`` (an ImageFieldFile, or a stored file name) as a
+    <picture> with WebP and JPEG srcsets once its derivatives exist, or as
+    the original until then.
+    """
+    name = getattr(image, 'name', image)
+    context = {
+        'alt': alt,
+        'sizes': sizes,
+        'css_class': css_class,
+        'style': style,
+        'src': default_storage.url(name) if name else '',
+        'sources': [],
+        'srcset': '',
+    }
+    if not name or not has_derivatives(name):
+        return context
+
+    widths = get_widths()
+
+    def srcset(extension):
+        return ', '.join(
+            f'{default_storage.url(derivative_name(name, width, extension))} {width}w'
+            for width in widths
+        )
+
+    context['sources'] = [
+        {'type': mime, 'srcset': srcset(extension)}
+        for extension, (pil_format, mime) in FORMATS.items()
+        if pil_format != 'JPEG'
+    ]
+    context['srcset'] = srcset('jpg')
+    context['src'] = default_storage.url(derivative_name(name, widths[len(widths) // 2], 'jpg'))
+    return context
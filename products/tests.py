@@ -1,3 +1,885 @@
-from django.test import TestCase
+import base64
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection, OperationalError
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
+from django.template import Context, Template
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from accounts.models import Vendor
+from sokohub.views import serve_media
+from . import cards, images, page_cache, storage, suggest
+from .categories import filter_by_category, get_category_tree
+from .facets import category_facets, refresh_category_counts
+from .search import search_products, FallbackSearchBackend, SQLITE_TABLE
+from .suggest import PrefixIndex
+from .inventory import (
+    reserve_stock, release_stock, hold_stock, release_expired_holds,
+    with_available_stock, InsufficientStock,
+)
+from .models import Category, Product, StockHold
+
+
+def make_product(name, stock, vendor=None, category=None):
+    if vendor is None:
+        user = User.objects.create_user(username=f'vendor-{name}', password='pass')
+        vendor = Vendor.objects.create(user=user, shop_name=f'Shop {name}')
+    if category is None:
+        category, _ = Category.objects.get_or_create(slug='general', defaults={'name': 'General'})
+    return Product.objects.create(
+        vendor=vendor,
+        category=category,
+        name=name,
+        price='10.00',
+        stock=stock,
+        status=Product.Status.ACTIVE
+    )
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        self.lamp = make_product('Desk lamp', 5)
+        self.lamp.description = 'Brass, with a warm bulb'
+        self.lamp.save()
+        self.bulb = make_product('Bulb', 5)
+        self.bulb.description = 'Fits any desk lamp'
+        self.bulb.save()
+
+    def search(self, query):
+        return list(search_products(Product.objects.all(), query))
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('lamp'), [self.lamp, self.bulb])
+        self.assertEqual(self.search('bul'), [self.bulb, self.lamp])
+        results = search_products(Product.objects.all(), 'lamp')
+        self.assertGreater(results[0].search_rank, results[1].search_rank)
+
+    def test_saves_and_deletes_update_the_index(self):
+        self.bulb.name = 'Filament globe'
+        self.bulb.description = ''
+        self.bulb.save()
+        self.assertEqual(self.search('bulb'), [self.lamp])
+        self.assertEqual(self.search('filament'), [self.bulb])
+        self.lamp.delete()
+        self.assertEqual(self.search('lamp'), [])
+
+    def test_rebuild_command_reindexes_every_product(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SQLITE_TABLE}')
+        self.assertEqual(self.search('lamp'), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Indexed 2 products', out.getvalue())
+        self.assertEqual(self.search('lamp'), [self.lamp, self.bulb])
+
+    def test_unranked_results_still_carry_search_rank(self):
+        results = search_products(Product.objects.all(), '!!!')
+        self.assertEqual(list(results), [])
+        self.assertIn('search_rank', results.query.annotations)
+        results = FallbackSearchBackend(connection).search(Product.objects.all(), 'lamp')
+        self.assertEqual([product.search_rank for product in results], [0.0, 0.0])
+
+
+@override_settings(PRODUCTS_PAGE_SIZE=2)
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        vendor = make_product('Oldest', 5).vendor
+        for name in ('Older', 'Newer', 'Newest'):
+            make_product(name, 5, vendor=vendor)
+
+    def get_page(self, params):
+        response = self.client.get(reverse('products:product_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['page']
+
+    def test_cursors_walk_forward_and_back(self):
+        first = self.get_page({})
+        self.assertEqual([p.name for p in first], ['Newest', 'Newer'])
+        self.assertFalse(first.has_previous)
+        second = self.get_page({'cursor': first.next_cursor})
+        self.assertEqual([p.name for p in second], ['Older', 'Oldest'])
+        self.assertFalse(second.has_next)
+        back = self.get_page({'cursor': second.previous_cursor})
+        self.assertEqual([p.name for p in back], ['Newest', 'Newer'])
+        self.assertFalse(back.has_previous)
+        self.assertEqual(back.next_cursor, first.next_cursor)
+
+    def test_invalid_or_tampered_cursor_shows_the_first_page(self):
+        def cursor(payload):
+            return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip('=')
+
+        for bad in (
+            'not-a-cursor',
+            cursor(['x', ['2024-01-01T00:00:00+00:00', 1]]),
+            cursor(['n', ['2024-01-01T00:00:00+00:00']]),
+            cursor(['n', ['yesterday', 1]]),
+            cursor(['n', [None, 'one']]),
+            cursor(['n', [{'a': 1}, 1]]),
+        ):
+            with self.subTest(cursor=bad):
+                page = self.get_page({'cursor': bad})
+                self.assertEqual([p.name for p in page], ['Newest', 'Newer'])
+
+    def test_query_without_words_is_empty_not_an_error(self):
+        for query in ('!!!', '%'):
+            with self.subTest(q=query):
+                self.assertEqual(list(self.get_page({'q': query})), [])
+        # Blank is no search at all, as in the page cache key
+        self.assertEqual([p.name for p in self.get_page({'q': '  '})], ['Newest', 'Newer'])
+
+    @override_settings(PRODUCTS_PAGE_SIZE=1)
+    def test_search_results_page_by_relevance(self):
+        older = Product.objects.get(name='Older')
+        older.description = 'Newer than the oldest'
+        older.save()
+        # The name match ranks above the description match
+        page = self.get_page({'q': 'newer'})
+        self.assertEqual([p.name for p in page], ['Newer'])
+        page = self.get_page({'q': 'newer', 'cursor': page.next_cursor})
+        self.assertEqual([p.name for p in page], ['Older'])
+        self.assertFalse(page.has_next)
+        page = self.get_page({'q': 'newer', 'cursor': page.previous_cursor})
+        self.assertEqual([p.name for p in page], ['Newer'])
+        nan = base64.urlsafe_b64encode(b'["n",[NaN,"2024-01-01T00:00:00+00:00",1]]').decode()
+        self.assertEqual([p.name for p in self.get_page({'q': 'newer', 'cursor': nan})], ['Newer'])
+
+
+class ReserveStockTests(TestCase):
+    def setUp(self):
+        self.laptop = make_product('Laptop', stock=3)
+        self.bag = make_product('Bag', stock=1)
+
+    def test_reserves_every_line(self):
+        reserve_stock({self.laptop.pk: 2, self.bag.pk: 1})
+        self.laptop.refresh_from_db()
+        self.bag.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 1)
+        self.assertEqual(self.bag.stock, 0)
+
+    def test_short_line_fails_whole_reservation(self):
+        with self.assertRaises(InsufficientStock) as raised:
+            reserve_stock({self.laptop.pk: 2, self.bag.pk: 2})
+        self.assertEqual(raised.exception.product_ids, [self.bag.pk])
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 3)
+
+    def test_release_puts_stock_back(self):
+        reserve_stock({self.laptop.pk: 3})
+        release_stock({self.laptop.pk: 3})
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 3)
+
+    def test_reduce_stock_refuses_to_oversell(self):
+        self.assertFalse(self.bag.reduce_stock(2))
+        self.assertTrue(self.bag.reduce_stock(1))
+        self.assertEqual(self.bag.stock, 0)
+
+
+class StockHoldTests(TestCase):
+    def setUp(self):
+        self.laptop = make_product('Laptop', stock=3)
+
+    def available(self, holder=None):
+        return with_available_stock(
+            Product.objects.filter(pk=self.laptop.pk), exclude_holder=holder
+        ).get().available
+
+    def test_hold_reduces_stock_available_to_others(self):
+        hold_stock('alice', {self.laptop.pk: 2})
+        self.assertEqual(self.available(), 1)
+        self.assertEqual(self.available('alice'), 3)
+        self.assertEqual(self.laptop.available_stock, 1)
+        with self.assertRaises(InsufficientStock):
+            hold_stock('bob', {self.laptop.pk: 2})
+
+    def test_holding_again_replaces_previous_holds(self):
+        hold_stock('alice', {self.laptop.pk: 2})
+        hold_stock('alice', {self.laptop.pk: 3})
+        self.assertEqual(StockHold.objects.get().quantity, 3)
+
+    def test_expired_holds_do_not_count_and_are_swept(self):
+        hold_stock('alice', {self.laptop.pk: 3}, ttl=60)
+        later = timezone.now() + timedelta(minutes=2)
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.available(), 3)
+        self.assertTrue(self.laptop.is_available)
+        self.assertEqual(release_expired_holds(now=later), 1)
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_reserve_respects_other_holds_and_consumes_own(self):
+        hold_stock('alice', {self.laptop.pk: 2})
+        with self.assertRaises(InsufficientStock):
+            reserve_stock({self.laptop.pk: 2}, holder='bob')
+        reserve_stock({self.laptop.pk: 2}, holder='alice')
+        self.laptop.refresh_from_db()
+        self.assertEqual(self.laptop.stock, 1)
+        self.assertFalse(StockHold.objects.exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductCardCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.laptop = make_product('Laptop', stock=3)
+        # Signed-in users bypass the anonymous page cache
+        user = User.objects.create_user(username='shopper', password='pass')
+        self.client.force_login(user)
+
+    def test_card_is_rendered_once_and_then_served_from_cache(self):
+        self.client.get(reverse('products:product_list'))
+        self.client.get(reverse('products:product_list'))
+        self.assertEqual(cards.get_stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    @override_settings(PRODUCTS_PAGE_SIZE=3)
+    def test_page_reads_and_counts_its_cards_in_one_go(self):
+        make_product('Phone', stock=1)
+        make_product('Tablet', stock=1)
+        self.client.get(reverse('products:product_list'))
+        self.assertEqual(cards.get_stats()['misses'], 3)
+        with mock.patch.object(cards, '_count', wraps=cards._count) as count:
+            with mock.patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+                self.client.get(reverse('products:product_list'))
+        self.assertEqual(get_many.call_count, 1)
+        self.assertEqual(count.call_count, 2)
+        self.assertEqual(cards.get_stats(), {'hits': 3, 'misses': 3, 'hit_rate': 0.5})
+
+    def test_per_user_footer_is_not_cached(self):
+        html = cards.render_card(self.laptop)
+        self.assertIn('Laptop', html)
+        self.assertNotIn('csrfmiddlewaretoken', html)
+        response = self.client.get(reverse('products:product_list'))
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_saving_product_or_vendor_invalidates_card(self):
+        cards.render_card(self.laptop)
+        self.laptop.name = 'Gaming laptop'
+        self.laptop.save()
+        self.assertIsNone(cache.get(cards.card_key(self.laptop.pk)))
+
+        cards.render_card(self.laptop)
+        self.laptop.vendor.shop_name = 'Renamed'
+        self.laptop.vendor.save()
+        self.assertIsNone(cache.get(cards.card_key(self.laptop.pk)))
+
+    def test_stock_update_without_signal_is_not_served_stale(self):
+        self.client.get(reverse('products:product_list'))
+        reserve_stock({self.laptop.pk: 3})
+        response = self.client.get(reverse('products:product_list'))
+        self.assertContains(response, 'Out of Stock')
+        self.assertEqual(cards.get_stats()['hits'], 0)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class CatalogPageCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.laptop = make_product('Laptop', stock=3)
+        self.url = reverse('products:product_list')
+
+    def test_anonymous_pages_are_cached_per_normalized_query(self):
+        self.assertEqual(self.client.get(self.url, {'q': 'Laptop'})['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, {'q': '  Laptop ', 'utm_source': 'mail'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'Laptop')
+        self.assertIn('csrftoken', response.cookies)
+
+    def test_search_case_is_part_of_the_key(self):
+        self.client.get(self.url, {'q': 'LAPTOP'})
+        response = self.client.get(self.url, {'q': 'laptop'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'value="laptop"')
+        self.assertNotContains(response, 'value="LAPTOP"')
+        response = self.client.get(self.url, {'q': ' LAPTOP'})
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertContains(response, 'value="LAPTOP"')
+
+    def test_catalog_changes_invalidate_cached_pages(self):
+        self.client.get(self.url)
+        self.laptop.name = 'Gaming laptop'
+        self.laptop.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertContains(response, 'Gaming laptop')
+
+    def test_cached_page_answers_revalidation_with_304(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_signed_in_users_and_pending_messages_bypass_cache(self):
+        self.client.get(self.url)
+        self.client.cookies['messages'] = 'pending'
+        self.assertNotIn('X-Cache', self.client.get(self.url))
+        del self.client.cookies['messages']
+        user = User.objects.create_user(username='shopper', password='pass')
+        self.client.force_login(user)
+        self.assertNotIn('X-Cache', self.client.get(self.url))
+
+    def test_only_one_request_renders_a_missing_page(self):
+        renders = []
+
+        @page_cache.cache_anonymous_page
+        def slow_view(request):
+            renders.append(1)
+            time.sleep(0.2)
+            return HttpResponse('catalog')
+
+        def visit():
+            request = RequestFactory().get('/products/')
+            request.user = AnonymousUser()
+            responses.append(slow_view(request).content)
+
+        responses = []
+        visitors = [threading.Thread(target=visit) for _ in range(5)]
+        for visitor in visitors:
+            visitor.start()
+        for visitor in visitors:
+            visitor.join()
+        self.assertEqual(len(renders), 1)
+        self.assertEqual(responses, [b'catalog'] * 5)
+
+
+class CatalogConditionalGetTests(TestCase):
+    def setUp(self):
+        self.laptop = make_product('Laptop', stock=3)
+        self.url = reverse('products:product_list')
+        # Signed-in users skip the page cache, so every request reaches the view
+        user = User.objects.create_user(username='shopper', password='pass')
+        self.client.force_login(user)
+
+    def test_unchanged_catalog_returns_304_without_rendering(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.assertTemplateNotUsed('products/product_list.html'):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_products_filters_and_holds(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertNotEqual(self.client.get(self.url, {'q': 'laptop'})['ETag'], etag)
+
+        hold_stock('alice', {self.laptop.pk: 3})
+        held = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(held.status_code, 200)
+        self.assertContains(held, 'Out of Stock')
+
+        make_product('Bag', stock=1, vendor=self.laptop.vendor)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=held['ETag'])
+        self.assertEqual(response.status_code, 200)
+
+
+class CategoryFacetTests(TestCase):
+    def setUp(self):
+        self.general = Category.objects.create(name='General', slug='general')
+        self.bags = Category.objects.create(name='Bags', slug='bags')
+        self.laptop = make_product('Laptop', stock=2)
+        self.vendor = self.laptop.vendor
+
+    def counts(self):
+        return dict(Category.objects.values_list('slug', 'active_product_count'))
+
+    def test_counts_follow_status_stock_and_category_changes(self):
+        self.assertEqual(self.counts(), {'general': 1, 'bags': 0})
+        self.laptop.category = self.bags
+        self.laptop.save()
+        self.assertEqual(self.counts(), {'general': 0, 'bags': 1})
+        self.laptop.status = Product.Status.INACTIVE
+        self.laptop.save()
+        self.assertEqual(self.counts(), {'general': 0, 'bags': 0})
+        self.laptop.status = Product.Status.ACTIVE
+        self.laptop.save()
+        self.laptop.delete()
+        self.assertEqual(self.counts(), {'general': 0, 'bags': 0})
+
+    def test_selling_out_and_restocking_update_counts(self):
+        reserve_stock({self.laptop.pk: 2})
+        self.assertEqual(self.counts()['general'], 0)
+        release_stock({self.laptop.pk: 1})
+        self.assertEqual(self.counts()['general'], 1)
+        self.assertTrue(Product.objects.get(pk=self.laptop.pk).reduce_stock(1))
+        self.assertEqual(self.counts()['general'], 0)
+
+    def test_refresh_repairs_drift(self):
+        Category.objects.update(active_product_count=7)
+        refresh_category_counts()
+        self.assertEqual(self.counts(), {'general': 1, 'bags': 0})
+
+    def test_facets_hide_empty_categories_and_follow_search(self):
+        make_product('Laptop bag', stock=1, vendor=self.vendor, category=self.bags)
+        make_product('Backpack', stock=1, vendor=self.vendor, category=self.bags)
+        facets = {c.slug: c.facet_count for c in category_facets()}
+        self.assertEqual(facets, {'general': 1, 'bags': 2})
+
+        results = search_products(Product.objects.filter(status=Product.Status.ACTIVE), 'laptop')
+        # The category tree comes from the cache; only the counts are queried
+        with self.assertNumQueries(1):
+            facets = {c.slug: c.facet_count for c in category_facets(results)}
+        self.assertEqual(facets, {'general': 1, 'bags': 1})
+
+        self.laptop.stock = 0
+        self.laptop.save()
+        self.assertEqual([c.slug for c in category_facets()], ['bags'])
+
+
+class CategoryTreeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.electronics = Category.objects.create(name='Electronics', slug='electronics')
+        self.phones = Category.objects.create(name='Phones', slug='phones', parent=self.electronics)
+        self.android = Category.objects.create(name='Android', slug='android', parent=self.phones)
+        self.garden = Category.objects.create(name='Garden', slug='garden')
+
+    def test_paths_follow_the_tree_and_moves(self):
+        e, p, a = self.electronics.pk, self.phones.pk, self.android.pk
+        self.assertEqual(self.android.path, f'{e}/{p}/{a}/')
+        self.phones.parent = self.garden
+        self.phones.save()
+        self.android.refresh_from_db()
+        self.assertEqual(self.android.path, f'{self.garden.pk}/{p}/{a}/')
+        self.garden.parent = self.android
+        with self.assertRaises(ValueError):
+            self.garden.save()
+
+    def test_catalog_filter_includes_subcategories(self):
+        phone = make_product('Phone', stock=1, category=self.android)
+        make_product('Rake', stock=1, vendor=phone.vendor, category=self.garden)
+        response = self.client.get(reverse('products:product_list'), {'category': self.electronics.pk})
+        self.assertEqual([p.name for p in response.context['products']], ['Phone'])
+        facets = {c.slug: c.facet_count for c in category_facets()}
+        self.assertEqual(facets, {'electronics': 1, 'phones': 1, 'android': 1, 'garden': 1})
+
+    def test_category_filter_uses_subtree_ids_without_a_join(self):
+        phone = make_product('Phone', stock=1, category=self.android)
+        self.android.is_active = False
+        self.android.save()
+        node = get_category_tree().get(self.electronics.pk)
+        self.assertEqual(
+            sorted(node.subtree_ids), sorted([self.electronics.pk, self.phones.pk, self.android.pk])
+        )
+        products = filter_by_category(Product.objects.all(), self.phones.pk)
+        # Products of an inactive subcategory still count, with no category join
+        self.assertEqual(list(products), [phone])
+        self.assertNotIn('products_category', str(products.query))
+
+    def test_tree_is_cached_until_a_category_changes(self):
+        self.assertEqual([c.slug for c in get_category_tree()], ['electronics', 'phones', 'android', 'garden'])
+        with self.assertNumQueries(0):
+            get_category_tree()
+        self.android.is_active = False
+        self.android.save()
+        self.assertEqual([c.depth for c in get_category_tree()], [0, 1, 0])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ProductDetailTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lamp = make_product('Lamp', stock=2)
+            self.desk = make_product('Desk', stock=1, vendor=self.lamp.vendor)
+        self.url = reverse('products:product_detail', args=[self.lamp.pk])
+        user = User.objects.create_user(username='shopper', password='pass')
+        self.client.force_login(user)
+
+    def test_page_shows_product_and_more_from_vendor(self):
+        response = self.client.get(self.url)
+        self.assertContains(response, 'Lamp')
+        self.assertEqual([row['name'] for row in response.context['more_from_vendor']], ['Desk'])
+        self.assertContains(response, reverse('products:product_detail', args=[self.desk.pk]))
+
+    def test_read_path_is_product_query_plus_cache(self):
+        self.client.get(self.url)
+        # Session, user, the ETag aggregate and the product itself; the body
+        # and the vendor's other products come from the cache
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_conditional_get_and_vendor_list_refresh(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            chair = make_product('Chair', stock=1, vendor=self.lamp.vendor)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['more_from_vendor'][0]['id'], chair.pk)
+
+    def test_inactive_product_is_not_found(self):
+        self.lamp.status = Product.Status.INACTIVE
+        self.lamp.save()
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+class PrefixIndexTests(TestCase):
+    def setUp(self):
+        self.index = PrefixIndex.build([
+            (suggest.CATEGORY, 1, 'Laptops'),
+            (suggest.PRODUCT, 1, 'Gaming Laptop'),
+            (suggest.PRODUCT, 2, 'Laptop Bag'),
+            (suggest.PRODUCT, 3, 'Leather Wallet'),
+        ])
+
+    def test_prefix_matches_any_word_and_categories_come_first(self):
+        self.assertEqual(self.index.suggest('lap'), [
+            (suggest.CATEGORY, 1, 'Laptops'),
+            (suggest.PRODUCT, 1, 'Gaming Laptop'),
+            (suggest.PRODUCT, 2, 'Laptop Bag'),
+        ])
+        self.assertEqual(self.index.suggest('gam lap'), [(suggest.PRODUCT, 1, 'Gaming Laptop')])
+        self.assertEqual(self.index.suggest('lap', limit=1), [(suggest.CATEGORY, 1, 'Laptops')])
+        self.assertEqual(self.index.suggest('  '), [])
+
+    def test_add_and_remove_keep_entries_sorted(self):
+        self.index.add(suggest.PRODUCT, 3, 'Laptop Stand')
+        self.index.remove(suggest.PRODUCT, 2)
+        self.assertEqual(self.index.entries, sorted(self.index.entries))
+        self.assertEqual(
+            [label for _, _, label in self.index.suggest('lapt')],
+            ['Laptops', 'Gaming Laptop', 'Laptop Stand']
+        )
+        self.assertEqual(self.index.suggest('leather'), [])
+
+    def test_memory_budget_leaves_out_later_documents(self):
+        index = PrefixIndex.build(
+            [(suggest.PRODUCT, pk, f'Product {pk}') for pk in range(100)],
+            max_bytes=2000
+        )
+        self.assertTrue(index.truncated)
+        self.assertLessEqual(index.size, 2000)
+        self.assertIn((suggest.PRODUCT, 0), index.labels)
+
+
+class ProductSuggestViewTests(TestCase):
+    def setUp(self):
+        suggest.reset_index()
+        self.addCleanup(suggest.reset_index)
+        self.laptop = make_product('Gaming Laptop', stock=1)
+
+    def test_suggestions_come_from_memory(self):
+        self.client.get(reverse('products:product_suggest'), {'q': 'x'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('products:product_suggest'), {'q': 'gam'})
+        self.assertEqual(response.json()['suggestions'], [{
+            'type': 'product',
+            'id': self.laptop.pk,
+            'label': 'Gaming Laptop',
+            'url': '/products/?q=Gaming+Laptop',
+        }])
+
+    def test_saved_products_update_the_index(self):
+        suggest.get_index()
+        self.laptop.name = 'Office Laptop'
+        self.laptop.save()
+        make_product('Gaming Mouse', stock=1, vendor=self.laptop.vendor)
+        labels = [label for _, _, label in suggest.get_index().suggest('gam')]
+        self.assertEqual(labels, ['Gaming Mouse'])
+        self.laptop.status = Product.Status.INACTIVE
+        self.laptop.save()
+        self.assertEqual(suggest.get_index().suggest('office'), [])
+
+
+    def test_changes_during_a_rebuild_are_replayed_onto_it(self):
+        suggest.get_index()
+        stale = suggest.build_index()
+
+        def build_index():
+            # Saved while the rebuild was reading the catalog
+            self.laptop.name = 'Office Laptop'
+            self.laptop.save()
+            return stale
+
+        def thread(target, daemon):
+            return mock.Mock(start=target)
+
+        with mock.patch.object(suggest, 'build_index', build_index), \
+                mock.patch.object(suggest.threading, 'Thread', thread), \
+                mock.patch.object(suggest, 'connection'):
+            suggest._refresh_in_background()
+        self.assertIs(suggest.get_index(), stale)
+        labels = [label for _, _, label in stale.suggest('office')]
+        self.assertEqual(labels, ['Office Laptop'])
+
+
+class CatalogSortAndFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.cheap = make_product('Cheap', stock=1)
+        vendor = self.cheap.vendor
+        self.mid = make_product('Mid', stock=0, vendor=vendor)
+        self.dear = make_product('Dear', stock=1, vendor=vendor)
+        Product.objects.filter(pk=self.cheap.pk).update(price='5.00')
+        Product.objects.filter(pk=self.mid.pk).update(price='20.00')
+        Product.objects.filter(pk=self.dear.pk).update(price='50.00')
+
+    def names(self, **params):
+        response = self.client.get(reverse('products:product_list'), params)
+        return [product.name for product in response.context['products']]
+
+    def test_sorts_by_price_and_newest(self):
+        self.assertEqual(self.names(sort='price_asc'), ['Cheap', 'Mid', 'Dear'])
+        self.assertEqual(self.names(sort='price_desc'), ['Dear', 'Mid', 'Cheap'])
+        self.assertEqual(self.names(sort='newest'), ['Dear', 'Mid', 'Cheap'])
+
+    def test_filters_by_price_range_and_stock(self):
+        self.assertEqual(self.names(min_price='10', max_price='30'), ['Mid'])
+        self.assertEqual(self.names(in_stock='1', sort='price_asc'), ['Cheap', 'Dear'])
+        # Stock held by a checkout in progress is not in stock for others
+        hold_stock('alice', {self.cheap.pk: 1})
+        cache.clear()  # Holds do not retire cached anonymous pages
+        self.assertEqual(self.names(in_stock='1', sort='price_asc'), ['Dear'])
+        # Invalid bounds are ignored rather than failing the page
+        self.assertEqual(len(self.names(min_price='abc', max_price='-1')), 3)
+
+    @override_settings(PRODUCTS_PAGE_SIZE=2)
+    def test_price_sort_paginates_with_cursors(self):
+        response = self.client.get(reverse('products:product_list'), {'sort': 'price_desc'})
+        page = response.context['page']
+        self.assertEqual([p.name for p in page], ['Dear', 'Mid'])
+        response = self.client.get(
+            reverse('products:product_list'), {'sort': 'price_desc', 'cursor': page.next_cursor}
+        )
+        self.assertEqual([p.name for p in response.context['page']], ['Cheap'])
+
+    def test_non_finite_price_cursors_fall_back_to_the_first_page(self):
+        for price in ('NaN', 'Infinity', '-Infinity', 'abc'):
+            payload = json.dumps(['n', [price, self.mid.pk]]).encode()
+            cursor = base64.urlsafe_b64encode(payload).decode()
+            response = self.client.get(
+                reverse('products:product_list'), {'sort': 'price_desc', 'cursor': cursor}
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [p.name for p in response.context['page']], ['Dear', 'Mid', 'Cheap'], price
+            )
+
+
+def make_image_upload(name='photo.png', size=(1000, 600)):
+    buffer = BytesIO()
+    Image.new('RGBA', size, (200, 30, 30, 255)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(
+    IMAGE_DERIVATIVES_ASYNC=False,
+    IMAGE_DERIVATIVE_WIDTHS=(200, 400),
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+)
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        cache.clear()
+        self.product = make_product('Lamp', stock=1)
+
+    def upload(self):
+        self.product.image = make_image_upload()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        return self.product.image.name
+
+    def test_upload_generates_webp_and_jpeg_widths(self):
+        name = self.upload()
+        self.assertTrue(images.has_derivatives(name))
+        for width in (200, 400):
+            for extension in ('webp', 'jpg'):
+                with default_storage.open(images.derivative_name(name, width, extension)) as f:
+                    self.assertEqual(Image.open(f).width, width)
+
+    def test_missing_derivatives_are_remembered_briefly(self):
+        self.product.image = make_image_upload()
+        self.product.save()  # on_commit never runs inside the test transaction
+        name = self.product.image.name
+        self.assertFalse(images.has_derivatives(name))
+        with mock.patch.object(images.default_storage, 'exists') as exists:
+            self.assertFalse(images.has_derivatives(name))
+        exists.assert_not_called()
+        images.generate_derivatives(name)
+        self.assertTrue(images.has_derivatives(name))
+
+    def test_failed_image_is_not_resubmitted_on_save(self):
+        self.product.image = SimpleUploadedFile('broken.png', b'not an image', content_type='image/png')
+        with self.assertRaises(Exception):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+        self.assertTrue(images.has_failed(self.product.image.name))
+        with mock.patch.object(images, 'schedule_derivatives') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+        schedule.assert_not_called()
+
+    def test_new_quality_writes_new_names(self):
+        name = self.upload()
+        first = images.derivative_name(name, 200, 'jpg')
+        with default_storage.open(first) as f:
+            original = f.read()
+        with override_settings(IMAGE_DERIVATIVE_QUALITY=50):
+            self.assertFalse(images.has_derivatives(name))
+            images.generate_derivatives(name)
+            self.assertNotEqual(images.derivative_name(name, 200, 'jpg'), first)
+        with default_storage.open(first) as f:
+            self.assertEqual(f.read(), original)
+
+        images.delete_derivatives(name)
+        self.assertFalse(default_storage.exists(first))
+        with override_settings(IMAGE_DERIVATIVE_QUALITY=50):
+            self.assertFalse(default_storage.exists(images.derivative_name(name, 200, 'jpg')))
+
+    def test_responsive_image_renders_srcset_once_ready(self):
+        template = Template('{% load product_images %}{% responsive_image image alt="Lamp" sizes="80px" %}')
+        self.product.image = make_image_upload()
+        self.product.save()  # on_commit never runs inside the test transaction
+        html = template.render(Context({'image': self.product.image}))
+        self.assertNotIn('srcset', html)
+        self.assertIn(self.product.image.url, html)
+
+        images.generate_derivatives(self.product.image.name)
+        html = template.render(Context({'image': self.product.image}))
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('-200w-q80.jpg 200w', html)
+        self.assertIn('sizes="80px"', html)
+
+    def test_backfill_command_covers_existing_images(self):
+        self.product.image = make_image_upload()
+        self.product.save()
+        call_command('generate_image_derivatives', '--sync', stdout=StringIO())
+        self.assertTrue(images.has_derivatives(self.product.image.name))
+
+
+@override_settings(IMAGE_DERIVATIVES_ASYNC=False, IMAGE_DERIVATIVE_WIDTHS=(200,))
+class ContentAddressedStorageTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        override = override_settings(MEDIA_ROOT=media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.first = make_product('First', stock=1)
+        self.second = make_product('Second', stock=1, vendor=self.first.vendor)
+
+    def test_identical_uploads_share_one_file(self):
+        self.first.image = make_image_upload('first.PNG')
+        self.first.save()
+        self.second.image = make_image_upload('other-name.png')
+        self.second.save()
+        self.assertEqual(self.first.image.name, self.second.image.name)
+        self.assertRegex(self.first.image.name, r'^cas/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+        directory = self.first.image.name.rsplit('/', 1)[0]
+        self.assertEqual(len(storage.content_storage.listdir(directory)[1]), 1)
+
+    def test_reusing_a_stored_file_restarts_its_grace_period(self):
+        self.first.image = make_image_upload('first.png')
+        self.first.save()
+        name = self.first.image.name
+        path = storage.content_storage.path(name)
+        os.utime(path, (0, 0))
+        self.second.image = make_image_upload('second.png')
+        self.second.save()
+        self.assertGreater(os.path.getmtime(path), 0)
+
+    def test_gc_removes_only_unreferenced_files_and_derivatives(self):
+        self.first.image = make_image_upload(size=(300, 300))
+        self.first.save()
+        kept = self.first.image.name
+        self.second.image = make_image_upload(size=(500, 300))
+        self.second.save()
+        orphan = self.second.image.name
+        images.generate_derivatives(orphan)
+        self.second.image = None
+        self.second.save()
+
+        with override_settings(MEDIA_GC_GRACE=0):
+            call_command('gc_media', stdout=StringIO())
+        self.assertTrue(storage.content_storage.exists(kept))
+        self.assertFalse(storage.content_storage.exists(orphan))
+        self.assertFalse(default_storage.exists(images.derivative_name(orphan, 200, 'jpg')))
+
+    def test_content_addressed_media_is_served_immutable(self):
+        self.first.image = make_image_upload()
+        self.first.save()
+        request = RequestFactory().get(self.first.image.url)
+        response = serve_media(request, self.first.image.name, document_root=settings.MEDIA_ROOT)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+
+
+class ReserveStockConcurrencyTests(TransactionTestCase):
+    """Many buyers racing for the same products must never oversell."""
+
+    BUYERS = 20
+    STOCK = 10
+
+    def setUp(self):
+        self.laptop = make_product('Laptop', stock=self.STOCK)
+        self.bag = make_product('Bag', stock=self.STOCK)
+
+    def test_concurrent_checkouts_never_oversell(self):
+        start = threading.Barrier(self.BUYERS)
+        sold = []
+        refused = []
+        exhausted = []
+
+        def buy(order):
+            try:
+                start.wait()
+                for attempt in range(50):
+                    try:
+                        reserve_stock(order)
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting
+                        time.sleep(0.01)
+                        continue
+                    except InsufficientStock:
+                        refused.append(order)
+                    else:
+                        sold.append(order)
+                    break
+                else:
+                    exhausted.append(order)
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(
+                target=buy,
+                args=({self.laptop.pk: 2, self.bag.pk: 1} if i % 2 else {self.bag.pk: 1, self.laptop.pk: 2},)
+            )
+            for i in range(self.BUYERS)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.laptop.refresh_from_db()
+        self.bag.refresh_from_db()
+        self.assertEqual(exhausted, [])
+        self.assertEqual(len(sold) + len(refused), self.BUYERS)
+        self.assertEqual(len(sold), self.STOCK // 2)
+        self.assertEqual(self.laptop.stock, self.STOCK - 2 * len(sold))
+        self.assertEqual(self.bag.stock, self.STOCK - len(sold))
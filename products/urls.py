@@ -5,4 +5,6 @@ app_name = 'products'
 
 urlpatterns = [
     path('', views.product_list, name='product_list'),
+    path('<int:pk>/', views.product_detail, name='product_detail'),
+    path('suggest/', views.product_suggest, name='product_suggest'),
 ]
\ No newline at end of file
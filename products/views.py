@@ -1,35 +1,227 @@
-from django.shortcuts import render
-from django.db.models import Q
-from .models import Product, Category
+from decimal import Decimal, InvalidOperation
 
+from django.conf import settings
+from django.db.models import Count, Max, OuterRef, Q
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
+from django.utils.http import urlencode
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_GET
+from .models import Product
+from .cards import render_cards
+from .categories import filter_by_category, get_category_tree
+from .facets import category_facets
+from .pagination import KeysetPaginator, InvalidCursor
+from .search import search_products
+from .inventory import held_quantity, with_available_stock
+from .page_cache import cache_anonymous_page, get_generation, normalize_query, normalize_search
+from .conditional import make_etag
+from .related import more_from_vendor
+from . import suggest
+
+
+# ?sort= options and their keyset orderings; the last key is always unique
+SORT_ORDERINGS = {
+    'newest': ['-created_at', 'id'],
+    'price_asc': ['price', 'id'],
+    'price_desc': ['-price', '-id'],
+}
+
+
+def _price_param(request, name):
+    """A non-negative Decimal from the query string, or None if missing or invalid."""
+    try:
+        value = Decimal(request.GET.get(name, '').strip())
+    except InvalidOperation:
+        return None
+    return value if value.is_finite() and value >= 0 else None
+
+
+def _catalog_products(request, filter_category=True):
+    """Active products matching the request's search, price, stock and category filters."""
+    products = Product.objects.filter(status=Product.Status.ACTIVE)
+    
+    # Get search query if provided
+    search_query = normalize_search(request.GET.get('q'))
+    if search_query:
+        # Full-text index lookup, ranked by relevance
+        products = search_products(products, search_query)
+    
+    # Price range and stock filters
+    min_price = _price_param(request, 'min_price')
+    if min_price is not None:
+        products = products.filter(price__gte=min_price)
+    max_price = _price_param(request, 'max_price')
+    if max_price is not None:
+        products = products.filter(price__lte=max_price)
+    if request.GET.get('in_stock'):
+        # In stock as the cards show it: stock left once active holds are
+        # taken off. stock > 0 narrows the rows on the index first.
+        products = products.filter(stock__gt=0).filter(stock__gt=held_quantity(OuterRef('pk')))
+    
+    # Get category filter if provided
+    category_id = request.GET.get('category')
+    if category_id and filter_category:
+        # The category and all of its subcategories, as a list of ids
+        products = filter_by_category(products, category_id)
+    return products
+
+
+def _catalog_ordering(request):
+    """Keyset ordering for the requested sort; search results default to relevance."""
+    sort = request.GET.get('sort', '')
+    if sort in SORT_ORDERINGS:
+        return sort, SORT_ORDERINGS[sort]
+    if normalize_search(request.GET.get('q')):
+        return 'relevance', ['-search_rank', '-created_at', 'id']
+    return 'newest', SORT_ORDERINGS['newest']
+
+
+def product_list_etag(request):
+    """
+    Validator for the catalog: what the products matching the search look
+    like (latest change, count, active holds) plus the normalised query and
+    the catalog generation, which covers category and vendor changes. One
+    aggregate query.
+    """
+    # Without the category filter, so changes to the other categories'
+    # facet counts are picked up too
+    state = _catalog_products(request, filter_category=False).aggregate(
+        last_modified=Max('updated_at'),
+        count=Count('pk', distinct=True),
+        active_holds=Count('holds', filter=Q(holds__expires_at__gt=timezone.now())),
+        last_hold_at=Max('holds__created_at'),
+    )
+    return make_etag(
+        request,
+        normalize_query(request.GET),
+        get_generation(),
+        *state.values()
+    )
+
+
+@cache_anonymous_page
+@condition(etag_func=product_list_etag)
 def product_list(request):
     """
     Display all active products for browsing.
     Users don't need to be logged in to browse products.
     """
-    # Filter for ACTIVE products
-    products = Product.objects.filter(status=Product.Status.ACTIVE).select_related('vendor', 'category').order_by('-created_at')
+    # Rendered as the page cache key sees it, so a cached page echoes
+    # the same query to everyone it is served to
+    search_query = normalize_search(request.GET.get('q'))
+    category_id = request.GET.get('category')
+    min_price = _price_param(request, 'min_price')
+    max_price = _price_param(request, 'max_price')
+    in_stock = bool(request.GET.get('in_stock'))
     
-    # Get categories for filtering (optional)
-    categories = Category.objects.filter(is_active=True)
+    # Active products matching the filters; stock held by checkouts in
+    # progress is not offered to other shoppers
+    products = with_available_stock(_catalog_products(request)).select_related('vendor', 'category')
+    # Every ordering is served by a (status, [category,] key, id) index
+    sort, ordering = _catalog_ordering(request)
     
-    # Get search query if provided
-    search_query = request.GET.get('q', '')
-    if search_query:
-        products = products.filter(
-            Q(name__icontains=search_query) | 
-            Q(description__icontains=search_query)
-        )
+    # Categories with their product counts; the stored counts cover the
+    # unfiltered catalog, otherwise they are grouped from the filtered
+    # products in one query
+    filtered = search_query or min_price is not None or max_price is not None or in_stock
+    categories = category_facets(
+        _catalog_products(request, filter_category=False) if filtered else None
+    )
     
-    # Get category filter if provided
-    category_id = request.GET.get('category')
-    if category_id:
-        products = products.filter(category_id=category_id)
+    # Keyset pagination: no OFFSET and no COUNT, so deep pages cost the same as page 1
+    paginator = KeysetPaginator(
+        products,
+        ordering,
+        getattr(settings, 'PRODUCTS_PAGE_SIZE', 24)
+    )
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor:
+        page = paginator.page()
+    
+    # Keep the current filters on the next/previous links
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    if search_query:
+        query['q'] = search_query
     
     context = {
-        'products': products,
+        'products': page,
+        'product_cards': list(zip(page, map(mark_safe, render_cards(page)))),
+        'page': page,
         'categories': categories,
         'search_query': search_query,
         'selected_category': category_id,
+        'sort': sort,
+        'min_price': min_price,
+        'max_price': max_price,
+        'in_stock': in_stock,
+        'filter_query': query.urlencode(),
     }
-    return render(request, 'products/product_list.html', context)
\ No newline at end of file
+    return render(request, 'products/product_list.html', context)
+
+
+def product_detail_etag(request, pk):
+    """
+    Validator for a product page: the product's last change and its active
+    holds, plus the catalog generation, which moves whenever any product,
+    category or vendor changes (so the vendor's other products too).
+    """
+    state = Product.objects.filter(pk=pk, status=Product.Status.ACTIVE).aggregate(
+        last_modified=Max('updated_at'),
+        active_holds=Count('holds', filter=Q(holds__expires_at__gt=timezone.now())),
+        last_hold_at=Max('holds__created_at'),
+    )
+    return make_etag(request, get_generation(), *state.values())
+
+
+@cache_anonymous_page
+@condition(etag_func=product_detail_etag)
+def product_detail(request, pk):
+    """
+    Display one active product. The product, its vendor and category come
+    from one query; the page body is a cached fragment (products.cards) and
+    the vendor's other products a precomputed list (products.related).
+    """
+    product = get_object_or_404(
+        with_available_stock(Product.objects.filter(status=Product.Status.ACTIVE))
+        .select_related('vendor', 'category'),
+        pk=pk
+    )
+    
+    context = {
+        'product': product,
+        'breadcrumbs': get_category_tree().lineage(product.category_id),
+        'more_from_vendor': more_from_vendor(product),
+    }
+    return render(request, 'products/product_detail.html', context)
+
+
+@require_GET
+@cache_control(public=True, max_age=getattr(settings, 'SUGGEST_MAX_AGE', 60))
+def product_suggest(request):
+    """Typeahead suggestions from the in-memory prefix index (no database access)."""
+    query = request.GET.get('q', '')[:100]
+    try:
+        limit = min(int(request.GET.get('limit', 8)), 20)
+    except ValueError:
+        limit = 8
+    
+    catalog_url = reverse('products:product_list')
+    suggestions = []
+    for kind, pk, label in suggest.get_index().suggest(query, max(limit, 1)):
+        if kind == suggest.CATEGORY:
+            params = {'category': pk}
+        else:
+            params = {'q': label}
+        suggestions.append({
+            'type': suggest.KIND_NAMES[kind],
+            'id': pk,
+            'label': label,
+            'url': f'{catalog_url}?{urlencode(params)}',
+        })
+    return JsonResponse({'query': query, 'suggestions': suggestions})
@@ -16,6 +16,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'products.context_processors.category_tree',
             ],
         },
     },
@@ -29,6 +30,60 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60  # Browser/CDN lifetime of content-addressed media (see products.storage)
+MEDIA_GC_GRACE = 24 * 60 * 60  # Seconds before an unreferenced upload may be removed by gc_media
+
+# Cache
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at a shared
+# backend (e.g. django.core.cache.backends.redis.RedisCache and a redis://
+# URL, or FileBasedCache and a directory) so all workers share one cache.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'sokohub'),
+        'TIMEOUT': 300,
+    }
+}
+
+# Catalog
+PRODUCTS_PAGE_SIZE = 24  # Products per page on the public catalog
+PRODUCT_CARD_CACHE = 'default'  # Cache alias holding rendered product cards
+PRODUCT_CARD_CACHE_TIMEOUT = 24 * 60 * 60
+CATALOG_PAGE_CACHE = 'default'  # Cache alias for anonymous catalog pages
+CATALOG_PAGE_CACHE_TIMEOUT = 60  # Also bounds how stale a stock badge can get
+CATALOG_PAGE_CACHE_LOCK_TIMEOUT = 10  # Seconds one request may spend rendering a missing page
+CATALOG_PAGE_CACHE_WAIT = 2  # Seconds other requests wait for that render
+CATEGORY_TREE_CACHE_TIMEOUT = 60 * 60  # Also dropped on every category change
+VENDOR_PRODUCTS_LIST_SIZE = 12  # Products kept in each vendor's precomputed "more from this vendor" list
+SUGGEST_INDEX_MAX_BYTES = 96 * 1024 * 1024  # Per-worker typeahead index budget (~61 MiB for 100k products)
+SUGGEST_INDEX_REFRESH = 5 * 60  # Seconds before a worker rebuilds it to pick up other workers' changes
+SUGGEST_INDEX_PRELOAD = True  # Build the index when the worker starts
+SUGGEST_MAX_AGE = 60  # Seconds browsers may reuse a suggestion response
+IMAGE_DERIVATIVE_WIDTHS = (200, 400, 800)  # Pixel widths of the resized product images and logos
+IMAGE_DERIVATIVE_QUALITY = 80  # WebP/JPEG encoder quality
+IMAGE_DERIVATIVE_WORKERS = 2  # Processes per worker resizing uploads
+IMAGE_DERIVATIVES_ASYNC = True  # False resizes inline during the request (tests)
+IMAGE_DERIVATIVE_MISSING_CACHE_TIMEOUT = 60  # Seconds an image is remembered as not resized yet
+IMAGE_DERIVATIVE_FAILED_CACHE_TIMEOUT = 24 * 60 * 60  # Seconds a failed resize is not retried on save
+
+# Orders
+STOCK_HOLD_TTL = 10 * 60  # Seconds a checkout holds its cart's stock before payment
+
+# Vendors
+VENDOR_DASHBOARD_CACHE_TIMEOUT = 5 * 60  # Also bounds how stale the dashboard's stock counts can get
+EXPORT_CHUNK_SIZE = 2000  # Rows fetched per round trip by the streaming CSV exports
+
+# Payments
+# Use 'orders.payments.FakeGateway' for local development and load tests
+PAYMENT_GATEWAY = os.environ.get('PAYMENT_GATEWAY', 'orders.payments.StripeGateway')
+PAYMENT_GATEWAY_OPTIONS = {
+    'connect_timeout': 3.05,  # Seconds to establish the connection
+    'read_timeout': 15,       # Seconds to wait for the provider's response
+    'retries': 2,             # Extra attempts for timeouts, 429s and 5xx errors
+    'failure_threshold': 5,   # Consecutive failures before the circuit opens
+    'reset_timeout': 30,      # Seconds before a trial call is let through
+}
+STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET', '')
 
 # ==========================================
 # CRITICAL FIX FOR LOGIN/LOGOUT ERRORS
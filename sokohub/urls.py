@@ -7,7 +7,7 @@ from django.http import HttpResponse
 from accounts import views as account_views
 
 # Import the debug_templates view
-from sokohub.views import debug_templates
+from sokohub.views import debug_templates, serve_media
 
 def test_view(request):
     return HttpResponse("Test page")
@@ -42,4 +42,4 @@ urlpatterns = [
 # Serving static + media in development
 if settings.DEBUG:
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL, serve_media, document_root=settings.MEDIA_ROOT)
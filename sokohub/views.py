@@ -1,10 +1,25 @@
 # sokohub/views.py
 from django.conf import settings
 from django.shortcuts import render
+from django.views.static import serve
 from django.contrib.admin.views.decorators import staff_member_required  # optional protection
 
+from products.storage import immutable_cache_control, is_content_addressed
+
 @staff_member_required  # only staff/admin can view
 def debug_templates(request):
     # settings.TEMPLATES is a list of template engine configs (each has 'DIRS')
     template_dirs = settings.TEMPLATES
     return render(request, 'debug_templates.html', {'template_dirs': template_dirs})
+
+
+def serve_media(request, path, document_root=None):
+    """
+    Development media server. Content-addressed files never change, so
+    they are marked immutable; production web servers should send the same
+    Cache-Control for MEDIA_URL + 'cas/' and 'derivatives/cas/'.
+    """
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200 and is_content_addressed(path):
+        response['Cache-Control'] = immutable_cache_control()
+    return response
@@ -10,18 +10,22 @@ document.addEventListener('DOMContentLoaded', function() {
         form.addEventListener('submit', function(e) {
             e.preventDefault();
             const formData = new FormData(this);
+            // Catalog pages may come from the shared page cache, so the token
+            // in the form can belong to another visitor; use our own cookie.
+            const csrfToken = getCookie('csrftoken') || formData.get('csrfmiddlewaretoken');
+            formData.set('csrfmiddlewaretoken', csrfToken);
             
             fetch(this.action, {
                 method: 'POST',
                 body: formData,
                 headers: {
-                    'X-CSRFToken': formData.get('csrfmiddlewaretoken')
+                    'X-CSRFToken': csrfToken
                 }
             })
             .then(response => response.json())
             .then(data => {
                 if (data.success) {
-                    updateCartCount();
+                    renderCartCount(data.cart);
                     showNotification(data.message, 'success');
                 } else {
                     showNotification(data.message, 'error');
@@ -35,23 +39,32 @@ document.addEventListener('DOMContentLoaded', function() {
     });
 });
 
-// Update cart count
+// Read a cookie value by name
+function getCookie(name) {
+    const match = document.cookie.match(new RegExp('(?:^|; )' + name + '=([^;]*)'));
+    return match ? decodeURIComponent(match[1]) : null;
+}
+
+// Update cart count from the lightweight JSON summary
 function updateCartCount() {
-    fetch('/orders/cart/')
-        .then(response => response.text())
-        .then(html => {
-            const parser = new DOMParser();
-            const doc = parser.parseFromString(html, 'text/html');
-            const itemCount = doc.querySelectorAll('tbody tr').length;
-            const cartCountEl = document.getElementById('cart-count');
-            if (cartCountEl) {
-                cartCountEl.textContent = itemCount;
-                cartCountEl.style.display = itemCount > 0 ? 'flex' : 'none';
-            }
-        })
+    fetch('/orders/cart/summary/', {
+        credentials: 'same-origin',
+        headers: { 'Accept': 'application/json' }
+    })
+        .then(response => response.json())
+        .then(renderCartCount)
         .catch(error => console.error('Error updating cart count:', error));
 }
 
+// Render a cart summary ({count, total}) into the navbar badge
+function renderCartCount(cart) {
+    const cartCountEl = document.getElementById('cart-count');
+    if (cartCountEl && cart) {
+        cartCountEl.textContent = cart.count;
+        cartCountEl.style.display = cart.count > 0 ? 'flex' : 'none';
+    }
+}
+
 // Show notification
 function showNotification(message, type) {
     const alertClass = type === 'success' ? 'alert-success' : 'alert-danger';